@@ -1,9 +1,13 @@
 #!/usr/bin/env python3
+import hashlib
 import json
 import logging
+import os
 import re
+import sqlite3
 import sys
 import time
+from pathlib import Path
 from concurrent.futures.thread import ThreadPoolExecutor
 from copy import deepcopy
 from threading import Lock
@@ -21,6 +25,13 @@ logging.basicConfig(
 V37 = "37"
 V38 = "38"
 
+VERSION_TO_SERVER = {V37: "https://grch37.rest.ensembl.org", V38: "https://rest.ensembl.org"}
+RELEASE_ENDPOINT = "/info/data"
+SERVER_VARIABLE = "ENSEMBL_REST_SERVER"  # overrides the server, for instance to test against a local stub server
+CACHE_PATH_VARIABLE = "ENSEMBL_REST_CACHE"  # path of the response cache, which is only used if this is set
+DEFAULT_CACHE_MAX_AGE_SECONDS = 30 * 24 * 60 * 60
+MAX_POST_BATCH_SIZE = 1000  # limit of the Ensembl POST endpoints
+
 class StringCollector(object):
     def __init__(self):
         self.strings = []
@@ -32,17 +43,120 @@ class StringCollector(object):
         self.strings.append(string)
 
 
+class ResponseCache(object):
+    """
+    On-disk cache of JSON responses, shared between runs and servers.
+    Responses are stored per server and release, and expire after a maximum age.
+    Responses of the server for other releases are removed when the cache is opened for a server and release.
+    """
+    SCHEMA_VERSION = 1
+
+    def __init__(self, path, server, release, max_age_seconds=DEFAULT_CACHE_MAX_AGE_SECONDS):
+        self.path = path
+        self.server = server
+        self.release = release
+        self.max_age_seconds = max_age_seconds
+        self._lock = Lock()
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        # A single connection is shared between the threads of the client, so access is serialized by the lock
+        self._connection = sqlite3.connect(str(path), check_same_thread=False)
+        with self._lock, self._connection:
+            if self._connection.execute("PRAGMA user_version").fetchone()[0] != self.SCHEMA_VERSION:
+                self._connection.execute("DROP TABLE IF EXISTS responses")
+                self._connection.execute("PRAGMA user_version = {0}".format(self.SCHEMA_VERSION))
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, url TEXT NOT NULL, server TEXT NOT NULL, "
+                "release TEXT NOT NULL, created REAL NOT NULL, data TEXT)"
+            )
+            self._connection.execute("DELETE FROM responses WHERE server = ? AND release != ?", (server, release))
+            self._connection.execute("DELETE FROM responses WHERE created < ?", (time.time() - max_age_seconds,))
+
+    def get(self, request):
+        # Returns None for responses that are not in the cache
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT data FROM responses WHERE key = ? AND server = ? AND release = ? AND created >= ?",
+                (self._get_key(request), self.server, self.release, time.time() - self.max_age_seconds),
+            ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def put(self, request, data):
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (key, url, server, release, created, data) VALUES (?, ?, ?, ?, ?, ?)",
+                (self._get_key(request), request, self.server, self.release, time.time(), json.dumps(data)),
+            )
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    @staticmethod
+    def _get_key(request):
+        return hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+
 class BaseRestClient(object):
-    def __init__(self, server, reqs_per_sec, max_wait_time=30):
+    def __init__(self, server, reqs_per_sec, max_wait_time=30, cache_path=None, release_endpoint=None):
         self.server = server
         self.reqs_per_sec = reqs_per_sec
         self.max_wait_time = max_wait_time
+        self.cache_path = cache_path
+        self.release_endpoint = release_endpoint
         self._req_count = 0
         self._last_req = 0
         self._wait_lock = Lock()
         self._wait_time_owed = 0
+        self._cache = None
+        self._cache_lock = Lock()
+
+    def perform_rest_action(self, endpoint, headers=None, params=None, body=None):
+        # Responses are cached by endpoint, params and body, so cache hits don't count towards the rate limit.
+        # Requests with a body are sent as POST requests.
+        request_url = self._get_request_url(endpoint, params)
+        if body is None:
+            cache_request = request_url
+        else:
+            cache_request = "POST " + request_url + " " + json.dumps(body, sort_keys=True)
+        cache = self._get_cache()
+        if cache is not None:
+            data = cache.get(cache_request)
+            if data is not None:
+                logging.debug("Use cached response for url: {request_url}".format(request_url=request_url))
+                return data
+
+        data = self._perform_request(endpoint, headers, params, body)
+
+        if cache is not None and data is not None:
+            cache.put(cache_request, data)
+        return data
 
-    def perform_rest_action(self, endpoint, headers=None, params=None):
+    def _get_cache(self):
+        if self.cache_path is None:
+            return None
+        with self._cache_lock:
+            if self._cache is None:
+                release = self._request_release()
+                logging.info("Use response cache {path} for release {release}".format(
+                    path=self.cache_path, release=release))
+                self._cache = ResponseCache(self.cache_path, self.server, release)
+        return self._cache
+
+    def _request_release(self):
+        # Without a release endpoint, cached responses are only invalidated by their age
+        if self.release_endpoint is None:
+            return ""
+        answer = self._perform_request(self.release_endpoint)
+        return ",".join(str(release) for release in answer["releases"])
+
+    def _get_request_url(self, endpoint, params):
+        if params:
+            return self.server + endpoint + '?' + urlencode(params)
+        else:
+            return self.server + endpoint
+
+    def _perform_request(self, endpoint, headers=None, params=None, body=None):
         self._wait_lock.acquire()
         self._do_rate_limiting()
 
@@ -54,15 +168,16 @@ class BaseRestClient(object):
         if 'Content-Type' not in headers:
             headers['Content-Type'] = 'application/json'
 
-        if params:
-            request_url = self.server + endpoint + '?' + urlencode(params)
-        else:
-            request_url = self.server + endpoint
+        request_url = self._get_request_url(endpoint, params)
 
         data = None
 
         try:
-            request = Request(request_url, headers=headers)
+            if body is None:
+                request = Request(request_url, headers=headers)
+            else:
+                headers.setdefault('Accept', 'application/json')
+                request = Request(request_url, data=json.dumps(body).encode("utf-8"), headers=headers, method="POST")
             logging.debug("Send request to url: {request_url}".format(request_url=request_url))
             response = urlopen(request)
             content = response.read()
@@ -77,11 +192,11 @@ class BaseRestClient(object):
                     retry = e.headers['Retry-After']
                     logging.info("Retry after: {retry}".format(retry=retry))
                     self._wait_time_owed += float(retry) + 1
-                    return self.perform_rest_action(endpoint, headers, params)
+                    return self._perform_request(endpoint, headers, params, body)
             elif e.code == 503:
                 logging.error("Maybe recoverable error for request: " + request_url + "\nerror: " + repr(e))
                 self._wait_time_owed += 5
-                return self.perform_rest_action(endpoint, headers, params)
+                return self._perform_request(endpoint, headers, params, body)
             else:
                 logging.error("Fatal error for request: " + request_url + "\nerror: " + repr(e))
                 raise ValueError(
@@ -90,7 +205,7 @@ class BaseRestClient(object):
                 )
         except URLError as e:
             logging.error("Maybe recoverable URL error for request: " + request_url + "\nerror: " + repr(e))
-            return self.perform_rest_action(endpoint, headers, params)
+            return self._perform_request(endpoint, headers, params, body)
         return data
 
     def _do_rate_limiting(self):
@@ -121,13 +236,14 @@ class EnsemblRestClient(object):
 
     FULL_CIGAR_MATCH = re.compile(r"\d+M")
 
-    def __init__(self, version: str, reqs_per_sec=15):
-        if version == V38:
-            self._rest_client = BaseRestClient('https://rest.ensembl.org', reqs_per_sec)
-        elif version == V37:
-            self._rest_client = BaseRestClient('https://grch37.rest.ensembl.org', reqs_per_sec)
-        else:
+    def __init__(self, version: str, reqs_per_sec=15, server=None, cache_path=None):
+        if version not in VERSION_TO_SERVER:
             raise ValueError(f"Unrecognized ref genome version number: {version}")
+        if server is None:
+            server = VERSION_TO_SERVER[version]
+        self._rest_client = BaseRestClient(
+            server, reqs_per_sec, cache_path=cache_path, release_endpoint=RELEASE_ENDPOINT
+        )
 
     def get_coordinate_to_translated_position_and_sequences(
             self, species, coordinates, source_coordinate_system, target_coordinate_system, 
@@ -157,6 +273,31 @@ class EnsemblRestClient(object):
             }
             return {symbol: future.result() for symbol, future in future_to_symbol.items()}
 
+    def get_symbol_to_gene_overview_in_batches(self, species, symbols, warning_collector, max_workers=None):
+        # Looks up symbols in batches. A batch result is used if the symbol is the exact name of a gene on the primary
+        # assembly. The requests per symbol select the same gene, and would only add a warning if the symbol is also
+        # a synonym of another gene, or fail if another gene has the same name. Other symbols go through all requests
+        # per symbol, which also consider synonyms and report ambiguous matches.
+        symbol_to_lookup = {}
+        for batch in self._get_batches(symbols):
+            symbol_to_lookup.update(self._request_symbol_lookups(species, batch))
+
+        symbol_to_gene_overview = {}
+        ambiguous_symbols = []
+        for symbol in symbols:
+            lookup = symbol_to_lookup.get(symbol)
+            if self._lookup_is_exact_match(lookup, symbol):
+                symbol_to_gene_overview[symbol] = self._get_gene_overview_from_lookup(lookup)
+            else:
+                ambiguous_symbols.append(symbol)
+        logging.info("Resolved {resolved_count} symbols in batches, {ambiguous_count} remain".format(
+            resolved_count=len(symbol_to_gene_overview), ambiguous_count=len(ambiguous_symbols)))
+
+        symbol_to_gene_overview.update(
+            self.get_symbol_to_gene_overview(species, ambiguous_symbols, warning_collector, max_workers)
+        )
+        return symbol_to_gene_overview
+
     def get_gene_overview(self, species, symbol, warning_collector):
         logging.info("Start with getting overview for symbol {symbol}".format(symbol=symbol))
         suggested_ensembl_ids = self._request_ensembl_ids(species, symbol)
@@ -400,6 +541,13 @@ class EnsemblRestClient(object):
         )
         return {answer["id"] for answer in answers if answer["id"].startswith("ENSG")}
 
+    def _request_symbol_lookups(self, species, symbols):
+        answer = self._rest_client.perform_rest_action(
+            endpoint="/lookup/symbol/{0}".format(species),
+            body={"symbols": symbols}
+        )
+        return {symbol: lookup for symbol, lookup in answer.items() if lookup is not None}
+
     def _request_nm_transcript_ids(self, species, ensembl_id):
         if ensembl_id[:4] == "ENSG":
             object_type = "gene"
@@ -441,6 +589,26 @@ class EnsemblRestClient(object):
             params={"feature": "variation", "species": species}
         )
 
+    @staticmethod
+    def _lookup_is_exact_match(lookup, symbol):
+        return (
+            lookup is not None
+            and lookup.get("display_name") == symbol
+            and lookup.get("id", "").startswith("ENSG")
+            and not lookup.get("seq_region_name", "").startswith("CHR")
+        )
+
+    @staticmethod
+    def _get_gene_overview_from_lookup(lookup):
+        overview = dict(lookup)
+        overview["external_name"] = lookup["display_name"]
+        return overview
+
+    @staticmethod
+    def _get_batches(items):
+        items = list(items)
+        return [items[i:i + MAX_POST_BATCH_SIZE] for i in range(0, len(items), MAX_POST_BATCH_SIZE)]
+
     @staticmethod
     def _overview_is_relevant(overview, ensembl_id):
         return overview["id"] == ensembl_id and not overview["seq_region_name"].startswith("CHR")
@@ -451,11 +619,17 @@ class EnsemblRestClient(object):
         return "{" + ", ".join(sorted(key_to_value_strings)) + "}"
 
 
+def create_client(version):
+    server = os.environ.get(SERVER_VARIABLE) or None
+    cache_path = os.environ.get(CACHE_PATH_VARIABLE) or None
+    return EnsemblRestClient(version, reqs_per_sec=5, server=server, cache_path=cache_path)
+
+
 def print_gene_id_and_name(species, symbols, output_file, version):
-    client = EnsemblRestClient(version, reqs_per_sec=5)
+    client = create_client(version)
     warning_collector = StringCollector()
 
-    symbol_to_gene_overview = client.get_symbol_to_gene_overview(species, symbols, warning_collector, 15)
+    symbol_to_gene_overview = client.get_symbol_to_gene_overview_in_batches(species, symbols, warning_collector, 15)
 
     symbol_overview_pairs = sorted([(symbol, overview) for symbol, overview in symbol_to_gene_overview.items()])
     with open(output_file, "w") as out_f:
@@ -473,7 +647,7 @@ def print_gene_id_and_name(species, symbols, output_file, version):
 
 
 def print_nm_transcript_ids(species, gene_name_ensembl_id_tuples, output_file, version):
-    client = EnsemblRestClient(version, reqs_per_sec=5)
+    client = create_client(version)
     warning_collector = StringCollector()
     ensembl_ids = [pair[1] for pair in gene_name_ensembl_id_tuples]
     ensembl_id_to_nm_transcript_names = client.get_ensembl_id_to_nm_transcript_names(species, ensembl_ids, warning_collector, 15)
@@ -499,7 +673,7 @@ def determine_gene_ids_and_canonical_names(input_file, output_file, version):
 
 def get_coordinate_to_translated_position_and_sequences(
         species, coordinates, source_coordinate_system, target_coordinate_system, version):
-    client = EnsemblRestClient(version, reqs_per_sec=5)
+    client = create_client(version)
     warning_collector = StringCollector()
     range_to_translated_region = client.get_coordinate_to_translated_position_and_sequences(
         species, coordinates, source_coordinate_system, target_coordinate_system, warning_collector
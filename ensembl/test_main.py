@@ -0,0 +1,202 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import urlparse
+
+import main
+
+# Gene id to (name, synonyms)
+GENES = {
+    "ENSG01": ("GENEA", []),
+    "ENSG02": ("GENEB", []),
+    "ENSG03": ("GENEC", ["GENEB"]),
+    "ENSG04": ("GENED", ["OLDD"]),
+}
+
+
+class StubEnsemblHandler(BaseHTTPRequestHandler):
+    """Answers the Ensembl REST requests of the client from GENES, and records the requests it receives."""
+    requests = []
+    release = 112
+
+    def do_POST(self):
+        self.requests.append("POST " + urlparse(self.path).path)
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        # Like Ensembl, a symbol is only found by the name of a gene, not by its synonyms
+        name_to_gene_id = {name: gene_id for gene_id, (name, _) in GENES.items()}
+        answer = {
+            symbol: self._get_lookup(name_to_gene_id[symbol]) for symbol in body["symbols"] if symbol in name_to_gene_id
+        }
+        self._send(answer)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        self.requests.append("GET " + path)
+        parts = path.split("/")
+        if path == "/info/data":
+            self._send({"releases": [self.release]})
+        elif path.startswith("/xrefs/symbol/"):
+            symbol = parts[4]
+            self._send([
+                {"id": gene_id, "type": "gene"}
+                for gene_id, (name, synonyms) in GENES.items() if symbol == name or symbol in synonyms
+            ])
+        elif path.startswith("/overlap/id/"):
+            gene_id = parts[3]
+            self._send([{"id": gene_id, "external_name": GENES[gene_id][0], "seq_region_name": "1"}])
+        elif path.startswith("/xrefs/id/"):
+            self._send([{"synonyms": GENES[parts[3]][1], "db_display_name": "HGNC Symbol", "primary_id": "1"}])
+        else:
+            self.send_error(404)
+
+    def log_message(self, format, *args):
+        pass
+
+    @staticmethod
+    def _get_lookup(gene_id):
+        return {"id": gene_id, "display_name": GENES[gene_id][0], "seq_region_name": "1", "object_type": "Gene"}
+
+    def _send(self, answer):
+        content = json.dumps(answer).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class StubServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubEnsemblHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        StubEnsemblHandler.requests = []
+        StubEnsemblHandler.release = 112
+        self.client = self._create_client()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _create_client(self, cache_path=None):
+        return main.EnsemblRestClient(
+            main.V38, reqs_per_sec=1000, server="http://127.0.0.1:{0}".format(self.server.server_port),
+            cache_path=cache_path,
+        )
+
+
+class TestResponseCache(StubServerTestCase):
+    GENE_OVERVIEW_REQUESTS = ["GET /xrefs/symbol/human/GENEA", "GET /overlap/id/ENSG01", "GET /xrefs/id/ENSG01"]
+
+    def setUp(self):
+        super().setUp()
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.cache_path = os.path.join(self.cache_dir.name, "responses.sqlite")
+
+    def tearDown(self):
+        self.cache_dir.cleanup()
+        super().tearDown()
+
+    def test_cache_is_disabled_by_default(self):
+        with mock.patch.dict(os.environ, {main.SERVER_VARIABLE: "http://127.0.0.1:1"}):
+            os.environ.pop(main.CACHE_PATH_VARIABLE, None)
+            self.assertIsNone(main.create_client(main.V38)._rest_client.cache_path)
+
+    def test_cached_responses_are_used_by_next_run(self):
+        first_overview = self._get_gene_overview()
+        self.assertEqual(["GET /info/data"] + self.GENE_OVERVIEW_REQUESTS, StubEnsemblHandler.requests)
+
+        StubEnsemblHandler.requests = []
+        self.assertEqual(first_overview, self._get_gene_overview())
+        self.assertEqual(["GET /info/data"], StubEnsemblHandler.requests)
+
+    def test_expired_responses_are_requested_again(self):
+        self._get_gene_overview()
+        with sqlite3.connect(self.cache_path) as connection:
+            connection.execute("UPDATE responses SET created = created - ?", (main.DEFAULT_CACHE_MAX_AGE_SECONDS + 1,))
+
+        StubEnsemblHandler.requests = []
+        self._get_gene_overview()
+        self.assertEqual(["GET /info/data"] + self.GENE_OVERVIEW_REQUESTS, StubEnsemblHandler.requests)
+
+    def test_responses_of_other_release_are_requested_again(self):
+        self._get_gene_overview()
+
+        StubEnsemblHandler.requests = []
+        StubEnsemblHandler.release = 113
+        self._get_gene_overview()
+        self.assertEqual(["GET /info/data"] + self.GENE_OVERVIEW_REQUESTS, StubEnsemblHandler.requests)
+        with sqlite3.connect(self.cache_path) as connection:
+            self.assertEqual([("113",)], connection.execute("SELECT DISTINCT release FROM responses").fetchall())
+
+    def _get_gene_overview(self):
+        # Each run uses a new client, like each run of the script
+        client = self._create_client(self.cache_path)
+        return client.get_gene_overview("human", "GENEA", main.StringCollector())
+
+
+class TestSymbolToGeneOverviewInBatches(StubServerTestCase):
+
+    def test_exact_name_matches_are_resolved_from_batch(self):
+        # GENEB is the name of ENSG02 but also a synonym of ENSG03, which doesn't change the selected gene
+        warning_collector = main.StringCollector()
+        result = self.client.get_symbol_to_gene_overview_in_batches(
+            "human", ["GENEA", "GENEB", "GENED"], warning_collector,
+        )
+
+        self.assertEqual({"GENEA": "ENSG01", "GENEB": "ENSG02", "GENED": "ENSG04"}, self._get_symbol_to_id(result))
+        self.assertEqual("GENEA", result["GENEA"]["external_name"])
+        self.assertEqual([], warning_collector.get_all())
+        self.assertEqual(["POST /lookup/symbol/human"], StubEnsemblHandler.requests)
+
+    def test_synonyms_and_missing_symbols_fall_back_to_requests_per_symbol(self):
+        # OLDD is only a synonym of ENSG04
+        warning_collector = main.StringCollector()
+        result = self.client.get_symbol_to_gene_overview_in_batches(
+            "human", ["GENEA", "OLDD", "UNKNOWN"], warning_collector,
+        )
+
+        self.assertEqual({"GENEA": "ENSG01", "OLDD": "ENSG04", "UNKNOWN": None}, self._get_symbol_to_id(result))
+        self.assertEqual([], warning_collector.get_all())
+        self.assertEqual(
+            {
+                "POST /lookup/symbol/human",
+                "GET /xrefs/symbol/human/OLDD", "GET /overlap/id/ENSG04", "GET /xrefs/id/ENSG04",
+                "GET /xrefs/symbol/human/UNKNOWN",
+            },
+            set(StubEnsemblHandler.requests),
+        )
+
+    def test_symbols_are_looked_up_in_batches(self):
+        with mock.patch.object(main, "MAX_POST_BATCH_SIZE", 2):
+            result = self.client.get_symbol_to_gene_overview_in_batches(
+                "human", ["GENEA", "GENEB", "GENED", "UNKNOWN", "OLDD"], main.StringCollector(),
+            )
+
+        self.assertEqual(5, len(result))
+        self.assertEqual(3, StubEnsemblHandler.requests.count("POST /lookup/symbol/human"))
+
+    def test_panel_takes_one_request_per_batch(self):
+        panel_genes = {"ENSG1{0:05d}".format(i): ("PANEL{0}".format(i), []) for i in range(2500)}
+        symbols = [name for name, _ in panel_genes.values()]
+        with mock.patch.dict(GENES, panel_genes):
+            result = self.client.get_symbol_to_gene_overview_in_batches("human", symbols, main.StringCollector())
+
+        self.assertEqual(2500, len(result))
+        self.assertTrue(all(overview is not None for overview in result.values()))
+        self.assertEqual(["POST /lookup/symbol/human"] * 3, StubEnsemblHandler.requests)
+
+    @staticmethod
+    def _get_symbol_to_id(symbol_to_overview):
+        return {
+            symbol: overview["id"] if overview is not None else None
+            for symbol, overview in symbol_to_overview.items()
+        }
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+import argparse
+import concurrent.futures
+import sys
+from pathlib import Path
+from typing import List, Tuple, Optional
+
+import numpy as np
+
+from extract_baf_info import get_allele_counts_at_loci, read_loci, AlleleCounts
+
+AMBER_BAF_VCF_SUFFIX = ".amber.baf.vcf.gz"
+
+
+def main(
+        amber_outputs: List[str],
+        loci: str,
+        output_file: str,
+        tsv_output_file: Optional[str],
+        streaming: bool,
+        threads: Optional[int],
+) -> None:
+    sample_names = [get_sample_name(amber_output) for amber_output in amber_outputs]
+    if len(set(sample_names)) != len(sample_names):
+        raise ValueError(f"Sample names derived from AMBER outputs are not unique: {sample_names}")
+
+    loci_list = list(read_loci(loci))
+    chroms = np.array([chrom for chrom, _ in loci_list])
+    positions = np.array([int(pos) for _, pos in loci_list], dtype=np.int64)
+
+    ref_counts = np.zeros((len(loci_list), len(amber_outputs)), dtype=np.int32)
+    alt_counts = np.zeros((len(loci_list), len(amber_outputs)), dtype=np.int32)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=threads) as executor:
+        future_to_sample_index = {
+            executor.submit(get_allele_count_list, amber_output, loci, streaming): sample_index
+            for sample_index, amber_output in enumerate(amber_outputs)
+        }
+        for future in concurrent.futures.as_completed(future_to_sample_index):
+            sample_index = future_to_sample_index[future]
+            try:
+                allele_counts = future.result()
+            except Exception as exc:
+                raise ValueError(f"Could not extract BAF info from {amber_outputs[sample_index]}: {exc}")
+            if len(allele_counts) != len(loci_list):
+                raise ValueError(f"Unexpected number of loci for {amber_outputs[sample_index]}")
+            if allele_counts:
+                ref_counts[:, sample_index], alt_counts[:, sample_index] = zip(*allele_counts)
+
+    np.savez_compressed(
+        output_file,
+        chroms=chroms,
+        positions=positions,
+        samples=np.array(sample_names),
+        ref_counts=ref_counts,
+        alt_counts=alt_counts,
+    )
+
+    if tsv_output_file is not None:
+        write_tsv(tsv_output_file, chroms, positions, sample_names, ref_counts, alt_counts)
+
+
+def get_allele_count_list(amber_output: str, loci: str, streaming: bool) -> List[AlleleCounts]:
+    return list(get_allele_counts_at_loci(amber_output, loci, streaming))
+
+
+def get_sample_name(amber_output: str) -> str:
+    file_name = Path(amber_output).name
+    if file_name.endswith(AMBER_BAF_VCF_SUFFIX):
+        return file_name[:-len(AMBER_BAF_VCF_SUFFIX)]
+    else:
+        return file_name
+
+
+def write_tsv(
+        tsv_output_file: str,
+        chroms: np.ndarray,
+        positions: np.ndarray,
+        sample_names: List[str],
+        ref_counts: np.ndarray,
+        alt_counts: np.ndarray,
+) -> None:
+    header_entries = ["chrom", "pos"]
+    for sample_name in sample_names:
+        header_entries.extend([f"{sample_name}_ref", f"{sample_name}_alt"])
+
+    interleaved_counts = np.empty((ref_counts.shape[0], 2 * ref_counts.shape[1]), dtype=ref_counts.dtype)
+    interleaved_counts[:, 0::2] = ref_counts
+    interleaved_counts[:, 1::2] = alt_counts
+
+    with open(tsv_output_file, "w") as output_f:
+        output_f.write("\t".join(header_entries) + "\n")
+        for chrom, pos, counts in zip(chroms, positions, interleaved_counts):
+            output_f.write("\t".join([str(chrom), str(pos)] + [str(count) for count in counts]) + "\n")
+
+
+def load_matrix(matrix_file: str) -> Tuple[List[Tuple[str, int]], List[str], np.ndarray, np.ndarray]:
+    with np.load(matrix_file) as matrix:
+        loci = [(str(chrom), int(pos)) for chrom, pos in zip(matrix["chroms"], matrix["positions"])]
+        return loci, [str(sample) for sample in matrix["samples"]], matrix["ref_counts"], matrix["alt_counts"]
+
+
+def parse_args(sys_args: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Build loci x samples matrix of BAF info from AMBER outputs")
+    parser.add_argument('loci', type=str, help='AMBER config file with loci.')
+    parser.add_argument('output_file', type=str, help='Output NPZ file.')
+    parser.add_argument('amber_outputs', type=str, nargs='+', help='AMBER output vcfs.')
+    parser.add_argument('--tsv', type=str, default=None, help='Optional argument. Also export matrix to this TSV.')
+    parser.add_argument(
+        '--streaming',
+        action='store_true',
+        help='Stream sorted inputs instead of loading each AMBER output into memory. See extract_baf_info.py.',
+    )
+    parser.add_argument(
+        '--threads', type=int, default=None, help='Optional argument. Number of worker processes.',
+    )
+    return parser.parse_args(sys_args)
+
+
+if __name__ == '__main__':
+    args = parse_args(sys.argv[1:])
+    main(args.amber_outputs, args.loci, args.output_file, args.tsv, args.streaming, args.threads)
@@ -1,34 +1,135 @@
 #!/usr/bin/env python
 import argparse
 import gzip
+import itertools
 import sys
-from typing import List, Dict, Tuple
+from pathlib import Path
+from typing import List, Dict, Tuple, Iterator, Optional, TextIO
 
+Locus = Tuple[str, str]
+AlleleCounts = Tuple[int, int]
 
-def main(amber_output: str, loci: str, output_file: str) -> None:
-    position_to_allele_counts: Dict[Tuple[str, str], Tuple[int, int]] = {}
+NO_ALLELE_COUNTS: AlleleCounts = (0, 0)
+VCF_CONTIG_HEADER_PREFIX = "##contig=<ID="
+TABIX_INDEX_SUFFIXES = (".tbi", ".csi")
+
+
+def main(amber_output: str, loci: str, output_file: str, streaming: bool = False) -> None:
+    with open(output_file, "w") as output_f:
+        for ref_count, alt_count in get_allele_counts_at_loci(amber_output, loci, streaming):
+            output_f.write(f"{ref_count}\t{alt_count}\n")
+
+
+def get_allele_counts_at_loci(amber_output: str, loci: str, streaming: bool) -> Iterator[AlleleCounts]:
+    if not streaming:
+        return _get_allele_counts_from_dict(amber_output, loci)
+    elif is_tabix_indexed(amber_output):
+        return _get_allele_counts_from_tabix_lookups(amber_output, loci)
+    else:
+        return _get_allele_counts_from_merge_join(amber_output, loci)
+
+
+def read_loci(loci: str) -> Iterator[Locus]:
+    with open(loci, "r") as loci_f:
+        for line in loci_f:
+            if line[:3] == "chr":
+                chrom, pos, _, _, _, _, _, _ = line.split("\t")
+                yield chrom, pos
+
+
+def is_tabix_indexed(amber_output: str) -> bool:
+    return any(Path(f"{amber_output}{suffix}").exists() for suffix in TABIX_INDEX_SUFFIXES)
+
+
+def _get_allele_counts_from_dict(amber_output: str, loci: str) -> Iterator[AlleleCounts]:
+    position_to_allele_counts: Dict[Locus, AlleleCounts] = {}
     with gzip.open(amber_output, "rt") as amber_output_f:
         for line in amber_output_f:
             if line[:3] == "chr":
-                chrom, pos, _, _, _, _, _, _, _, data = line.split("\t")
-                allele_counts = data.split(":")[1]
-                ref_count, alt_count = allele_counts.split(",")
-                ref_count = int(ref_count)
-                alt_count = int(alt_count)
-                position_to_allele_counts[(chrom, pos)] = (ref_count, alt_count)
+                locus, allele_counts = _parse_amber_line(line)
+                position_to_allele_counts[locus] = allele_counts
 
-    with open(loci, "r") as loci_f:
-        with open(output_file, "w") as output_f:
-            for line in loci_f:
-                if line[:3] == "chr":
-                    chrom, pos, _, _, _, _, _, _ = line.split("\t")
-                    if (chrom, pos) in position_to_allele_counts.keys():
-                        ref_count, alt_count = position_to_allele_counts[(chrom, pos)]
-                    else:
-                        ref_count = 0
-                        alt_count = 0
-                    new_line = f"{ref_count}\t{alt_count}\n"
-                    output_f.write(new_line)
+    for locus in read_loci(loci):
+        yield position_to_allele_counts.get(locus, NO_ALLELE_COUNTS)
+
+
+def _get_allele_counts_from_merge_join(amber_output: str, loci: str) -> Iterator[AlleleCounts]:
+    # Both files need to be sorted in the contig order of the AMBER VCF header
+    with gzip.open(amber_output, "rt") as amber_output_f:
+        contig_to_rank, first_record_line = _read_contig_ranks_from_header(amber_output_f)
+        amber_records = _read_sorted_amber_records(first_record_line, amber_output_f, contig_to_rank)
+
+        current_record = next(amber_records, None)
+        previous_locus_key: Optional[Tuple[int, int]] = None
+        for locus in read_loci(loci):
+            locus_key = _get_sort_key(locus, contig_to_rank)
+            if previous_locus_key is not None and locus_key < previous_locus_key:
+                raise ValueError(f"Loci file is not sorted: {loci}, first unsorted locus={locus}")
+            previous_locus_key = locus_key
+
+            while current_record is not None and _get_sort_key(current_record[0], contig_to_rank) < locus_key:
+                current_record = next(amber_records, None)
+
+            if current_record is not None and current_record[0] == locus:
+                yield current_record[1]
+            else:
+                yield NO_ALLELE_COUNTS
+
+
+def _get_allele_counts_from_tabix_lookups(amber_output: str, loci: str) -> Iterator[AlleleCounts]:
+    import pysam  # only needed for indexed lookups, so not required for the default mode
+
+    with pysam.TabixFile(amber_output) as amber_output_f:
+        indexed_contigs = set(amber_output_f.contigs)
+        for chrom, pos in read_loci(loci):
+            allele_counts = NO_ALLELE_COUNTS
+            if chrom in indexed_contigs:
+                for line in amber_output_f.fetch(chrom, int(pos) - 1, int(pos)):
+                    record_locus, record_allele_counts = _parse_amber_line(line)
+                    if record_locus == (chrom, pos):
+                        allele_counts = record_allele_counts
+            yield allele_counts
+
+
+def _read_contig_ranks_from_header(amber_output_f: TextIO) -> Tuple[Dict[str, int], str]:
+    contig_to_rank: Dict[str, int] = {}
+    line = amber_output_f.readline()
+    while line.startswith("#"):
+        if line.startswith(VCF_CONTIG_HEADER_PREFIX):
+            contig = line[len(VCF_CONTIG_HEADER_PREFIX):].rstrip("\n>").split(",")[0]
+            contig_to_rank[contig] = len(contig_to_rank)
+        line = amber_output_f.readline()
+    if not contig_to_rank:
+        raise ValueError("Cannot determine contig order for streaming, since AMBER output has no contig header lines")
+    return contig_to_rank, line
+
+
+def _read_sorted_amber_records(
+        first_line: str, amber_output_f: TextIO, contig_to_rank: Dict[str, int],
+) -> Iterator[Tuple[Locus, AlleleCounts]]:
+    previous_key: Optional[Tuple[int, int]] = None
+    for line in itertools.chain([first_line], amber_output_f):
+        if line[:3] == "chr":
+            locus, allele_counts = _parse_amber_line(line)
+            key = _get_sort_key(locus, contig_to_rank)
+            if previous_key is not None and key < previous_key:
+                raise ValueError(f"AMBER output is not sorted, first unsorted locus={locus}")
+            previous_key = key
+            yield locus, allele_counts
+
+
+def _parse_amber_line(line: str) -> Tuple[Locus, AlleleCounts]:
+    chrom, pos, _, _, _, _, _, _, _, data = line.split("\t")
+    allele_counts = data.split(":")[1]
+    ref_count, alt_count = allele_counts.split(",")
+    return (chrom, pos), (int(ref_count), int(alt_count))
+
+
+def _get_sort_key(locus: Locus, contig_to_rank: Dict[str, int]) -> Tuple[int, int]:
+    chrom, pos = locus
+    if chrom not in contig_to_rank:
+        raise ValueError(f"Contig not present in AMBER output header: {chrom}")
+    return contig_to_rank[chrom], int(pos)
 
 
 def parse_args(sys_args: List[str]) -> argparse.Namespace:
@@ -36,11 +137,17 @@ def parse_args(sys_args: List[str]) -> argparse.Namespace:
     parser.add_argument('amber_output', type=str, help='AMBER output vcf.')
     parser.add_argument('loci', type=str, help='AMBER config file with loci.')
     parser.add_argument('output_file', type=str, help='Output file.')
+    parser.add_argument(
+        '--streaming',
+        action='store_true',
+        help=(
+            'Stream sorted inputs instead of loading the AMBER output into memory. '
+            'Uses tabix lookups at the loci if the AMBER output is bgzipped and indexed.'
+        ),
+    )
     return parser.parse_args(sys_args)
 
 
 if __name__ == '__main__':
     args = parse_args(sys.argv[1:])
-    main(args.amber_output, args.loci, args.output_file)
-
-
+    main(args.amber_output, args.loci, args.output_file, args.streaming)
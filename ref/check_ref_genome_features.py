@@ -1,30 +1,76 @@
 import argparse
+import concurrent.futures
 import logging
+import os
 import sys
 from pathlib import Path
-from typing import List, NamedTuple, Optional
+from typing import List, NamedTuple, Optional, Tuple, Dict
 
+from ref_lib.contig_digest import ContigDigest
 from ref_lib.contig_name_translation import AliasToCanonicalContigNameTextWriter, ContigNameTranslator
-from ref_lib.ref_genome_feature_analysis import ReferenceGenomeFeatureAnalyzer
+from ref_lib.feature_analysis_cache import FeatureAnalysisCache, FastaFingerprinter
+from ref_lib.ref_genome_feature_analysis import ReferenceGenomeFeatureAnalyzer, ReferenceGenomeFeatureAnalysis
 from ref_lib.ref_util import set_up_logging, assert_dir_does_not_exist, ALIAS_TO_CANONICAL_CONTIG_NAME_FILE_NAME, \
-    SOURCE_FILES_DIR_NAME, assert_file_exists
+    SOURCE_FILES_DIR_NAME, assert_file_exists, get_temp_path, make_temp_version_final, get_text_from_file
+from ref_lib.source_file_cache import SourceFileCache, DEFAULT_SOURCE_FILE_CACHE_MAX_SIZE_GIB, GIB
 from ref_lib.source_files import SourceFile, SourceFileDownloader, SourceFileLocator
 
 SCRIPT_NAME = "check_ref_genome_features"
+FEATURE_MATRIX_FILE_NAME = "feature_matrix.tsv"
+CONTIG_DIGEST_DIFFERENCES_FILE_NAME = "contig_digest_differences.tsv"
+ASSEMBLY_REPORT_CACHE_DIR_NAME = "assembly_reports"
+MISSING_CONTIG_DIGEST = "-"
+FEATURE_TO_DESCRIPTION = {
+    "has_unplaced_contigs": "Unplaced contigs",
+    "has_unlocalized_contigs": "Unlocalized contigs",
+    "has_alts": "Alts",
+    "has_decoys": "Decoys (hs38d1)",
+    "has_patches": "Patches",
+    "has_ebv": "EBV",
+    "has_rcrs": "rCRS mitochondrial sequence",
+    "uses_canonical_chrom_names": "Uses canonical contig names, so 'chr1' etc.",
+    "has_only_hardmasked_nucleotides_at_y_par1": "PAR hardmask (not fully accurate)",
+    "has_semi_ambiguous_iub_codes": "Semi ambiguous IUB codes",
+    "has_softmasked_nucleotides": "Has softmasked nucleotides",
+    "alts_are_padded": "Alts are padded with N",
+    "has_ki270752": "Has KI270752 (see DEV-2403)",
+}
+VALUE_TO_ANSWER = {True: "Yes", False: "No", None: "?"}
 
 
 class Config(NamedTuple):
-    ref_genome_path: Path
+    ref_genome_paths: List[Path]
     working_dir: Path
     reuse_existing_files: bool
     source_files_from_bucket_dir: Optional[str]
+    cache_dir: Optional[Path]
+    force: bool
+    source_file_cache_dir: Optional[Path]
+    source_file_cache_max_size_gib: int
+    verify_source_file_checksums: bool
 
     def get_local_source_file_dir(self) -> Path:
         return self.working_dir / SOURCE_FILES_DIR_NAME
 
+    def get_source_file_cache(self) -> Optional[SourceFileCache]:
+        if self.source_file_cache_dir is None:
+            return None
+        return SourceFileCache(self.source_file_cache_dir, self.source_file_cache_max_size_gib * GIB)
+
     def get_alias_to_canonical_contig_name_path(self) -> Path:
         return self.working_dir / ALIAS_TO_CANONICAL_CONTIG_NAME_FILE_NAME
 
+    def get_assembly_report_cache_dir(self) -> Optional[Path]:
+        if self.cache_dir is None:
+            return None
+        return self.cache_dir / ASSEMBLY_REPORT_CACHE_DIR_NAME
+
+    def get_feature_matrix_path(self) -> Path:
+        return self.working_dir / FEATURE_MATRIX_FILE_NAME
+
+    def get_contig_digest_differences_path(self) -> Path:
+        return self.working_dir / CONTIG_DIGEST_DIFFERENCES_FILE_NAME
+
 
 def main(config: Config) -> None:
     set_up_logging()
@@ -34,7 +80,10 @@ def main(config: Config) -> None:
     logging.info(f"Config values:\n{config}")
 
     # Sanity checks
-    assert_file_exists(config.ref_genome_path)
+    for ref_genome_path in config.ref_genome_paths:
+        assert_file_exists(ref_genome_path)
+    if len(set(config.ref_genome_paths)) != len(config.ref_genome_paths):
+        raise ValueError(f"Ref genomes are not unique: {config.ref_genome_paths}")
 
     if not config.reuse_existing_files:
         assert_dir_does_not_exist(config.working_dir)
@@ -48,6 +97,8 @@ def main(config: Config) -> None:
         config.get_local_source_file_dir(),
         config.source_files_from_bucket_dir,
         create_file_with_sources=False,
+        cache=config.get_source_file_cache(),
+        verify_checksums=config.verify_source_file_checksums,
     )
 
     logging.info(f"Creating {ALIAS_TO_CANONICAL_CONTIG_NAME_FILE_NAME} file.")
@@ -55,55 +106,138 @@ def main(config: Config) -> None:
         AliasToCanonicalContigNameTextWriter.create_contig_alias_file(
             config.get_alias_to_canonical_contig_name_path(),
             config.get_local_source_file_dir(),
+            config.get_assembly_report_cache_dir(),
         )
     else:
         logging.info(f"Skipping creation of {ALIAS_TO_CANONICAL_CONTIG_NAME_FILE_NAME} file. Already exists.")
 
     logging.info(f"Checking features.")
-    with open(config.get_alias_to_canonical_contig_name_path(), "r") as f:
-        contig_name_translator = ContigNameTranslator.from_contig_alias_text(f.read())
+    contig_name_translator = ContigNameTranslator.from_contig_alias_file(
+        config.get_alias_to_canonical_contig_name_path(),
+    )
 
     rcrs_path = SourceFileLocator().get_location(SourceFile.RCRS_FASTA, config.get_local_source_file_dir())
-    analysis = ReferenceGenomeFeatureAnalyzer.do_analysis(
-        config.ref_genome_path, rcrs_path, contig_name_translator,
+
+    # Analyses share the available cores instead of each starting a process per core
+    processes_per_analysis = max(1, (os.cpu_count() or 1) // len(config.ref_genome_paths))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(config.ref_genome_paths)) as executor:
+        futures = [
+            executor.submit(
+                get_feature_analysis,
+                config,
+                ref_genome_path,
+                contig_name_translator,
+                rcrs_path,
+                processes_per_analysis,
+            )
+            for ref_genome_path in config.ref_genome_paths
+        ]
+    results: List[Tuple[ReferenceGenomeFeatureAnalysis, List[ContigDigest]]] = []
+    for ref_genome_path, future in zip(config.ref_genome_paths, futures):
+        try:
+            results.append(future.result())
+        except Exception as exc:
+            raise ValueError(f"Could not analyze {ref_genome_path}: {exc}")
+
+    if len(results) == 1:
+        analysis, _ = results[0]
+        report_feature_analysis(analysis)
+    else:
+        analyses = [analysis for analysis, _ in results]
+        write_feature_matrix(config.ref_genome_paths, analyses, config.get_feature_matrix_path())
+        print(get_text_from_file(config.get_feature_matrix_path()), end="")
+        contig_digests_per_genome = [contig_digests for _, contig_digests in results]
+        write_contig_digest_differences(
+            config.ref_genome_paths,
+            contig_digests_per_genome,
+            contig_name_translator,
+            config.get_contig_digest_differences_path(),
+        )
+    logging.info(f"Finished {SCRIPT_NAME}.")
+
+
+def get_feature_analysis(
+        config: Config,
+        ref_genome_path: Path,
+        contig_name_translator: ContigNameTranslator,
+        rcrs_path: Path,
+        processes: int,
+) -> Tuple[ReferenceGenomeFeatureAnalysis, List[ContigDigest]]:
+    if config.cache_dir is None:
+        return ReferenceGenomeFeatureAnalyzer.do_analysis_with_contig_digests(
+            ref_genome_path, rcrs_path, contig_name_translator, processes,
+        )
+
+    feature_analysis_cache = FeatureAnalysisCache(config.cache_dir)
+    fasta_fingerprint = FastaFingerprinter.get_fingerprint(ref_genome_path)
+    cache_key = FeatureAnalysisCache.get_key(
+        fasta_fingerprint, [config.get_alias_to_canonical_contig_name_path(), rcrs_path],
+    )
+    cached_result = None if config.force else feature_analysis_cache.load(cache_key)
+    if cached_result is not None:
+        return cached_result
+
+    analysis, contig_digests = ReferenceGenomeFeatureAnalyzer.do_analysis_with_contig_digests(
+        ref_genome_path, rcrs_path, contig_name_translator, processes,
     )
+    feature_analysis_cache.store(cache_key, ref_genome_path, fasta_fingerprint, analysis, contig_digests)
+    return analysis, contig_digests
+
 
+def report_feature_analysis(analysis: ReferenceGenomeFeatureAnalysis) -> None:
     logging.info(f"FEATURES GENOME:")
 
-    logging.info(f"Unplaced contigs: {analysis.has_unplaced_contigs}")
-    logging.info(f"Unlocalized contigs: {analysis.has_unlocalized_contigs}")
-    logging.info(f"Alts: {analysis.has_alts}")
-    logging.info(f"Decoys (hs38d1): {analysis.has_decoys}")
-    logging.info(f"Patches: {analysis.has_patches}")
-    logging.info(f"EBV: {analysis.has_ebv}")
-    logging.info(f"rCRS mitochondrial sequence: {analysis.has_rcrs}")
-    logging.info(f"Uses canonical contig names, so 'chr1' etc.: {analysis.uses_canonical_chrom_names}")
-    logging.info(f"PAR hardmask (not fully accurate): {analysis.has_only_hardmasked_nucleotides_at_y_par1}")
-    logging.info(f"Semi ambiguous IUB codes: {analysis.has_semi_ambiguous_iub_codes}")
-    logging.info(f"Has softmasked nucleotides: {analysis.has_softmasked_nucleotides}")
-    logging.info(f"Alts are padded with N: {analysis.alts_are_padded}")
-    logging.info(f"Has KI270752 (see DEV-2403): {analysis.has_ki270752}")
+    for feature, description in FEATURE_TO_DESCRIPTION.items():
+        logging.info(f"{description}: {getattr(analysis, feature)}")
     logging.info(f"PhiX: False?")
     logging.info(f"")
     logging.info(f"For easy copy-paste:")
-    answers = [
-        analysis.has_unplaced_contigs,
-        analysis.has_unlocalized_contigs,
-        analysis.has_alts,
-        analysis.has_decoys,
-        analysis.has_patches,
-        analysis.has_ebv,
-        analysis.has_rcrs,
-        analysis.uses_canonical_chrom_names,
-        analysis.has_only_hardmasked_nucleotides_at_y_par1,
-        analysis.has_semi_ambiguous_iub_codes,
-        analysis.has_softmasked_nucleotides,
-        analysis.alts_are_padded,
-        analysis.has_ki270752
+    print("\n".join([VALUE_TO_ANSWER[getattr(analysis, feature)] for feature in FEATURE_TO_DESCRIPTION.keys()]))
+
+
+def write_feature_matrix(
+        ref_genome_paths: List[Path], analyses: List[ReferenceGenomeFeatureAnalysis], output_path: Path,
+) -> None:
+    lines = ["\t".join(["feature"] + [str(path) for path in ref_genome_paths])]
+    for feature, description in FEATURE_TO_DESCRIPTION.items():
+        answers = [VALUE_TO_ANSWER[getattr(analysis, feature)] for analysis in analyses]
+        lines.append("\t".join([description] + answers))
+    with open(get_temp_path(output_path), "w") as f:
+        f.write("\n".join(lines) + "\n")
+    make_temp_version_final(output_path)
+
+
+def write_contig_digest_differences(
+        ref_genome_paths: List[Path],
+        contig_digests_per_genome: List[List[ContigDigest]],
+        contig_name_translator: ContigNameTranslator,
+        output_path: Path,
+) -> None:
+    # Contigs are matched on their standardized names, since the genomes can use different naming conventions.
+    # Only contigs that are missing from some genomes or that differ in MD5 are written.
+    standardized_name_to_md5_per_genome = [
+        dict(zip(
+            contig_name_translator.standardize_many(digest.name for digest in contig_digests),
+            [digest.md5 for digest in contig_digests],
+        ))
+        for contig_digests in contig_digests_per_genome
     ]
-    value_to_answer = {True: "Yes", False: "No", None: "?"}
-    print("\n".join([value_to_answer[answer] for answer in answers]))
-    logging.info(f"Finished {SCRIPT_NAME}.")
+    standardized_names: Dict[str, None] = {}
+    for standardized_name_to_md5 in standardized_name_to_md5_per_genome:
+        standardized_names.update({name: None for name in standardized_name_to_md5.keys()})
+
+    lines = ["\t".join(["contig"] + [str(path) for path in ref_genome_paths])]
+    for standardized_name in standardized_names:
+        md5s = [
+            standardized_name_to_md5.get(standardized_name, MISSING_CONTIG_DIGEST)
+            for standardized_name_to_md5 in standardized_name_to_md5_per_genome
+        ]
+        if len(set(md5s)) != 1:
+            lines.append("\t".join([standardized_name] + md5s))
+    logging.info(f"Found {len(lines) - 1} contigs that are missing or differ between ref genomes")
+    with open(get_temp_path(output_path), "w") as f:
+        f.write("\n".join(lines) + "\n")
+    make_temp_version_final(output_path)
 
 
 def parse_args(sys_args: List[str]) -> Config:
@@ -117,8 +251,13 @@ def parse_args(sys_args: List[str]) -> Config:
         "--ref_genome",
         "-i",
         type=Path,
+        nargs="+",
         required=True,
-        help="Path to FASTA file with reference genome to check.",
+        help=(
+            "Path to FASTA file with reference genome to check. If multiple are provided, they are analyzed "
+            f"concurrently and compared in {FEATURE_MATRIX_FILE_NAME} and {CONTIG_DIGEST_DIFFERENCES_FILE_NAME} "
+            f"in the working dir."
+        ),
     )
     parser.add_argument(
         "--working_dir",
@@ -143,6 +282,54 @@ def parse_args(sys_args: List[str]) -> Config:
             "instead of downloading them from their original source."
         ),
     )
+    parser.add_argument(
+        "--cache_dir",
+        "-c",
+        type=Path,
+        default=None,
+        help=(
+            "Optional argument. Directory for cached feature analyses and interpreted assembly reports, "
+            "which is shared between runs. If not provided, no cache is used."
+        ),
+    )
+    parser.add_argument(
+        "--force",
+        "-f",
+        help=(
+            "Optional argument. Redo the feature analysis even if a cached result exists in the cache dir, "
+            "and update the cache."
+        ),
+        action="store_true",
+    )
+    parser.add_argument(
+        "--source_file_cache_dir",
+        type=Path,
+        default=None,
+        help=(
+            "Optional argument. Directory for a local cache of source files that is shared between runs and "
+            "working dirs. Cached files are copied into the working dir instead of downloaded, as reflinks where "
+            "the file system supports it. If not provided, no cache is used."
+        ),
+    )
+    parser.add_argument(
+        "--source_file_cache_max_size_gib",
+        type=int,
+        default=DEFAULT_SOURCE_FILE_CACHE_MAX_SIZE_GIB,
+        help=(
+            f"Optional argument. Maximum size of the source file cache in GiB. "
+            f"Least recently used files are removed when it grows larger. "
+            f"Default is {DEFAULT_SOURCE_FILE_CACHE_MAX_SIZE_GIB}."
+        ),
+    )
+    parser.add_argument(
+        "--verify_source_file_checksums",
+        help=(
+            "Optional argument. Hash all existing local source files again to verify their checksums. "
+            "By default, files are only hashed again if their size or modification time has changed "
+            "since their checksums were last verified."
+        ),
+        action="store_true",
+    )
     parser.add_argument(
         "--venv_dir",
         "-v",
@@ -165,6 +352,11 @@ def parse_args(sys_args: List[str]) -> Config:
         args.working_dir,
         args.reuse_existing_files,
         args.source_files_from_bucket_dir,
+        args.cache_dir,
+        args.force,
+        args.source_file_cache_dir,
+        args.source_file_cache_max_size_gib,
+        args.verify_source_file_checksums,
     )
     return config
 
@@ -4,19 +4,24 @@ import sys
 from pathlib import Path
 from typing import List, NamedTuple, Optional
 
-import pysam
-
+from ref_lib.bucket_upload import BucketUploader
 from ref_lib.contig_name_translation import AliasToCanonicalContigNameTextWriter, ContigNameTranslator
 from ref_lib.contig_classification import ContigCategorizer
+from ref_lib.contig_digest import ContigDigest, ContigDigestTable, ContigDigester, CONTIG_DIGEST_FILE_SUFFIX
 from ref_lib.contig_types import ContigTypeDesirabilities
-from ref_lib.fasta_writer import FastaWriter
+from ref_lib.fasta_comparison import FastaComparer, ContigPair
+from ref_lib.fasta_reader import MappedFastaReader
+from ref_lib.fasta_writer import FastaWriter, get_sequence_dictionary_path
 from ref_lib.ref_genome_feature_analysis import ReferenceGenomeFeatureAnalyzer, ReferenceGenomeFeatureAnalysis
 from ref_lib.ref_util import set_up_logging, assert_dir_does_not_exist, assert_bucket_dir_does_not_exist, \
-    upload_directory_to_bucket, get_temp_path, make_temp_version_final, ALIAS_TO_CANONICAL_CONTIG_NAME_FILE_NAME, \
-    MASTER_FASTA_FILE_NAME, SOURCE_FILES_DIR_NAME, combine_compressed_files
+    get_temp_path, make_temp_version_final, ALIAS_TO_CANONICAL_CONTIG_NAME_FILE_NAME, MASTER_FASTA_FILE_NAME, \
+    SOURCE_FILES_DIR_NAME, combine_compressed_files, get_storage_client
+from ref_lib.source_file_cache import SourceFileCache, DEFAULT_SOURCE_FILE_CACHE_MAX_SIZE_GIB, GIB
 from ref_lib.source_files import SourceFile, SourceFileDownloader, SourceFileLocator
 
 SCRIPT_NAME = "create_hmf_ref_genome_fasta"
+OUTPUT_FASTA_SIDECAR_SUFFIXES = [".fai", CONTIG_DIGEST_FILE_SUFFIX]
+BGZF_OUTPUT_FASTA_SIDECAR_SUFFIXES = [".fai", ".gzi"]
 
 
 class Config(NamedTuple):
@@ -25,10 +30,21 @@ class Config(NamedTuple):
     output_bucket_dir: Optional[str]
     reuse_existing_files: bool
     source_files_from_bucket_dir: Optional[str]
+    processes: int
+    verify_against_master: bool
+    write_bgzf: bool
+    source_file_cache_dir: Optional[Path]
+    source_file_cache_max_size_gib: int
+    verify_source_file_checksums: bool
 
     def get_local_source_file_dir(self) -> Path:
         return self.working_dir / SOURCE_FILES_DIR_NAME
 
+    def get_source_file_cache(self) -> Optional[SourceFileCache]:
+        if self.source_file_cache_dir is None:
+            return None
+        return SourceFileCache(self.source_file_cache_dir, self.source_file_cache_max_size_gib * GIB)
+
     def get_alias_to_canonical_contig_name_path(self) -> Path:
         return self.working_dir / ALIAS_TO_CANONICAL_CONTIG_NAME_FILE_NAME
 
@@ -38,6 +54,9 @@ class Config(NamedTuple):
     def get_output_fasta_path(self) -> Path:
         return self.working_dir / self.output_fasta_name
 
+    def get_bgzf_output_fasta_path(self) -> Path:
+        return self.working_dir / f"{self.output_fasta_name}.gz"
+
 
 def main(config: Config) -> None:
     set_up_logging()
@@ -49,7 +68,7 @@ def main(config: Config) -> None:
     # Sanity checks
     if not config.reuse_existing_files:
         assert_dir_does_not_exist(config.working_dir)
-    if config.output_bucket_dir is not None:
+    if config.output_bucket_dir is not None and not config.reuse_existing_files:
         assert_bucket_dir_does_not_exist(config.output_bucket_dir)
 
     if not config.get_local_source_file_dir().exists():
@@ -60,6 +79,8 @@ def main(config: Config) -> None:
         SourceFile.get_all(),
         config.get_local_source_file_dir(),
         config.source_files_from_bucket_dir,
+        cache=config.get_source_file_cache(),
+        verify_checksums=config.verify_source_file_checksums,
     )
 
     logging.info(f"Creating {ALIAS_TO_CANONICAL_CONTIG_NAME_FILE_NAME} file.")
@@ -78,8 +99,9 @@ def main(config: Config) -> None:
         logging.info(f"Skipping creation of master FASTA file. Already exists.")
 
     logging.info(f"Creating temp version of HMFref FASTA file.")
-    with open(config.get_alias_to_canonical_contig_name_path(), "r") as f:
-        contig_name_translator = ContigNameTranslator.from_contig_alias_text(f.read())
+    contig_name_translator = ContigNameTranslator.from_contig_alias_file(
+        config.get_alias_to_canonical_contig_name_path(),
+    )
     contig_categorizer = ContigCategorizer(contig_name_translator)
     contig_type_desirabilities = ContigTypeDesirabilities.create()
 
@@ -89,6 +111,8 @@ def main(config: Config) -> None:
         contig_categorizer,
         contig_name_translator,
         contig_type_desirabilities,
+        config.processes,
+        get_temp_path(config.get_bgzf_output_fasta_path()) if config.write_bgzf else None,
     )
 
     logging.info("Asserting that output is as expected.")
@@ -99,11 +123,23 @@ def main(config: Config) -> None:
 
     logging.info("Moving temp output file to final output location.")
     make_temp_version_final(config.get_output_fasta_path())
-    Path(f"{get_temp_path(config.get_output_fasta_path())}.fai").rename(Path(f"{config.get_output_fasta_path()}.fai"))
+    for suffix in OUTPUT_FASTA_SIDECAR_SUFFIXES:
+        Path(f"{get_temp_path(config.get_output_fasta_path())}{suffix}").rename(
+            Path(f"{config.get_output_fasta_path()}{suffix}")
+        )
+    get_sequence_dictionary_path(get_temp_path(config.get_output_fasta_path())).rename(
+        get_sequence_dictionary_path(config.get_output_fasta_path())
+    )
+    if config.write_bgzf:
+        make_temp_version_final(config.get_bgzf_output_fasta_path())
+        for suffix in BGZF_OUTPUT_FASTA_SIDECAR_SUFFIXES:
+            Path(f"{get_temp_path(config.get_bgzf_output_fasta_path())}{suffix}").rename(
+                Path(f"{config.get_bgzf_output_fasta_path()}{suffix}")
+            )
 
     if config.output_bucket_dir is not None:
         logging.info("Upload results to bucket.")
-        upload_directory_to_bucket(config.working_dir, config.output_bucket_dir)
+        BucketUploader(get_storage_client()).upload_directory(config.working_dir, config.output_bucket_dir)
     else:
         logging.info("Skip upload of results to bucket.")
 
@@ -130,27 +166,58 @@ def assert_created_ref_genome_matches_expectations(
         contig_name_translator: ContigNameTranslator,
         contig_type_desirabilities: ContigTypeDesirabilities,
 ) -> None:
-    with pysam.Fastafile(get_temp_path(config.get_output_fasta_path())) as temp_f:
-        with pysam.Fastafile(config.get_local_uncompressed_master_fasta_path()) as master_f:
+    temp_output_fasta_path = get_temp_path(config.get_output_fasta_path())
+    written_digests = ContigDigestTable.read(ContigDigestTable.get_path(temp_output_fasta_path))
+    with MappedFastaReader(temp_output_fasta_path) as temp_f:
+        with MappedFastaReader(config.get_local_uncompressed_master_fasta_path()) as master_f:
             contigs_expected_to_be_copied = {
-                contig_name for contig_name in master_f.references
-                if contig_categorizer.get_contig_type(contig_name) in contig_type_desirabilities.desired_contig_types
-            }
-            contigs_expected_in_output = {
-                contig_name_translator.standardize(contig_name) for contig_name in contigs_expected_to_be_copied
+                contig_name
+                for contig_name, contig_type in zip(
+                    master_f.references, contig_categorizer.categorize_many(master_f.references),
+                )
+                if contig_type in contig_type_desirabilities.desired_contig_types
             }
-            if set(temp_f.references) != contigs_expected_in_output:
-                error_msg = (
-                    f"Contigs in output file not as expected: "
-                    f"expected={contigs_expected_in_output}, actual={sorted(temp_f.references)}"
+            contig_to_expected_length = {
+                standardized_contig_name: master_f.get_reference_length(contig_name)
+                for contig_name, standardized_contig_name in zip(
+                    contigs_expected_to_be_copied,
+                    contig_name_translator.standardize_many(contigs_expected_to_be_copied),
                 )
-                raise ValueError(error_msg)
-
-            for contig_name in contigs_expected_to_be_copied:
-                expected_sequence = master_f.fetch(contig_name).upper()
-                actual_sequence = temp_f.fetch(contig_name_translator.standardize(contig_name))
-                if actual_sequence != expected_sequence:
-                    raise ValueError(f"Contig sequences are not identical: contig={contig_name}")
+            }
+        contigs_expected_in_output = set(contig_to_expected_length.keys())
+        if set(temp_f.references) != contigs_expected_in_output:
+            error_msg = (
+                f"Contigs in output file not as expected: "
+                f"expected={contigs_expected_in_output}, actual={sorted(temp_f.references)}"
+            )
+            raise ValueError(error_msg)
+        if {digest.name for digest in written_digests} != contigs_expected_in_output:
+            error_msg = (
+                f"Contigs in digest file not as expected: "
+                f"expected={contigs_expected_in_output}, actual={sorted(digest.name for digest in written_digests)}"
+            )
+            raise ValueError(error_msg)
+
+        for written_digest in written_digests:
+            if written_digest.length != contig_to_expected_length[written_digest.name]:
+                raise ValueError(f"Contig lengths are not identical: contig={written_digest.name}")
+
+    sorted_contigs_expected_to_be_copied = sorted(contigs_expected_to_be_copied)
+    contig_pairs = [
+        ContigPair(contig_name, standardized_contig_name)
+        for contig_name, standardized_contig_name in zip(
+            sorted_contigs_expected_to_be_copied,
+            contig_name_translator.standardize_many(sorted_contigs_expected_to_be_copied),
+        )
+    ]
+    if config.verify_against_master:
+        mismatches = FastaComparer.get_mismatches(
+            config.get_local_uncompressed_master_fasta_path(), temp_output_fasta_path, contig_pairs, config.processes,
+        )
+        if mismatches:
+            raise ValueError(f"Contig sequences are not identical: {mismatches}")
+    else:
+        assert_output_digests_match_master(config, contig_pairs, written_digests)
     feature_analysis = ReferenceGenomeFeatureAnalyzer.do_analysis(
         get_temp_path(config.get_output_fasta_path()),
         SourceFileLocator().get_location(SourceFile.RCRS_FASTA, config.get_local_source_file_dir()),
@@ -176,6 +243,28 @@ def assert_created_ref_genome_matches_expectations(
         raise ValueError(error_msg)
 
 
+def assert_output_digests_match_master(
+        config: Config, contig_pairs: List[ContigPair], written_digests: List[ContigDigest],
+) -> None:
+    # The written digests were computed from the windows that were written, so the output is also compared to digests
+    # computed from the master FASTA itself. The MD5 is of the uppercased sequence, so softmasks don't matter.
+    temp_output_fasta_path = get_temp_path(config.get_output_fasta_path())
+    master_digests = ContigDigester.digest_contigs_in_file(
+        config.get_local_uncompressed_master_fasta_path(),
+        [contig_pair.expected_contig_name for contig_pair in contig_pairs],
+        config.processes,
+    )
+    output_digests = ContigDigester.digest_contigs_in_file(
+        temp_output_fasta_path, [contig_pair.actual_contig_name for contig_pair in contig_pairs], config.processes,
+    )
+    name_to_written_digest = {written_digest.name: written_digest for written_digest in written_digests}
+    for contig_pair, master_digest, output_digest in zip(contig_pairs, master_digests, output_digests):
+        if (master_digest.length, master_digest.md5) != (output_digest.length, output_digest.md5):
+            raise ValueError(f"Contig sequences are not identical: {contig_pair}")
+        if output_digest != name_to_written_digest[contig_pair.actual_contig_name]:
+            raise ValueError(f"Contig digests are not as written: contig={contig_pair.actual_contig_name}")
+
+
 def parse_args(sys_args: List[str]) -> Config:
     parser = argparse.ArgumentParser(
         prog=f"{SCRIPT_NAME}",
@@ -202,13 +291,17 @@ def parse_args(sys_args: List[str]) -> Config:
         default=None,
         help=(
             "Optional argument. Path to output bucket dir. Argument should be of the form 'gs://some/kind/of/path'. "
-            "This script will not overwrite existing files in the bucket."
+            "This script will not overwrite existing files in the bucket. "
+            "With --reuse_existing_files, an earlier upload to this dir is continued."
         ),
     )
     parser.add_argument(
         "--reuse_existing_files",
         "-u",
-        help="Optional argument. Reuse local source files from a previous run of this script.",
+        help=(
+            "Optional argument. Reuse local source files from a previous run of this script, "
+            "and continue its upload to the output bucket dir. Identical files in the bucket are skipped."
+        ),
         action="store_true",
     )
     parser.add_argument(
@@ -221,6 +314,63 @@ def parse_args(sys_args: List[str]) -> Config:
             "instead of downloading them from their original source."
         ),
     )
+    parser.add_argument(
+        "--processes",
+        "-p",
+        type=int,
+        default=1,
+        help=(
+            "Optional argument. Number of processes used to write the contigs of the FASTA file in parallel. "
+            "Default is 1, which writes the contigs one after another without temporary shards."
+        ),
+    )
+    parser.add_argument(
+        "--verify_against_master",
+        help=(
+            "Optional argument. Verify output by comparing it to the master FASTA file window by window, "
+            "which reports the first mismatching offset. "
+            "By default, the MD5 digests of the output contigs are compared to those of the master FASTA contigs."
+        ),
+        action="store_true",
+    )
+    parser.add_argument(
+        "--bgzf",
+        "-z",
+        help=(
+            "Optional argument. Also write a BGZF-compressed copy of the FASTA file with its .fai and .gzi files. "
+            "It is compressed while the uncompressed FASTA file is written."
+        ),
+        action="store_true",
+    )
+    parser.add_argument(
+        "--source_file_cache_dir",
+        type=Path,
+        default=None,
+        help=(
+            "Optional argument. Directory for a local cache of source files that is shared between runs and "
+            "working dirs. Cached files are copied into the working dir instead of downloaded, as reflinks where "
+            "the file system supports it. If not provided, no cache is used."
+        ),
+    )
+    parser.add_argument(
+        "--source_file_cache_max_size_gib",
+        type=int,
+        default=DEFAULT_SOURCE_FILE_CACHE_MAX_SIZE_GIB,
+        help=(
+            f"Optional argument. Maximum size of the source file cache in GiB. "
+            f"Least recently used files are removed when it grows larger. "
+            f"Default is {DEFAULT_SOURCE_FILE_CACHE_MAX_SIZE_GIB}."
+        ),
+    )
+    parser.add_argument(
+        "--verify_source_file_checksums",
+        help=(
+            "Optional argument. Hash all existing local source files again to verify their checksums. "
+            "By default, files are only hashed again if their size or modification time has changed "
+            "since their checksums were last verified."
+        ),
+        action="store_true",
+    )
     parser.add_argument(
         "--venv_dir",
         "-v",
@@ -244,6 +394,12 @@ def parse_args(sys_args: List[str]) -> Config:
         args.output_bucket_dir,
         args.reuse_existing_files,
         args.source_files_from_bucket_dir,
+        args.processes,
+        args.verify_against_master,
+        args.bgzf,
+        args.source_file_cache_dir,
+        args.source_file_cache_max_size_gib,
+        args.verify_source_file_checksums,
     )
     return config
 
@@ -0,0 +1,172 @@
+import argparse
+import logging
+import os
+import sys
+from pathlib import Path
+from typing import List, NamedTuple, Optional
+
+from ref_lib.contig_name_translation import ContigNameTranslator
+from ref_lib.contig_types import ContigType
+from ref_lib.fasta_slicing import FastaSlicer, FastaSliceSelection, ContigRegion
+from ref_lib.ref_util import set_up_logging, assert_file_exists, assert_dir_exists, \
+    ALIAS_TO_CANONICAL_CONTIG_NAME_FILE_NAME
+
+SCRIPT_NAME = "extract_ref_genome_contigs"
+
+
+class Config(NamedTuple):
+    ref_genome_path: Path
+    output_path: Path
+    per_record: bool
+    contig_types: List[ContigType]
+    contig_names: List[str]
+    regions: List[ContigRegion]
+    contig_alias_path: Optional[Path]
+    standardize_names: bool
+    processes: int
+
+    def get_selection(self) -> FastaSliceSelection:
+        return FastaSliceSelection(set(self.contig_types), self.contig_names, self.regions)
+
+
+def main(config: Config) -> None:
+    set_up_logging()
+
+    logging.info(f"Starting {SCRIPT_NAME}.")
+
+    logging.info(f"Config values:\n{config}")
+
+    # Sanity checks
+    assert_file_exists(config.ref_genome_path)
+    if config.contig_alias_path is not None:
+        assert_file_exists(config.contig_alias_path)
+    if config.per_record:
+        assert_dir_exists(config.output_path)
+    elif config.output_path.exists():
+        raise ValueError(f"Output file already exists: {config.output_path}")
+
+    if config.contig_alias_path is not None:
+        contig_name_translator: Optional[ContigNameTranslator] = ContigNameTranslator.from_contig_alias_file(
+            config.contig_alias_path,
+        )
+    else:
+        contig_name_translator = None
+
+    written_fastas = FastaSlicer.write_slices(
+        config.ref_genome_path,
+        config.get_selection(),
+        config.output_path,
+        config.per_record,
+        contig_name_translator,
+        config.standardize_names,
+        config.processes,
+    )
+    logging.info(f"Wrote {len(written_fastas)} FASTA files")
+
+    logging.info(f"Finished {SCRIPT_NAME}.")
+
+
+def parse_args(sys_args: List[str]) -> Config:
+    parser = argparse.ArgumentParser(
+        prog=f"{SCRIPT_NAME}",
+        description=(
+            "Extract contigs and regions from a reference genome FASTA into a combined FASTA file "
+            "or into a FASTA file per contig or region, each with its .fai and .dict file."
+        ),
+    )
+    parser.add_argument(
+        "--ref_genome",
+        "-i",
+        type=Path,
+        required=True,
+        help="Path to uncompressed FASTA file to extract from.",
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        type=Path,
+        required=True,
+        help="Path to output FASTA file. With --per_record, path to existing output directory instead.",
+    )
+    parser.add_argument(
+        "--per_record",
+        help="Optional argument. Write a FASTA file per contig or region, named after the record.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--contig_types",
+        "-t",
+        nargs="+",
+        choices=[contig_type.name for contig_type in ContigType],
+        default=[],
+        help="Optional argument. Extract all contigs of these types. Requires --contig_alias_file.",
+    )
+    parser.add_argument(
+        "--contig_names",
+        "-n",
+        nargs="+",
+        default=[],
+        help="Optional argument. Extract these contigs. Aliases in the contig alias file can be used as well.",
+    )
+    parser.add_argument(
+        "--regions",
+        "-r",
+        nargs="+",
+        default=[],
+        help="Optional argument. Extract these regions, in samtools faidx format like 'chr1:1000-2000'.",
+    )
+    parser.add_argument(
+        "--contig_alias_file",
+        "-a",
+        type=Path,
+        default=None,
+        help=(
+            f"Optional argument. Path to {ALIAS_TO_CANONICAL_CONTIG_NAME_FILE_NAME} file, "
+            f"as created in the working dir of create_hmf_ref_genome_fasta or check_ref_genome_features."
+        ),
+    )
+    parser.add_argument(
+        "--standardize_names",
+        help="Optional argument. Name output records by canonical contig name. Requires --contig_alias_file.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--processes",
+        "-p",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Optional argument. Number of processes used to write records. Default is all cores.",
+    )
+    parser.add_argument(
+        "--venv_dir",
+        "-v",
+        type=Path,
+        default=None,
+        help="Optional argument. Directory to use for a Python venv. If not provided, no venv is used.",
+    )  # Does nothing. Should be caught and used in shell script already.
+
+    args = parser.parse_args(sys_args)
+
+    if args.venv_dir is not None:
+        error_msg = (
+            f"Venv argument should be caught and used in the wrapping shell script, "
+            f"not in the Python script itself: {args.venv_dir}"
+        )
+        raise SyntaxError(error_msg)
+
+    config = Config(
+        args.ref_genome,
+        args.output,
+        args.per_record,
+        [ContigType[contig_type_name] for contig_type_name in args.contig_types],
+        args.contig_names,
+        [ContigRegion.from_text(region_text) for region_text in args.regions],
+        args.contig_alias_file,
+        args.standardize_names,
+        args.processes,
+    )
+    return config
+
+
+if __name__ == "__main__":
+    main(parse_args(sys.argv[1:]))
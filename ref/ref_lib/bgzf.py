@@ -0,0 +1,95 @@
+import struct
+import zlib
+from pathlib import Path
+from typing import BinaryIO, List, NamedTuple, Dict
+
+BGZF_EOF_BLOCK = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+BGZF_MAX_BLOCK_DATA_SIZE = 0xff00  # same as htslib, so even incompressible data fits in a block of at most 64 KiB
+BGZF_MAX_BLOCK_SIZE = 0x10000
+BGZF_DEFAULT_COMPRESSION_LEVEL = 6
+BGZF_BLOCK_HEADER = struct.Struct("<4BI2BH2BHH")
+BGZF_BLOCK_FOOTER = struct.Struct("<2I")
+GZI_ENTRY_COUNT = struct.Struct("<Q")
+GZI_ENTRY = struct.Struct("<2Q")
+
+
+class BgzfBlockOffset(NamedTuple):
+    compressed_offset: int
+    uncompressed_offset: int
+
+
+class BgzfWriter(object):
+    """
+    Compresses data into BGZF blocks and keeps track of where each block starts, for the .gzi index.
+    Offsets are relative to the position in the file where the writer started, and the EOF block is not written,
+    so separately written parts can be concatenated.
+    """
+    def __init__(self, out_f: BinaryIO, compression_level: int = BGZF_DEFAULT_COMPRESSION_LEVEL) -> None:
+        self._out_f = out_f
+        self._start = out_f.tell()
+        self._compression_level = compression_level
+        self._buffer = bytearray()
+        self._uncompressed_size = 0
+        self._block_offsets: List[BgzfBlockOffset] = []
+        self._stored_block_position_to_data_size: Dict[int, int] = {}
+
+    def write(self, data: bytes) -> None:
+        self._buffer += data
+        while len(self._buffer) >= BGZF_MAX_BLOCK_DATA_SIZE:
+            self._write_block(bytes(self._buffer[:BGZF_MAX_BLOCK_DATA_SIZE]), self._compression_level)
+            del self._buffer[:BGZF_MAX_BLOCK_DATA_SIZE]
+
+    def write_stored_block(self, data: bytes) -> int:
+        # Uncompressed blocks have a size that only depends on the size of the data,
+        # so they can be overwritten in place once the final content is known.
+        if len(data) > BGZF_MAX_BLOCK_DATA_SIZE:
+            raise ValueError(f"Data too large for single BGZF block: {len(data)}")
+        self.flush()
+        position = self._out_f.tell()
+        self._write_block(data, 0)
+        self._stored_block_position_to_data_size[position] = len(data)
+        return position
+
+    def overwrite_stored_block(self, position: int, data: bytes) -> None:
+        if self._stored_block_position_to_data_size.get(position) != len(data):
+            raise ValueError(f"Can only overwrite stored BGZF block with data of the same size: position={position}")
+        current_position = self._out_f.tell()
+        self._out_f.seek(position)
+        self._out_f.write(self._get_block(data, 0))
+        self._out_f.seek(current_position)
+
+    def flush(self) -> None:
+        if self._buffer:
+            self._write_block(bytes(self._buffer), self._compression_level)
+            self._buffer.clear()
+
+    def get_block_offsets(self) -> List[BgzfBlockOffset]:
+        return list(self._block_offsets)
+
+    def get_compressed_size(self) -> int:
+        return self._out_f.tell() - self._start
+
+    def _write_block(self, data: bytes, compression_level: int) -> None:
+        self._block_offsets.append(BgzfBlockOffset(self.get_compressed_size(), self._uncompressed_size))
+        self._out_f.write(self._get_block(data, compression_level))
+        self._uncompressed_size += len(data)
+
+    @classmethod
+    def _get_block(cls, data: bytes, compression_level: int) -> bytes:
+        compressor = zlib.compressobj(compression_level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        compressed_data = compressor.compress(data) + compressor.flush()
+        block_size = BGZF_BLOCK_HEADER.size + len(compressed_data) + BGZF_BLOCK_FOOTER.size
+        if block_size > BGZF_MAX_BLOCK_SIZE:
+            raise ValueError(f"BGZF block too large: {block_size}")
+        header = BGZF_BLOCK_HEADER.pack(31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, block_size - 1)
+        footer = BGZF_BLOCK_FOOTER.pack(zlib.crc32(data), len(data))
+        return header + compressed_data + footer
+
+
+def write_bgzf_index(block_offsets: List[BgzfBlockOffset], index_path: Path) -> None:
+    # Same format as the .gzi index created by bgzip and samtools, which leaves out the first block at offset 0
+    entries = [block_offset for block_offset in block_offsets if block_offset != BgzfBlockOffset(0, 0)]
+    with open(index_path, "wb") as f:
+        f.write(GZI_ENTRY_COUNT.pack(len(entries)))
+        for entry in entries:
+            f.write(GZI_ENTRY.pack(entry.compressed_offset, entry.uncompressed_offset))
@@ -0,0 +1,175 @@
+import base64
+import concurrent.futures
+import logging
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Dict, TypeVar
+
+import google_crc32c
+from google.cloud import storage
+
+from ref_lib.ref_util import assert_dir_exists, assert_file_exists, split_bucket_path, FILE_READ_BUFFER_SIZE
+
+DEFAULT_UPLOAD_THREADS = 16
+COMPOSITE_UPLOAD_THRESHOLD = 1024 * 1024 * 1024
+COMPOSITE_UPLOAD_MIN_PART_SIZE = 128 * 1024 * 1024
+MAX_COMPOSE_SOURCE_COUNT = 32  # limit of the GCS compose API
+COMPOSITE_UPLOAD_PARTS_SUFFIX = ".composite_upload_parts"
+
+T = TypeVar("T")
+
+
+class FilePart(NamedTuple):
+    offset: int
+    size: int
+
+
+class UploadPlan(NamedTuple):
+    source_path: Path
+    blob_name: str
+    crc32c: str  # base64-encoded, like in GCS object metadata
+    parts: List[FilePart]  # empty for a regular upload
+
+    def is_composite(self) -> bool:
+        return bool(self.parts)
+
+    def get_part_blob_name(self, index: int) -> str:
+        return f"{self.blob_name}{COMPOSITE_UPLOAD_PARTS_SUFFIX}/{index:02d}"
+
+
+class BucketUploader(object):
+    """
+    Uploads files to a bucket with a pool of threads that share a single client.
+    Large files are uploaded in parts that are composed into a single object afterwards.
+    Existing objects are never overwritten, but existing objects with the same CRC32C checksum are skipped,
+    so an interrupted upload can simply be restarted.
+    """
+    def __init__(self, client: storage.Client, threads: int = DEFAULT_UPLOAD_THREADS) -> None:
+        self._client = client
+        self._threads = threads
+
+    def upload_directory(self, source_dir: Path, bucket_dir: str) -> None:
+        assert_dir_exists(source_dir)
+        source_path_to_bucket_path = {
+            file_path: f"{bucket_dir}/{file_path.relative_to(source_dir)}"
+            for file_path in sorted(source_dir.glob("**/*")) if file_path.is_file()
+        }
+        self.upload_files(source_path_to_bucket_path)
+
+    def upload_files(self, source_path_to_bucket_path: Dict[Path, str]) -> None:
+        bucket_names = {split_bucket_path(bucket_path)[0] for bucket_path in source_path_to_bucket_path.values()}
+        if len(bucket_names) > 1:
+            raise ValueError(f"Can only upload to a single bucket at a time: {sorted(bucket_names)}")
+        if not bucket_names:
+            return
+        bucket = self._client.bucket(bucket_names.pop())
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self._threads) as executor:
+            plan_futures = [
+                executor.submit(self._get_upload_plan, bucket, source_path, split_bucket_path(bucket_path)[1])
+                for source_path, bucket_path in source_path_to_bucket_path.items()
+            ]
+            upload_plans = [plan for plan in self._get_results(plan_futures) if plan is not None]
+
+            composite_upload_plans = [upload_plan for upload_plan in upload_plans if upload_plan.is_composite()]
+            upload_futures: List["concurrent.futures.Future[None]"] = []
+            try:
+                # Parts of all files are uploaded in the same pool, so a few large files still use all threads
+                for upload_plan in upload_plans:
+                    if upload_plan.is_composite():
+                        for index, part in enumerate(upload_plan.parts):
+                            upload_futures.append(executor.submit(self._upload_part, bucket, upload_plan, index, part))
+                    else:
+                        upload_futures.append(executor.submit(self._upload_whole_file, bucket, upload_plan))
+                self._get_results(upload_futures)
+
+                compose_futures = [
+                    executor.submit(self._compose_parts, bucket, upload_plan) for upload_plan in composite_upload_plans
+                ]
+                upload_futures.extend(compose_futures)
+                self._get_results(compose_futures)
+            finally:
+                # Parts are also removed when an upload fails, once no part upload is running anymore
+                concurrent.futures.wait(upload_futures)
+                self._get_results([
+                    executor.submit(self._delete_parts, bucket, upload_plan) for upload_plan in composite_upload_plans
+                ])
+
+    @classmethod
+    def _get_upload_plan(cls, bucket: storage.Bucket, source_path: Path, blob_name: str) -> Optional[UploadPlan]:
+        assert_file_exists(source_path)
+        crc32c = get_crc32c_of_file(source_path)
+        existing_blob = bucket.get_blob(blob_name)
+        if existing_blob is not None:
+            if existing_blob.crc32c == crc32c:
+                logging.info(f"Skipping upload of {source_path}, since identical file already exists: {blob_name}")
+                return None
+            raise FileExistsError(f"Cannot upload file {source_path} since it would overwrite an existing file.")
+        return UploadPlan(source_path, blob_name, crc32c, cls._get_file_parts(source_path.stat().st_size))
+
+    @classmethod
+    def _get_file_parts(cls, file_size: int) -> List[FilePart]:
+        if file_size < COMPOSITE_UPLOAD_THRESHOLD:
+            return []
+        part_size = max(COMPOSITE_UPLOAD_MIN_PART_SIZE, -(-file_size // MAX_COMPOSE_SOURCE_COUNT))
+        return [
+            FilePart(offset, min(part_size, file_size - offset)) for offset in range(0, file_size, part_size)
+        ]
+
+    @classmethod
+    def _upload_whole_file(cls, bucket: storage.Bucket, upload_plan: UploadPlan) -> None:
+        logging.info(f"Uploading {upload_plan.source_path} to {upload_plan.blob_name}")
+        blob = bucket.blob(upload_plan.blob_name)
+        # The generation match makes the upload fail if the object was created in the meantime
+        blob.upload_from_filename(str(upload_plan.source_path), if_generation_match=0)
+        cls._assert_blob_has_crc32c(blob, upload_plan.crc32c)
+        logging.info(f"Finished upload of {upload_plan.source_path} to {upload_plan.blob_name}")
+
+    @classmethod
+    def _upload_part(cls, bucket: storage.Bucket, upload_plan: UploadPlan, index: int, part: FilePart) -> None:
+        logging.info(f"Uploading part {index + 1}/{len(upload_plan.parts)} of {upload_plan.source_path}")
+        blob = bucket.blob(upload_plan.get_part_blob_name(index))
+        with open(upload_plan.source_path, "rb") as f:
+            f.seek(part.offset)
+            blob.upload_from_file(f, size=part.size, rewind=False)
+        blob.reload()
+        if blob.size != part.size:
+            raise ValueError(f"Uploaded part has unexpected size: part={blob.name}, size={blob.size}")
+
+    @classmethod
+    def _compose_parts(cls, bucket: storage.Bucket, upload_plan: UploadPlan) -> None:
+        logging.info(f"Composing {len(upload_plan.parts)} parts into {upload_plan.blob_name}")
+        part_blobs = [bucket.blob(upload_plan.get_part_blob_name(index)) for index in range(len(upload_plan.parts))]
+        blob = bucket.blob(upload_plan.blob_name)
+        blob.compose(part_blobs, if_generation_match=0)
+        cls._assert_blob_has_crc32c(blob, upload_plan.crc32c)
+        logging.info(f"Finished upload of {upload_plan.source_path} to {upload_plan.blob_name}")
+
+    @classmethod
+    def _delete_parts(cls, bucket: storage.Bucket, upload_plan: UploadPlan) -> None:
+        # Parts that were never uploaded are skipped
+        part_blob_names = [upload_plan.get_part_blob_name(index) for index in range(len(upload_plan.parts))]
+        bucket.delete_blobs(part_blob_names, on_error=lambda blob: None)
+
+    @classmethod
+    def _assert_blob_has_crc32c(cls, blob: storage.Blob, crc32c: str) -> None:
+        blob.reload()
+        if blob.crc32c != crc32c:
+            raise ValueError(f"Checksum of uploaded file does not match: blob={blob.name}, crc32c={blob.crc32c}")
+
+    @classmethod
+    def _get_results(cls, futures: List["concurrent.futures.Future[T]"]) -> List[T]:
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as exc:
+                raise ValueError(exc)
+        return results
+
+
+def get_crc32c_of_file(path: Path) -> str:
+    checksum = google_crc32c.Checksum()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(FILE_READ_BUFFER_SIZE), b""):
+            checksum.update(block)
+    return base64.b64encode(checksum.digest()).decode("ascii")
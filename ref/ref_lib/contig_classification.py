@@ -1,4 +1,4 @@
-from typing import NamedTuple, Tuple, List
+from typing import NamedTuple, Tuple, List, Dict, Iterable
 
 from ref_lib.contig_name_translation import ContigNameTranslator
 from ref_lib.contig_types import ContigType
@@ -48,6 +48,8 @@ class ContigCategorizer(object):
 
     def __init__(self, contig_name_translator: ContigNameTranslator) -> None:
         self._contig_name_translator = contig_name_translator
+        # Many aliases share a standardized name, so contig types are determined once per standardized name
+        self._standardized_name_to_contig_type: Dict[str, ContigType] = {}
 
     def get_categorized_contig_names(
             self,
@@ -66,9 +68,7 @@ class ContigCategorizer(object):
         novel_patch_contigs: List[str] = []
         uncategorized_contigs: List[str] = []
 
-        for contig_name in contig_names:
-            contig_type = self.get_contig_type(contig_name)
-
+        for contig_name, contig_type in zip(contig_names, self.categorize_many(contig_names)):
             if contig_type == ContigType.AUTOSOME:
                 autosome_contigs.append(contig_name)
             elif contig_type == ContigType.X:
@@ -123,28 +123,78 @@ class ContigCategorizer(object):
         return categorized_contigs
 
     def get_contig_type(self, contig_name: str) -> ContigType:
+        return self._get_contig_type_of_standardized_name(self._contig_name_translator.standardize(contig_name))
+
+    def categorize_many(self, contig_names: Iterable[str]) -> List[ContigType]:
+        return [
+            self._get_contig_type_of_standardized_name(standardized_contig_name)
+            for standardized_contig_name in self._contig_name_translator.standardize_many(contig_names)
+        ]
+
+    def is_autosome_contig_name(self, contig_name: str) -> bool:
+        return self._is_autosome_name(self._contig_name_translator.standardize(contig_name))
+
+    def is_x_contig_name(self, contig_name: str) -> bool:
+        return self._is_x_name(self._contig_name_translator.standardize(contig_name))
+
+    def is_y_contig_name(self, contig_name: str) -> bool:
+        return self._is_y_name(self._contig_name_translator.standardize(contig_name))
+
+    def is_mitochondrial_contig_name(self, contig_name: str) -> bool:
+        return self._is_mitochondrial_name(self._contig_name_translator.standardize(contig_name))
+
+    def is_ebv_contig_name(self, contig_name: str) -> bool:
+        return self._is_ebv_name(self._contig_name_translator.standardize(contig_name))
+
+    def is_decoy_contig_name(self, contig_name: str) -> bool:
+        return self._is_decoy_name(self._contig_name_translator.standardize(contig_name))
+
+    def is_unlocalized_contig_name(self, contig_name: str) -> bool:
+        return self._is_unlocalized_name(self._contig_name_translator.standardize(contig_name))
+
+    def is_unplaced_contig_name(self, contig_name: str) -> bool:
+        return self._is_unplaced_name(self._contig_name_translator.standardize(contig_name))
+
+    def is_alt_contig_name(self, contig_name: str) -> bool:
+        return self._is_alt_name(self._contig_name_translator.standardize(contig_name))
+
+    def is_fix_patch_contig_name(self, contig_name: str) -> bool:
+        return self._is_fix_patch_name(self._contig_name_translator.standardize(contig_name))
+
+    def is_novel_patch_contig_name(self, contig_name: str) -> bool:
+        return self._is_novel_patch_name(self._contig_name_translator.standardize(contig_name))
+
+    def _get_contig_type_of_standardized_name(self, standardized_contig_name: str) -> ContigType:
+        if standardized_contig_name not in self._standardized_name_to_contig_type:
+            self._standardized_name_to_contig_type[standardized_contig_name] = self._determine_contig_type(
+                standardized_contig_name,
+            )
+        return self._standardized_name_to_contig_type[standardized_contig_name]
+
+    @classmethod
+    def _determine_contig_type(cls, standardized_contig_name: str) -> ContigType:
         matching_contig_types = []
-        if self.is_autosome_contig_name(contig_name):
+        if cls._is_autosome_name(standardized_contig_name):
             matching_contig_types.append(ContigType.AUTOSOME)
-        if self.is_x_contig_name(contig_name):
+        if cls._is_x_name(standardized_contig_name):
             matching_contig_types.append(ContigType.X)
-        if self.is_y_contig_name(contig_name):
+        if cls._is_y_name(standardized_contig_name):
             matching_contig_types.append(ContigType.Y)
-        if self.is_mitochondrial_contig_name(contig_name):
+        if cls._is_mitochondrial_name(standardized_contig_name):
             matching_contig_types.append(ContigType.MITOCHONDRIAL)
-        if self.is_ebv_contig_name(contig_name):
+        if cls._is_ebv_name(standardized_contig_name):
             matching_contig_types.append(ContigType.EBV)
-        if self.is_decoy_contig_name(contig_name):
+        if cls._is_decoy_name(standardized_contig_name):
             matching_contig_types.append(ContigType.DECOY)
-        if self.is_unlocalized_contig_name(contig_name):
+        if cls._is_unlocalized_name(standardized_contig_name):
             matching_contig_types.append(ContigType.UNLOCALIZED)
-        if self.is_unplaced_contig_name(contig_name):
+        if cls._is_unplaced_name(standardized_contig_name):
             matching_contig_types.append(ContigType.UNPLACED)
-        if self.is_alt_contig_name(contig_name):
+        if cls._is_alt_name(standardized_contig_name):
             matching_contig_types.append(ContigType.ALT)
-        if self.is_fix_patch_contig_name(contig_name):
+        if cls._is_fix_patch_name(standardized_contig_name):
             matching_contig_types.append(ContigType.FIX_PATCH)
-        if self.is_novel_patch_contig_name(contig_name):
+        if cls._is_novel_patch_name(standardized_contig_name):
             matching_contig_types.append(ContigType.NOVEL_PATCH)
 
         if len(matching_contig_types) == 1:
@@ -154,70 +204,70 @@ class ContigCategorizer(object):
         else:
             raise ValueError(f"Contig matches multiple contig types: {matching_contig_types}")
 
-    def is_autosome_contig_name(self, contig_name: str) -> bool:
-        standardized_contig_name = self._contig_name_translator.standardize(contig_name)
-        return standardized_contig_name in self.AUTOSOME_CONTIG_NAMES
+    @classmethod
+    def _is_autosome_name(cls, standardized_contig_name: str) -> bool:
+        return standardized_contig_name in cls.AUTOSOME_CONTIG_NAMES
 
-    def is_x_contig_name(self, contig_name: str) -> bool:
-        standardized_contig_name = self._contig_name_translator.standardize(contig_name)
-        return standardized_contig_name == self.X_CHROMOSOME_CONTIG_NAME
+    @classmethod
+    def _is_x_name(cls, standardized_contig_name: str) -> bool:
+        return standardized_contig_name == cls.X_CHROMOSOME_CONTIG_NAME
 
-    def is_y_contig_name(self, contig_name: str) -> bool:
-        standardized_contig_name = self._contig_name_translator.standardize(contig_name)
-        return standardized_contig_name == self.Y_CHROMOSOME_CONTIG_NAME
+    @classmethod
+    def _is_y_name(cls, standardized_contig_name: str) -> bool:
+        return standardized_contig_name == cls.Y_CHROMOSOME_CONTIG_NAME
 
-    def is_mitochondrial_contig_name(self, contig_name: str) -> bool:
-        standardized_contig_name = self._contig_name_translator.standardize(contig_name)
-        return standardized_contig_name == self.MITOCHONDRIAL_CONTIG_NAME
+    @classmethod
+    def _is_mitochondrial_name(cls, standardized_contig_name: str) -> bool:
+        return standardized_contig_name == cls.MITOCHONDRIAL_CONTIG_NAME
 
-    def is_ebv_contig_name(self, contig_name: str) -> bool:
-        standardized_contig_name = self._contig_name_translator.standardize(contig_name)
-        return standardized_contig_name == self.EBV_CONTIG_NAME
+    @classmethod
+    def _is_ebv_name(cls, standardized_contig_name: str) -> bool:
+        return standardized_contig_name == cls.EBV_CONTIG_NAME
 
-    def is_decoy_contig_name(self, contig_name: str) -> bool:
-        standardized_contig_name = self._contig_name_translator.standardize(contig_name)
+    @classmethod
+    def _is_decoy_name(cls, standardized_contig_name: str) -> bool:
         result = (
-            standardized_contig_name.startswith(self.UNPLACED_PREFIX)
-            and standardized_contig_name.endswith(self.DECOY_SUFFIX)
+            standardized_contig_name.startswith(cls.UNPLACED_PREFIX)
+            and standardized_contig_name.endswith(cls.DECOY_SUFFIX)
         )
         return result
 
-    def is_unlocalized_contig_name(self, contig_name: str) -> bool:
-        standardized_contig_name = self._contig_name_translator.standardize(contig_name)
+    @classmethod
+    def _is_unlocalized_name(cls, standardized_contig_name: str) -> bool:
         result = (
-            not standardized_contig_name.startswith(self.UNPLACED_PREFIX)
-            and standardized_contig_name.endswith(self.UNLOCALIZED_SUFFIX)
+            not standardized_contig_name.startswith(cls.UNPLACED_PREFIX)
+            and standardized_contig_name.endswith(cls.UNLOCALIZED_SUFFIX)
         )
         return result
 
-    def is_unplaced_contig_name(self, contig_name: str) -> bool:
-        standardized_contig_name = self._contig_name_translator.standardize(contig_name)
+    @classmethod
+    def _is_unplaced_name(cls, standardized_contig_name: str) -> bool:
         result = (
-            standardized_contig_name.startswith(self.UNPLACED_PREFIX)
-            and not standardized_contig_name.endswith(self.DECOY_SUFFIX)
+            standardized_contig_name.startswith(cls.UNPLACED_PREFIX)
+            and not standardized_contig_name.endswith(cls.DECOY_SUFFIX)
         )
         return result
 
-    def is_alt_contig_name(self, contig_name: str) -> bool:
-        standardized_contig_name = self._contig_name_translator.standardize(contig_name)
+    @classmethod
+    def _is_alt_name(cls, standardized_contig_name: str) -> bool:
         result = (
-            not standardized_contig_name.startswith(self.UNPLACED_PREFIX)
-            and standardized_contig_name.endswith(self.ALT_SUFFIX)
+            not standardized_contig_name.startswith(cls.UNPLACED_PREFIX)
+            and standardized_contig_name.endswith(cls.ALT_SUFFIX)
         )
         return result
 
-    def is_fix_patch_contig_name(self, contig_name: str) -> bool:
-        standardized_contig_name = self._contig_name_translator.standardize(contig_name)
+    @classmethod
+    def _is_fix_patch_name(cls, standardized_contig_name: str) -> bool:
         result = (
-            not standardized_contig_name.startswith(self.UNPLACED_PREFIX)
-            and standardized_contig_name.endswith(self.FIX_PATCH_SUFFIX)
+            not standardized_contig_name.startswith(cls.UNPLACED_PREFIX)
+            and standardized_contig_name.endswith(cls.FIX_PATCH_SUFFIX)
         )
         return result
 
-    def is_novel_patch_contig_name(self, contig_name: str) -> bool:
-        standardized_contig_name = self._contig_name_translator.standardize(contig_name)
+    @classmethod
+    def _is_novel_patch_name(cls, standardized_contig_name: str) -> bool:
         result = (
-            not standardized_contig_name.startswith(self.UNPLACED_PREFIX)
-            and standardized_contig_name.endswith(self.NOVEL_PATCH_SUFFIX)
+            not standardized_contig_name.startswith(cls.UNPLACED_PREFIX)
+            and standardized_contig_name.endswith(cls.NOVEL_PATCH_SUFFIX)
         )
         return result
@@ -0,0 +1,96 @@
+import concurrent.futures
+import hashlib
+from pathlib import Path
+from typing import NamedTuple, Tuple, List, Dict, Optional
+
+import numpy as np
+import numpy.typing as npt
+
+from ref_lib.fasta_reader import FastaReader, open_fasta_reader
+from ref_lib.ref_util import UPPERCASE_TRANSLATION_TABLE, get_temp_path, make_temp_version_final
+
+CONTIG_DIGEST_FILE_SUFFIX = ".contig_digests.tsv"
+
+
+class ContigDigest(NamedTuple):
+    name: str
+    length: int
+    md5: str  # of the uppercased sequence, like the M5 tag in SAM headers
+    composition: Tuple[Tuple[str, int], ...]  # sorted (symbol, count) pairs, case-sensitive
+
+    def get_symbol_to_count(self) -> Dict[str, int]:
+        return dict(self.composition)
+
+
+class ContigDigester(object):
+    """Computes the digest of a contig sequence from consecutive windows of that sequence."""
+    def __init__(self, name: str) -> None:
+        self._name = name
+        self._md5 = hashlib.md5()
+        self._length = 0
+        self._symbol_counts: npt.NDArray[np.int64] = np.zeros(256, dtype=np.int64)
+
+    @classmethod
+    def digest_contig(cls, fasta_f: FastaReader, contig_name: str) -> ContigDigest:
+        digester = cls(contig_name)
+        for window in fasta_f.iterate_windows(contig_name):
+            digester.update(window)
+        return digester.get_digest()
+
+    @classmethod
+    def digest_contig_in_file(cls, fasta_path: Path, contig_name: str) -> ContigDigest:
+        # Lets worker processes read the sequence themselves, instead of receiving it from the parent process
+        with open_fasta_reader(fasta_path) as fasta_f:
+            return cls.digest_contig(fasta_f, contig_name)
+
+    @classmethod
+    def digest_contigs_in_file(
+            cls, fasta_path: Path, contig_names: List[str], processes: Optional[int] = None,
+    ) -> List[ContigDigest]:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+            return list(executor.map(cls.digest_contig_in_file, [fasta_path] * len(contig_names), contig_names))
+
+    def update(self, window: bytes) -> None:
+        self._md5.update(window if window.isupper() else window.translate(UPPERCASE_TRANSLATION_TABLE))
+        self._length += len(window)
+        self._symbol_counts += np.bincount(np.frombuffer(window, dtype=np.uint8), minlength=256)
+
+    def get_digest(self) -> ContigDigest:
+        composition = tuple(
+            (chr(symbol), int(self._symbol_counts[symbol])) for symbol in np.flatnonzero(self._symbol_counts)
+        )
+        return ContigDigest(self._name, self._length, self._md5.hexdigest(), composition)
+
+
+class ContigDigestTable(object):
+    COLUMNS = ["name", "length", "md5", "composition"]
+
+    @classmethod
+    def get_path(cls, fasta_path: Path) -> Path:
+        return Path(f"{fasta_path}{CONTIG_DIGEST_FILE_SUFFIX}")
+
+    @classmethod
+    def write(cls, digests: List[ContigDigest], path: Path) -> None:
+        lines = ["\t".join(cls.COLUMNS)]
+        for digest in digests:
+            composition_text = ",".join(f"{symbol}:{count}" for symbol, count in digest.composition)
+            lines.append("\t".join([digest.name, str(digest.length), digest.md5, composition_text]))
+        with open(get_temp_path(path), "w") as f:
+            f.write("\n".join(lines) + "\n")
+        make_temp_version_final(path)
+
+    @classmethod
+    def read(cls, path: Path) -> List[ContigDigest]:
+        digests = []
+        with open(path, "r") as f:
+            header = f.readline().rstrip("\n").split("\t")
+            if header != cls.COLUMNS:
+                raise ValueError(f"Unexpected header in contig digest file {path}: {header}")
+            for line in f:
+                name, length, md5, composition_text = line.rstrip("\n").split("\t")
+                composition = tuple(
+                    (entry.rsplit(":", 1)[0], int(entry.rsplit(":", 1)[1]))
+                    for entry in composition_text.split(",") if entry
+                )
+                digests.append(ContigDigest(name, int(length), md5, composition))
+        return digests
@@ -3,10 +3,10 @@ import re
 from collections import defaultdict
 from copy import deepcopy
 from pathlib import Path
-from typing import Dict, NamedTuple, Optional, Set, DefaultDict, List
+from typing import Dict, NamedTuple, Optional, Set, DefaultDict, List, Iterable, Tuple
 
 from ref_lib.contig_types import ContigType
-from ref_lib.ref_util import get_text_from_file, get_temp_path, make_temp_version_final
+from ref_lib.ref_util import get_text_from_file, get_temp_path, make_temp_version_final, get_md5_of_file
 from ref_lib.source_files import SourceFile, SourceFileLocator
 
 
@@ -14,6 +14,16 @@ class ContigNameTranslator(object):
     """Standardizes names if it can. Returns argument as is if it cannot."""
     def __init__(self, contig_name_to_canonical_name: Dict[str, str]) -> None:
         self._contig_name_to_canonical_name = deepcopy(contig_name_to_canonical_name)
+        self._canonical_names = set(self._contig_name_to_canonical_name.values())
+
+    @classmethod
+    def from_contig_alias_file(cls, path: Path) -> "ContigNameTranslator":
+        # Parsed once per process. The file stats are part of the key, so a replaced file is parsed again.
+        stat_result = path.stat()
+        cache_key = (str(path.resolve()), stat_result.st_size, stat_result.st_mtime_ns)
+        if cache_key not in _alias_file_cache_key_to_translator:
+            _alias_file_cache_key_to_translator[cache_key] = cls.from_contig_alias_text(get_text_from_file(path))
+        return _alias_file_cache_key_to_translator[cache_key]
 
     @classmethod
     def from_contig_alias_text(cls, text: str) -> "ContigNameTranslator":
@@ -34,8 +44,24 @@ class ContigNameTranslator(object):
         else:
             raise ValueError(f"Could not standardize '{contig_name}'")
 
+    def standardize_many(self, contig_names: Iterable[str]) -> List[str]:
+        contig_name_list = list(contig_names)
+        unknown_contig_names = [
+            contig_name for contig_name in contig_name_list if contig_name not in self._contig_name_to_canonical_name
+        ]
+        if unknown_contig_names:
+            raise ValueError(f"Could not standardize {unknown_contig_names}")
+        return [self._contig_name_to_canonical_name[contig_name] for contig_name in contig_name_list]
+
+    def is_known(self, contig_name: str) -> bool:
+        return contig_name in self._contig_name_to_canonical_name
+
     def is_canonical(self, contig_name: str) -> bool:
-        return contig_name in self._contig_name_to_canonical_name.values()
+        return contig_name in self._canonical_names
+
+
+# Translators created from alias files in the current process, by path and file stats
+_alias_file_cache_key_to_translator: Dict[Tuple[str, int, int], ContigNameTranslator] = {}
 
 
 class ContigSummary(NamedTuple):
@@ -88,6 +114,12 @@ class ContigSummary(NamedTuple):
         return contig
 
 
+class InterpretedContigSummary(NamedTuple):
+    contig_type: ContigType
+    canonical_name: str
+    aliases: Tuple[str, ...]  # sorted
+
+
 class ContigSummaryInterpreter(object):
     ASSIGNED_MOLECULES_AUTOSOME = {str(i) for i in range(1, 23)}
     ASSIGNED_MOLECULE_X = "X"
@@ -113,8 +145,19 @@ class ContigSummaryInterpreter(object):
     CONTIG_ROLE_ALT = "alt-scaffold"
 
     @classmethod
-    def get_canonical_name(cls, summary: ContigSummary) -> str:
+    def interpret(cls, summary: ContigSummary) -> InterpretedContigSummary:
+        # Determines contig type and canonical name only once, unlike calling the separate getters
         contig_type = cls.get_contig_type(summary)
+        canonical_name = cls._get_canonical_name_of_type(summary, contig_type)
+        aliases = cls._get_aliases_with_canonical_name(summary, canonical_name)
+        return InterpretedContigSummary(contig_type, canonical_name, tuple(sorted(aliases)))
+
+    @classmethod
+    def get_canonical_name(cls, summary: ContigSummary) -> str:
+        return cls._get_canonical_name_of_type(summary, cls.get_contig_type(summary))
+
+    @classmethod
+    def _get_canonical_name_of_type(cls, summary: ContigSummary, contig_type: ContigType) -> str:
         assigned_molecule_proper_name = cls.get_assigned_molecule_proper_name(summary.assigned_molecule)
         genbank_accession_without_dot = summary.genbank_accession_number.replace(".", "v")
         if contig_type == ContigType.AUTOSOME:
@@ -157,12 +200,16 @@ class ContigSummaryInterpreter(object):
 
     @classmethod
     def get_aliases(cls, summary: ContigSummary) -> Set[str]:
+        return cls._get_aliases_with_canonical_name(summary, cls.get_canonical_name(summary))
+
+    @classmethod
+    def _get_aliases_with_canonical_name(cls, summary: ContigSummary, canonical_name: str) -> Set[str]:
         aliases = {
-            cls.get_canonical_name(summary),
+            canonical_name,
             summary.sequence_name,
             summary.genbank_accession_number,
             f"CHR_{summary.sequence_name}",
-            cls.get_canonical_name(summary)[3:],
+            canonical_name[3:],
         }
         if summary.refseq_accession_number is not None:
             aliases.add(summary.refseq_accession_number)
@@ -322,31 +369,85 @@ class ContigSummaryInterpreter(object):
 
 
 class AliasToCanonicalContigNameTextWriter(object):
+    # Increase when the interpretation of assembly reports changes, to invalidate cached interpretations
+    INTERPRETED_REPORT_CACHE_VERSION = 1
+
     @classmethod
-    def create_contig_alias_file(cls, output_path: Path, source_files_dir: Path) -> None:
-        assembly_reports_text = "\n".join([
-            get_text_from_file(SourceFileLocator().get_location(source_file, source_files_dir))
-            for source_file in SourceFile.get_required_for_contig_alias_file()
-        ])
-        contig_alias_text = AliasToCanonicalContigNameTextWriter._create_text_from_assembly_reports_text(
-            assembly_reports_text
-        )
+    def create_contig_alias_file(
+            cls, output_path: Path, source_files_dir: Path, cache_dir: Optional[Path] = None,
+    ) -> None:
+        # With a cache dir, each assembly report is only parsed and interpreted if its checksum hasn't been seen before
+        interpreted_summaries: List[InterpretedContigSummary] = []
+        for source_file in SourceFile.get_required_for_contig_alias_file():
+            assembly_report_path = SourceFileLocator().get_location(source_file, source_files_dir)
+            interpreted_summaries.extend(cls._get_interpreted_summaries(assembly_report_path, cache_dir))
+        contig_alias_text = cls._create_text_from_interpreted_summaries(interpreted_summaries)
         with open(get_temp_path(output_path), "w") as f:
             f.write(contig_alias_text)
         make_temp_version_final(output_path)
 
+    @classmethod
+    def _get_interpreted_summaries(
+            cls, assembly_report_path: Path, cache_dir: Optional[Path],
+    ) -> List[InterpretedContigSummary]:
+        if cache_dir is None:
+            return cls._interpret_assembly_report_text(get_text_from_file(assembly_report_path))
+
+        cache_path = (
+            cache_dir / f"{get_md5_of_file(assembly_report_path)}.v{cls.INTERPRETED_REPORT_CACHE_VERSION}.tsv"
+        )
+        if cache_path.exists():
+            logging.info(f"Using cached interpretation of {assembly_report_path}: {cache_path}")
+            return cls._read_interpreted_summaries(cache_path)
+
+        interpreted_summaries = cls._interpret_assembly_report_text(get_text_from_file(assembly_report_path))
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        cls._write_interpreted_summaries(interpreted_summaries, cache_path)
+        return interpreted_summaries
+
+    @classmethod
+    def _interpret_assembly_report_text(cls, assembly_report_text: str) -> List[InterpretedContigSummary]:
+        return [
+            ContigSummaryInterpreter.interpret(summary) for summary in cls._get_contig_summaries(assembly_report_text)
+        ]
+
+    @classmethod
+    def _write_interpreted_summaries(cls, interpreted_summaries: List[InterpretedContigSummary], path: Path) -> None:
+        lines = [
+            "\t".join([summary.contig_type.name, summary.canonical_name, *summary.aliases])
+            for summary in interpreted_summaries
+        ]
+        with open(get_temp_path(path), "w") as f:
+            f.write("".join(f"{line}\n" for line in lines))
+        make_temp_version_final(path)
+
+    @classmethod
+    def _read_interpreted_summaries(cls, path: Path) -> List[InterpretedContigSummary]:
+        interpreted_summaries = []
+        for line in get_text_from_file(path).split("\n"):
+            if not line:
+                continue
+            contig_type_name, canonical_name, *aliases = line.split("\t")
+            interpreted_summaries.append(
+                InterpretedContigSummary(ContigType[contig_type_name], canonical_name, tuple(aliases)),
+            )
+        return interpreted_summaries
+
     @classmethod
     def _create_text_from_assembly_reports_text(cls, assembly_reports_text: str) -> str:
+        return cls._create_text_from_interpreted_summaries(cls._interpret_assembly_report_text(assembly_reports_text))
+
+    @classmethod
+    def _create_text_from_interpreted_summaries(cls, interpreted_summaries: List[InterpretedContigSummary]) -> str:
         # We don't use the UCSC-style names from the file because not all contigs have such a name in the file,
         # and because alt scaffolds ans novel patches share the '_alt' suffix in this file.
         # We instead use '_novel' for novel patches.
-        contig_summaries = cls._get_contig_summaries(assembly_reports_text)
-        canonical_contig_name_to_aliases = cls._get_canonical_name_to_aliases(contig_summaries)
+        canonical_contig_name_to_aliases = cls._get_canonical_name_to_aliases(interpreted_summaries)
         logging.debug(f"canonical_contig_name_to_aliases=\n{canonical_contig_name_to_aliases}")
 
         cls._assert_no_contradictions(canonical_contig_name_to_aliases)
 
-        sorted_canonical_contig_names = cls._get_sorted_canonical_contig_names(contig_summaries)
+        sorted_canonical_contig_names = cls._get_sorted_canonical_contig_names(interpreted_summaries)
 
         alias_canonical_name_pairs = [
             (alias, canonical_name)
@@ -372,13 +473,12 @@ class AliasToCanonicalContigNameTextWriter(object):
         return summaries
 
     @classmethod
-    def _get_canonical_name_to_aliases(cls, contig_summaries: List[ContigSummary]) -> Dict[str, Set[str]]:
+    def _get_canonical_name_to_aliases(
+            cls, interpreted_summaries: List[InterpretedContigSummary],
+    ) -> Dict[str, Set[str]]:
         result: DefaultDict[str, Set[str]] = defaultdict(set)
-        for summary in contig_summaries:
-            canonical_name = ContigSummaryInterpreter.get_canonical_name(summary)
-            aliases = ContigSummaryInterpreter.get_aliases(summary)
-
-            result[canonical_name] = result[canonical_name].union(aliases)
+        for summary in interpreted_summaries:
+            result[summary.canonical_name].update(summary.aliases)
 
         return dict(result)
 
@@ -406,10 +506,9 @@ class AliasToCanonicalContigNameTextWriter(object):
             raise ValueError(error_msg)
 
     @classmethod
-    def _get_sorted_canonical_contig_names(cls, contig_summaries: List[ContigSummary]) -> List[str]:
+    def _get_sorted_canonical_contig_names(cls, interpreted_summaries: List[InterpretedContigSummary]) -> List[str]:
         contig_type_canonical_name_pairs = {
-            (ContigSummaryInterpreter.get_contig_type(summary), ContigSummaryInterpreter.get_canonical_name(summary))
-            for summary in contig_summaries
+            (summary.contig_type, summary.canonical_name) for summary in interpreted_summaries
         }
         sorted_contig_type_canonical_name_pairs = sorted(
             contig_type_canonical_name_pairs,
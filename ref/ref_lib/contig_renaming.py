@@ -0,0 +1,171 @@
+import contextlib
+import gzip
+import logging
+import re
+import shutil
+import subprocess
+from pathlib import Path
+from typing import Dict, IO, Iterable, Iterator, Optional
+
+import pysam
+
+from ref_lib.contig_name_translation import ContigNameTranslator
+from ref_lib.ref_util import get_temp_path, make_temp_version_final
+
+VCF_SUFFIXES = (".vcf", ".vcf.gz", ".vcf.bgz")
+ALIGNMENT_SUFFIXES = (".bam", ".cram")
+
+
+class ContigRenamer(object):
+    """Renames contigs to their standardized names, remembering earlier answers since names repeat constantly."""
+    def __init__(self, contig_name_translator: ContigNameTranslator, keep_unknown_names: bool) -> None:
+        self._contig_name_translator = contig_name_translator
+        self._keep_unknown_names = keep_unknown_names
+        self._contig_name_to_new_name: Dict[bytes, bytes] = {}
+
+    def rename(self, contig_name: bytes) -> bytes:
+        if contig_name not in self._contig_name_to_new_name:
+            self._contig_name_to_new_name[contig_name] = self._get_new_name(contig_name)
+        return self._contig_name_to_new_name[contig_name]
+
+    def _get_new_name(self, contig_name: bytes) -> bytes:
+        decoded_contig_name = contig_name.decode("ascii")
+        try:
+            new_name = self._contig_name_translator.standardize(decoded_contig_name)
+        except ValueError:
+            if not self._keep_unknown_names:
+                raise
+            logging.warning(f"Keeping name of unknown contig: {decoded_contig_name}")
+            new_name = decoded_contig_name
+        return new_name.encode("ascii")
+
+
+class VcfContigRenamer(object):
+    """
+    Streams a VCF file line by line, renaming the contigs in the CHROM column and in the ##contig header lines.
+    The output is BGZF-compressed, so it can be indexed with tabix.
+    """
+    CONTIG_HEADER_PATTERN = re.compile(rb"^(##contig=<(?:[^>]*,)?ID=)([^,>]+)")
+
+    @classmethod
+    def rename_contigs(
+            cls, input_path: Path, output_path: Path, contig_renamer: ContigRenamer, threads: int, index: bool,
+    ) -> None:
+        if not output_path.name.endswith(".gz"):
+            raise ValueError(f"Output VCF needs to have a '.gz' extension, since it is BGZF-compressed: {output_path}")
+
+        temp_output_path = get_temp_path(output_path)
+        try:
+            with cls._open_input(input_path) as in_f, cls._open_bgzf_output(temp_output_path, threads) as out_f:
+                cls._rename_contigs_in_stream(in_f, out_f, contig_renamer)
+        except BaseException:
+            temp_output_path.unlink(missing_ok=True)
+            raise
+        make_temp_version_final(output_path)
+
+        if index:
+            logging.info(f"Indexing {output_path}")
+            pysam.tabix_index(str(output_path), preset="vcf", force=True)
+
+    @classmethod
+    def _rename_contigs_in_stream(cls, in_f: Iterable[bytes], out_f: IO[bytes], contig_renamer: ContigRenamer) -> None:
+        # Records of the same contig come in long runs, so the previous lookup is reused until the contig changes
+        previous_contig_name: Optional[bytes] = None
+        previous_new_contig_name = b""
+        for line in in_f:
+            if line.startswith(b"#"):
+                out_f.write(cls.CONTIG_HEADER_PATTERN.sub(
+                    lambda match: match.group(1) + contig_renamer.rename(match.group(2)), line, count=1,
+                ))
+                continue
+
+            tab_index = line.find(b"\t")
+            if tab_index == -1:
+                raise ValueError(f"VCF record without tab: {line!r}")
+            contig_name = line[:tab_index]
+            if contig_name != previous_contig_name:
+                previous_contig_name = contig_name
+                previous_new_contig_name = contig_renamer.rename(contig_name)
+            out_f.write(previous_new_contig_name + line[tab_index:])
+
+    @classmethod
+    @contextlib.contextmanager
+    def _open_input(cls, input_path: Path) -> Iterator[Iterable[bytes]]:
+        with open(input_path, "rb") as f:
+            is_gzipped = f.read(2) == b"\x1f\x8b"
+        with (gzip.open(input_path, "rb") if is_gzipped else open(input_path, "rb")) as in_f:
+            yield in_f
+
+    @classmethod
+    @contextlib.contextmanager
+    def _open_bgzf_output(cls, output_path: Path, threads: int) -> Iterator[IO[bytes]]:
+        # bgzip can compress with multiple threads, so it is used when available
+        bgzip = shutil.which("bgzip")
+        if bgzip is None:
+            with pysam.BGZFile(str(output_path), "wb") as out_f:
+                yield out_f
+            return
+
+        with open(output_path, "wb") as out_f:
+            process = subprocess.Popen(
+                [bgzip, "--threads", str(threads), "--stdout"], stdin=subprocess.PIPE, stdout=out_f,
+            )
+            try:
+                if process.stdin is None:
+                    raise ValueError("Could not open input stream of bgzip")
+                with process.stdin as compressor_in_f:
+                    yield compressor_in_f
+            except BaseException:
+                # Otherwise bgzip would finish compressing incomplete input in the background
+                process.kill()
+                process.wait()
+                raise
+            if process.wait() != 0:
+                raise ValueError(f"bgzip failed with exit code {process.returncode}")
+
+
+class AlignmentHeaderContigRenamer(object):
+    """
+    Renames the contigs in the @SQ lines of a BAM or CRAM header with samtools reheader.
+    The records refer to contigs by index, so they are copied without being decoded.
+    """
+    @classmethod
+    def rename_contigs(cls, input_path: Path, output_path: Path, contig_renamer: ContigRenamer) -> None:
+        with pysam.AlignmentFile(str(input_path), "r") as in_f:
+            header_text = str(in_f.header)
+
+        header_path = get_temp_path(Path(f"{output_path}.header.sam"))
+        try:
+            with open(header_path, "w") as f:
+                f.write(cls._get_renamed_header_text(header_text, contig_renamer))
+
+            logging.info(f"Writing {output_path} with renamed contigs in header")
+            pysam.reheader(str(header_path), str(input_path), save_stdout=str(get_temp_path(output_path)))
+        except BaseException:
+            get_temp_path(output_path).unlink(missing_ok=True)
+            raise
+        finally:
+            header_path.unlink(missing_ok=True)
+        make_temp_version_final(output_path)
+
+    @classmethod
+    def _get_renamed_header_text(cls, header_text: str, contig_renamer: ContigRenamer) -> str:
+        renamed_lines = []
+        for line in header_text.splitlines():
+            if line.startswith("@SQ\t"):
+                fields = [
+                    f"SN:{contig_renamer.rename(field[3:].encode('ascii')).decode('ascii')}"
+                    if field.startswith("SN:") else field
+                    for field in line.split("\t")
+                ]
+                line = "\t".join(fields)
+            renamed_lines.append(line)
+        return "".join(f"{line}\n" for line in renamed_lines)
+
+
+def is_vcf_path(path: Path) -> bool:
+    return path.name.endswith(VCF_SUFFIXES)
+
+
+def is_alignment_path(path: Path) -> bool:
+    return path.name.endswith(ALIGNMENT_SUFFIXES)
@@ -0,0 +1,75 @@
+import concurrent.futures
+import logging
+from pathlib import Path
+from typing import NamedTuple, Optional, List
+
+from ref_lib.fasta_reader import MappedFastaReader
+from ref_lib.ref_util import UPPERCASE_TRANSLATION_TABLE
+
+
+class ContigPair(NamedTuple):
+    expected_contig_name: str
+    actual_contig_name: str
+
+
+class ContigMismatch(NamedTuple):
+    contig_pair: ContigPair
+    first_mismatch_offset: int
+
+
+class FastaComparer(object):
+    """Compares uppercased expected contigs to actual contigs one window at a time, in parallel across contigs."""
+
+    @classmethod
+    def get_mismatches(
+            cls,
+            expected_fasta: Path,
+            actual_fasta: Path,
+            contig_pairs: List[ContigPair],
+            processes: Optional[int] = None,
+    ) -> List[ContigMismatch]:
+        futures = []
+        with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+            for contig_pair in contig_pairs:
+                futures.append(
+                    executor.submit(cls.get_first_mismatch_offset, expected_fasta, actual_fasta, contig_pair),
+                )
+
+        mismatches = []
+        for contig_pair, future in zip(contig_pairs, futures):
+            try:
+                first_mismatch_offset = future.result()
+            except Exception as exc:
+                raise ValueError(exc)
+            if first_mismatch_offset is not None:
+                logging.error(f"Contigs differ: {contig_pair}, first mismatch at offset {first_mismatch_offset}")
+                mismatches.append(ContigMismatch(contig_pair, first_mismatch_offset))
+        return mismatches
+
+    @classmethod
+    def get_first_mismatch_offset(
+            cls, expected_fasta: Path, actual_fasta: Path, contig_pair: ContigPair,
+    ) -> Optional[int]:
+        with MappedFastaReader(expected_fasta) as expected_f, MappedFastaReader(actual_fasta) as actual_f:
+            expected_windows = expected_f.iterate_windows(contig_pair.expected_contig_name)
+            actual_windows = actual_f.iterate_windows(contig_pair.actual_contig_name)
+            window_start = 0
+            for expected_window, actual_window in zip(expected_windows, actual_windows):
+                expected_window = expected_window.translate(UPPERCASE_TRANSLATION_TABLE)
+                if expected_window != actual_window:
+                    return window_start + cls._get_first_mismatch_index(expected_window, actual_window)
+                window_start += len(expected_window)
+
+            expected_length = expected_f.get_reference_length(contig_pair.expected_contig_name)
+            actual_length = actual_f.get_reference_length(contig_pair.actual_contig_name)
+            if expected_length != actual_length:
+                return min(expected_length, actual_length)
+            else:
+                return None
+
+    @classmethod
+    def _get_first_mismatch_index(cls, expected_window: bytes, actual_window: bytes) -> int:
+        for index, (expected, actual) in enumerate(zip(expected_window, actual_window)):
+            if expected != actual:
+                return index
+        return min(len(expected_window), len(actual_window))
@@ -0,0 +1,245 @@
+import gzip
+import mmap
+from pathlib import Path
+from types import TracebackType
+from typing import NamedTuple, Dict, Tuple, Optional, Iterator, Type, Union
+
+import numpy as np
+import numpy.typing as npt
+import pysam
+
+from ref_lib.ref_util import SEQUENCE_WINDOW_SIZE, assert_file_exists
+
+GZIP_MAGIC_NUMBER = b"\x1f\x8b"
+
+
+class FastaIndexEntry(NamedTuple):
+    name: str
+    length: int
+    offset: int
+    line_bases: int
+    line_width: int
+
+    @classmethod
+    def from_line(cls, line: str) -> "FastaIndexEntry":
+        split_line = line.rstrip("\n").split("\t")
+        if len(split_line) != 5:
+            raise ValueError(f"Incorrect line length: {line}")
+        name, length, offset, line_bases, line_width = split_line
+        return FastaIndexEntry(name, int(length), int(offset), int(line_bases), int(line_width))
+
+    def get_file_offset(self, position: int) -> int:
+        return self.offset + (position // self.line_bases) * self.line_width + position % self.line_bases
+
+
+class MappedFastaReader(object):
+    """
+    Reads regions of an uncompressed FASTA file through a read-only memory map, using the offsets in its .fai index.
+    The index is created with samtools faidx if it doesn't exist yet.
+    """
+    def __init__(self, fasta_path: Path) -> None:
+        assert_file_exists(fasta_path)
+        # Checked before indexing, so no index files are created for a file that cannot be read anyway
+        if is_gzipped(fasta_path):
+            raise ValueError(f"Cannot memory-map compressed FASTA file: {fasta_path}")
+        with open(self.create_index_if_missing(fasta_path), "r") as index_f:
+            entries = [FastaIndexEntry.from_line(line) for line in index_f if line.strip()]
+        self._name_to_entry: Dict[str, FastaIndexEntry] = {entry.name: entry for entry in entries}
+
+        self._file = open(fasta_path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @classmethod
+    def create_index_if_missing(cls, fasta_path: Path) -> Path:
+        # Returns the path of the .fai index
+        index_path = Path(f"{fasta_path}.fai")
+        if not index_path.exists():
+            pysam.faidx(str(fasta_path))
+        return index_path
+
+    def __enter__(self) -> "MappedFastaReader":
+        return self
+
+    def __exit__(
+            self,
+            exc_type: Optional[Type[BaseException]],
+            exc_val: Optional[BaseException],
+            exc_tb: Optional[TracebackType],
+    ) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._mmap.close()
+        self._file.close()
+
+    @property
+    def references(self) -> Tuple[str, ...]:
+        return tuple(self._name_to_entry.keys())
+
+    @property
+    def nreferences(self) -> int:
+        return len(self._name_to_entry)
+
+    def get_reference_length(self, contig_name: str) -> int:
+        return self._get_entry(contig_name).length
+
+    def fetch(self, contig_name: str, start: int = 0, end: Optional[int] = None) -> str:
+        return self.fetch_bytes(contig_name, start, end).decode("ascii")
+
+    def fetch_bytes(self, contig_name: str, start: int = 0, end: Optional[int] = None) -> bytes:
+        entry = self._get_entry(contig_name)
+        start, end = self._get_checked_region(entry, start, end)
+        if start == end:
+            return b""
+        raw_region = self._mmap[entry.get_file_offset(start):entry.get_file_offset(end - 1) + 1]
+        return raw_region.translate(None, b"\r\n")
+
+    def get_array(self, contig_name: str, start: int = 0, end: Optional[int] = None) -> npt.NDArray[np.uint8]:
+        # Regions within a single line are returned as a view of the memory map without any copying.
+        # Other regions are copied once, from a two-dimensional view of the lines without the line endings.
+        entry = self._get_entry(contig_name)
+        start, end = self._get_checked_region(entry, start, end)
+        if start == end:
+            return np.zeros(0, dtype=np.uint8)
+
+        first_line_index = start // entry.line_bases
+        last_line_index = (end - 1) // entry.line_bases
+        if first_line_index == last_line_index:
+            return np.frombuffer(self._mmap, dtype=np.uint8, count=end - start, offset=entry.get_file_offset(start))
+
+        full_line_count = last_line_index - first_line_index
+        full_lines = np.frombuffer(
+            self._mmap,
+            dtype=np.uint8,
+            count=full_line_count * entry.line_width,
+            offset=entry.offset + first_line_index * entry.line_width,
+        ).reshape(full_line_count, entry.line_width)[:, :entry.line_bases]
+        last_line_base_count = end - last_line_index * entry.line_bases
+        last_line = np.frombuffer(
+            self._mmap,
+            dtype=np.uint8,
+            count=last_line_base_count,
+            offset=entry.offset + last_line_index * entry.line_width,
+        )
+
+        result = np.empty(full_line_count * entry.line_bases + last_line_base_count, dtype=np.uint8)
+        result[:full_line_count * entry.line_bases].reshape(full_line_count, entry.line_bases)[:] = full_lines
+        result[full_line_count * entry.line_bases:] = last_line
+        return result[start - first_line_index * entry.line_bases:]
+
+    def iterate_windows(
+            self, contig_name: str, window_size: int = SEQUENCE_WINDOW_SIZE, start: int = 0, end: Optional[int] = None,
+    ) -> Iterator[bytes]:
+        start, end = self._get_checked_region(self._get_entry(contig_name), start, end)
+        for window_start in range(start, end, window_size):
+            yield self.fetch_bytes(contig_name, window_start, min(window_start + window_size, end))
+
+    def _get_entry(self, contig_name: str) -> FastaIndexEntry:
+        if contig_name not in self._name_to_entry:
+            raise KeyError(f"Contig not in FASTA index: {contig_name}")
+        return self._name_to_entry[contig_name]
+
+    @classmethod
+    def _get_checked_region(cls, entry: FastaIndexEntry, start: int, end: Optional[int]) -> Tuple[int, int]:
+        if end is None or end > entry.length:
+            end = entry.length
+        if start < 0 or start > end:
+            raise ValueError(f"Invalid region: contig={entry.name}, start={start}, end={end}")
+        return start, end
+
+
+class PysamFastaReader(object):
+    """
+    Reads regions of a BGZF-compressed FASTA file with pysam, with the same interface as MappedFastaReader.
+    The .fai and .gzi indices are created by pysam if they don't exist yet.
+    """
+    def __init__(self, fasta_path: Path) -> None:
+        assert_file_exists(fasta_path)
+        self._fasta_f = pysam.FastaFile(str(fasta_path))
+
+    def __enter__(self) -> "PysamFastaReader":
+        return self
+
+    def __exit__(
+            self,
+            exc_type: Optional[Type[BaseException]],
+            exc_val: Optional[BaseException],
+            exc_tb: Optional[TracebackType],
+    ) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._fasta_f.close()
+
+    @property
+    def references(self) -> Tuple[str, ...]:
+        return tuple(self._fasta_f.references)
+
+    @property
+    def nreferences(self) -> int:
+        return int(self._fasta_f.nreferences)
+
+    def get_reference_length(self, contig_name: str) -> int:
+        if contig_name not in self._fasta_f.references:
+            raise KeyError(f"Contig not in FASTA index: {contig_name}")
+        return int(self._fasta_f.get_reference_length(contig_name))
+
+    def fetch(self, contig_name: str, start: int = 0, end: Optional[int] = None) -> str:
+        start, end = self._get_checked_region(contig_name, start, end)
+        return str(self._fasta_f.fetch(contig_name, start, end))
+
+    def fetch_bytes(self, contig_name: str, start: int = 0, end: Optional[int] = None) -> bytes:
+        return self.fetch(contig_name, start, end).encode("ascii")
+
+    def get_array(self, contig_name: str, start: int = 0, end: Optional[int] = None) -> npt.NDArray[np.uint8]:
+        return np.frombuffer(self.fetch_bytes(contig_name, start, end), dtype=np.uint8)
+
+    def iterate_windows(
+            self, contig_name: str, window_size: int = SEQUENCE_WINDOW_SIZE, start: int = 0, end: Optional[int] = None,
+    ) -> Iterator[bytes]:
+        start, end = self._get_checked_region(contig_name, start, end)
+        for window_start in range(start, end, window_size):
+            yield self.fetch_bytes(contig_name, window_start, min(window_start + window_size, end))
+
+    def _get_checked_region(self, contig_name: str, start: int, end: Optional[int]) -> Tuple[int, int]:
+        length = self.get_reference_length(contig_name)
+        if end is None or end > length:
+            end = length
+        if start < 0 or start > end:
+            raise ValueError(f"Invalid region: contig={contig_name}, start={start}, end={end}")
+        return start, end
+
+
+FastaReader = Union[MappedFastaReader, PysamFastaReader]
+
+
+def open_fasta_reader(fasta_path: Path) -> FastaReader:
+    # Uncompressed files are memory-mapped, and BGZF-compressed files are read with pysam
+    if is_gzipped(fasta_path):
+        return PysamFastaReader(fasta_path)
+    else:
+        return MappedFastaReader(fasta_path)
+
+
+def is_gzipped(path: Path) -> bool:
+    with open(path, "rb") as f:
+        return f.read(len(GZIP_MAGIC_NUMBER)) == GZIP_MAGIC_NUMBER
+
+
+class FastaRecord(NamedTuple):
+    name: str
+    sequence: bytes
+
+
+def read_single_record_fasta(fasta_path: Path) -> FastaRecord:
+    # Meant for small files like the rCRS. Reads gzipped files as a stream, without an uncompressed copy on disk.
+    assert_file_exists(fasta_path)
+    with (gzip.open(fasta_path, "rb") if is_gzipped(fasta_path) else open(fasta_path, "rb")) as f:
+        lines = f.read().splitlines()
+
+    header_indices = [index for index, line in enumerate(lines) if line.startswith(b">")]
+    if header_indices != [0]:
+        raise ValueError(f"FASTA file does not contain exactly one record: {fasta_path}")
+    name = lines[0][1:].decode("ascii").split(maxsplit=1)[0]
+    sequence = b"".join(line.strip() for line in lines[1:])
+    return FastaRecord(name, sequence)
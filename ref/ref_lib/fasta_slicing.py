@@ -0,0 +1,174 @@
+import re
+from pathlib import Path
+from typing import NamedTuple, Optional, List, Dict, Set, Tuple
+
+from ref_lib.contig_classification import ContigCategorizer
+from ref_lib.contig_name_translation import ContigNameTranslator
+from ref_lib.contig_types import ContigType
+from ref_lib.fasta_reader import MappedFastaReader
+from ref_lib.fasta_writer import FastaRecordJob, FastaWriter
+
+
+class ContigRegion(NamedTuple):
+    contig_name: str
+    start: int  # 0-based
+    end: Optional[int]  # exclusive, end of contig if None
+
+    @classmethod
+    def from_text(cls, text: str) -> "ContigRegion":
+        # Same format as samtools faidx: "chr1", "chr1:1000" or "chr1:1000-2000", with 1-based inclusive coordinates
+        match = re.fullmatch(r"(.+?)(?::([0-9,]+)(?:-([0-9,]+))?)?", text)
+        if match is None:
+            raise ValueError(f"Could not parse region: {text}")
+        contig_name, start_text, end_text = match.groups()
+        start = int(start_text.replace(",", "")) - 1 if start_text is not None else 0
+        end = int(end_text.replace(",", "")) if end_text is not None else None
+        if start < 0 or (end is not None and end <= start):
+            raise ValueError(f"Invalid region: {text}")
+        return ContigRegion(contig_name, start, end)
+
+    def is_whole_contig(self) -> bool:
+        return self.start == 0 and self.end is None
+
+    def get_record_name(self, contig_name: str) -> str:
+        if self.is_whole_contig():
+            return contig_name
+        elif self.end is None:
+            return f"{contig_name}:{self.start + 1}"
+        else:
+            return f"{contig_name}:{self.start + 1}-{self.end}"
+
+
+class FastaSliceSelection(NamedTuple):
+    contig_types: Set[ContigType]
+    contig_names: List[str]
+    regions: List[ContigRegion]
+
+    def is_empty(self) -> bool:
+        return not self.contig_types and not self.contig_names and not self.regions
+
+
+class FastaSlicer(object):
+    """
+    Writes a subset of the contigs and regions of a FASTA file to a combined FASTA file or to a FASTA file per record.
+    All records are written in a single parallel pass, together with the FASTA indices and sequence dictionaries.
+    """
+    @classmethod
+    def write_slices(
+            cls,
+            source_fasta: Path,
+            selection: FastaSliceSelection,
+            output_path: Path,
+            per_record: bool,
+            contig_name_translator: Optional[ContigNameTranslator],
+            standardize_names: bool,
+            processes: Optional[int],
+    ) -> List[Path]:
+        record_jobs = cls.get_record_jobs(source_fasta, selection, contig_name_translator, standardize_names)
+
+        if per_record:
+            target_fasta_to_record_jobs = {
+                output_path / cls._get_file_name(record_job.name): [record_job] for record_job in record_jobs
+            }
+            if len(target_fasta_to_record_jobs) != len(record_jobs):
+                raise ValueError(f"Records with the same name cannot be written to separate files")
+        else:
+            target_fasta_to_record_jobs = {output_path: record_jobs}
+
+        existing_target_fastas = [path for path in target_fasta_to_record_jobs.keys() if path.exists()]
+        if existing_target_fastas:
+            raise ValueError(f"Output FASTA files already exist: {existing_target_fastas}")
+
+        FastaWriter.write_fasta_files(source_fasta, target_fasta_to_record_jobs, processes)
+        return list(target_fasta_to_record_jobs.keys())
+
+    @classmethod
+    def get_record_jobs(
+            cls,
+            source_fasta: Path,
+            selection: FastaSliceSelection,
+            contig_name_translator: Optional[ContigNameTranslator],
+            standardize_names: bool,
+    ) -> List[FastaRecordJob]:
+        # Contigs selected by type or name are written in the order of the source file, followed by the regions.
+        # Names can be given in any naming convention known to the translator.
+        if selection.is_empty():
+            raise ValueError(f"No contigs or regions selected")
+        if contig_name_translator is None and (selection.contig_types or standardize_names):
+            raise ValueError(f"Selecting contig types and standardizing names require a contig name translator")
+
+        with MappedFastaReader(source_fasta) as source_f:
+            source_contig_names = source_f.references
+        source_contig_name_lookup = cls._get_source_contig_name_lookup(source_contig_names, contig_name_translator)
+
+        selected_source_contig_names = {
+            cls._find_source_contig_name(contig_name, source_contig_name_lookup, contig_name_translator)
+            for contig_name in selection.contig_names
+        }
+        if selection.contig_types and contig_name_translator is not None:
+            contig_types = ContigCategorizer(contig_name_translator).categorize_many(source_contig_names)
+            selected_source_contig_names.update(
+                contig_name for contig_name, contig_type in zip(source_contig_names, contig_types)
+                if contig_type in selection.contig_types
+            )
+
+        source_contig_regions = [
+            (contig_name, ContigRegion(contig_name, 0, None))
+            for contig_name in source_contig_names if contig_name in selected_source_contig_names
+        ]
+        for region in selection.regions:
+            source_contig_name = cls._find_source_contig_name(
+                region.contig_name, source_contig_name_lookup, contig_name_translator,
+            )
+            source_contig_regions.append((source_contig_name, region))
+        return [
+            cls._get_record_job(source_contig_name, region, contig_name_translator, standardize_names)
+            for source_contig_name, region in source_contig_regions
+        ]
+
+    @classmethod
+    def _get_record_job(
+            cls,
+            source_contig_name: str,
+            region: ContigRegion,
+            contig_name_translator: Optional[ContigNameTranslator],
+            standardize_names: bool,
+    ) -> FastaRecordJob:
+        # Unlike the HMF ref genome, slices keep the soft-masking of the source
+        if standardize_names and contig_name_translator is not None:
+            contig_name = contig_name_translator.standardize(source_contig_name)
+        else:
+            contig_name = source_contig_name
+        name = region.get_record_name(contig_name)
+        return FastaRecordJob(source_contig_name, name, f">{name}", region.start, region.end, uppercase=False)
+
+    @classmethod
+    def _get_source_contig_name_lookup(
+            cls, source_contig_names: Tuple[str, ...], contig_name_translator: Optional[ContigNameTranslator],
+    ) -> Dict[str, str]:
+        lookup = {}
+        if contig_name_translator is not None:
+            for contig_name in source_contig_names:
+                if contig_name_translator.is_known(contig_name):
+                    lookup[contig_name_translator.standardize(contig_name)] = contig_name
+        lookup.update({contig_name: contig_name for contig_name in source_contig_names})
+        return lookup
+
+    @classmethod
+    def _find_source_contig_name(
+            cls,
+            contig_name: str,
+            source_contig_name_lookup: Dict[str, str],
+            contig_name_translator: Optional[ContigNameTranslator],
+    ) -> str:
+        if contig_name in source_contig_name_lookup:
+            return source_contig_name_lookup[contig_name]
+        if contig_name_translator is not None and contig_name_translator.is_known(contig_name):
+            standardized_contig_name = contig_name_translator.standardize(contig_name)
+            if standardized_contig_name in source_contig_name_lookup:
+                return source_contig_name_lookup[standardized_contig_name]
+        raise ValueError(f"Contig not found in source FASTA: {contig_name}")
+
+    @classmethod
+    def _get_file_name(cls, record_name: str) -> str:
+        return f"{record_name.replace(':', '_')}.fasta"
@@ -1,17 +1,44 @@
-import hashlib
+import concurrent.futures
+import contextlib
 import logging
+import shutil
+import tempfile
 from pathlib import Path
+from typing import BinaryIO, List, NamedTuple, Optional, Dict, Tuple
 
-import pysam
-
+from ref_lib.bgzf import BgzfWriter, BgzfBlockOffset, BGZF_EOF_BLOCK, write_bgzf_index
 from ref_lib.contig_classification import ContigCategorizer
+from ref_lib.contig_digest import ContigDigest, ContigDigester, ContigDigestTable
 from ref_lib.contig_name_translation import ContigNameTranslator
 from ref_lib.contig_types import ContigType, ContigTypeDesirabilities, Assembly
+from ref_lib.fasta_reader import MappedFastaReader
+from ref_lib.ref_util import UPPERCASE_TRANSLATION_TABLE, concatenate_files, get_temp_path, make_temp_version_final
+
+
+class FastaRecordJob(NamedTuple):
+    source_contig_name: str
+    name: str
+    header: str
+    start: int = 0  # 0-based
+    end: Optional[int] = None  # exclusive, end of contig if None
+    uppercase: bool = True
+
+
+class WrittenFastaRecord(NamedTuple):
+    digest: ContigDigest
+    header_size: int
+    record_size: int
+    bgzf_block_offsets: Tuple[BgzfBlockOffset, ...] = ()  # relative to start of record
+    bgzf_record_size: int = 0
 
 
 class FastaWriter(object):
+    SEQUENCE_DICTIONARY_HEADER = "@HD\tVN:1.0\tSO:unsorted"
     FASTA_LINE_WRAP = 70
     FASTA_HEADER_SEPARATOR = "  "
+    MD5_PLACEHOLDER_ENTRY = f"M5:{'0' * 32}"
+    WINDOW_SIZE = FASTA_LINE_WRAP * 16384  # multiple of line wrap, so every window starts on a new line
+    OUTPUT_BUFFER_SIZE = 16 * 1024 * 1024
     CONTIG_TYPE_TO_ROLE = {
         ContigType.AUTOSOME: "Chromosome",
         ContigType.X: "Chromosome",
@@ -34,33 +61,301 @@ class FastaWriter(object):
             contig_categorizer: ContigCategorizer,
             contig_name_translator: ContigNameTranslator,
             contig_type_desirabilities: ContigTypeDesirabilities,
+            processes: Optional[int] = 1,
+            bgzf_target_fasta: Optional[Path] = None,
     ) -> None:
+        # Besides the FASTA file, writes its index, sequence dictionary and contig digests.
+        # Optionally also writes a BGZF-compressed copy with its index and .gzi file, compressed in the same pass.
         cls._assert_master_fasta_contig_types_match_expected(
             master_fasta,
             contig_categorizer,
             contig_type_desirabilities,
         )
 
-        with pysam.Fastafile(master_fasta) as master_f:
-            contig_names = list(master_f.references)
-
-            with open(target_fasta, "w") as out_f:
-                for contig_name in contig_names:
-                    logging.info(f"Handling {contig_name}")
-                    contig_type = contig_categorizer.get_contig_type(contig_name)
-                    if contig_type in contig_type_desirabilities.desired_contig_types:
-                        logging.info(f"Include {contig_name} in output file")
-                        sequence = master_f.fetch(contig_name).upper()
-                        header = cls._get_header(
-                            contig_name,
-                            contig_name_translator.standardize(contig_name),
-                            contig_type,
-                            sequence,
+        record_jobs = []
+        with MappedFastaReader(master_fasta) as master_f:
+            contig_types = contig_categorizer.categorize_many(master_f.references)
+            standardized_contig_names = contig_name_translator.standardize_many(master_f.references)
+            for contig_name, contig_type, standardized_contig_name in zip(
+                    master_f.references, contig_types, standardized_contig_names,
+            ):
+                logging.info(f"Handling {contig_name}")
+                if contig_type in contig_type_desirabilities.desired_contig_types:
+                    logging.info(f"Include {contig_name} in output file")
+                    header = cls._get_header(
+                        contig_name,
+                        standardized_contig_name,
+                        contig_type,
+                        master_f.get_reference_length(contig_name),
+                    )
+                    record_jobs.append(FastaRecordJob(contig_name, standardized_contig_name, header))
+
+        target_fasta_to_bgzf_target_fasta = {target_fasta: bgzf_target_fasta} if bgzf_target_fasta is not None else {}
+        written_records = cls._write_fasta_files(
+            master_fasta, {target_fasta: record_jobs}, processes, target_fasta_to_bgzf_target_fasta,
+        )[target_fasta]
+        cls._write_fasta_index(written_records, Path(f"{target_fasta}.fai"))
+        # The output is uploaded elsewhere, so the sequence dictionary doesn't refer to its local path
+        cls._write_sequence_dictionary(written_records, get_sequence_dictionary_path(target_fasta), None)
+        ContigDigestTable.write(
+            [record.digest for record in written_records], ContigDigestTable.get_path(target_fasta),
+        )
+        if bgzf_target_fasta is not None:
+            cls._write_fasta_index(written_records, Path(f"{bgzf_target_fasta}.fai"))
+            cls._write_bgzf_index(written_records, Path(f"{bgzf_target_fasta}.gzi"))
+
+    @classmethod
+    def write_fasta_files(
+            cls,
+            source_fasta: Path,
+            target_fasta_to_record_jobs: Dict[Path, List[FastaRecordJob]],
+            processes: Optional[int] = 1,
+    ) -> None:
+        # Writes each target FASTA with its index and sequence dictionary
+        target_fasta_to_written_records = cls._write_fasta_files(
+            source_fasta, target_fasta_to_record_jobs, processes, {},
+        )
+        for target_fasta, written_records in target_fasta_to_written_records.items():
+            cls._write_fasta_index(written_records, Path(f"{target_fasta}.fai"))
+            cls._write_sequence_dictionary(
+                written_records, get_sequence_dictionary_path(target_fasta), f"file:{target_fasta.resolve()}",
+            )
+
+    @classmethod
+    def _write_fasta_files(
+            cls,
+            source_fasta: Path,
+            target_fasta_to_record_jobs: Dict[Path, List[FastaRecordJob]],
+            processes: Optional[int],
+            target_fasta_to_bgzf_target_fasta: Dict[Path, Path],
+    ) -> Dict[Path, List[WrittenFastaRecord]]:
+        for record_jobs in target_fasta_to_record_jobs.values():
+            for record_job in record_jobs:
+                if record_job.end is not None and record_job.end <= record_job.start:
+                    raise ValueError(f"Cannot write empty FASTA record: {record_job}")
+
+        if processes == 1:
+            target_fasta_to_written_records = {
+                target_fasta: cls._write_records(
+                    source_fasta, record_jobs, target_fasta, target_fasta_to_bgzf_target_fasta.get(target_fasta),
+                )
+                for target_fasta, record_jobs in target_fasta_to_record_jobs.items()
+            }
+        else:
+            target_fasta_to_written_records = cls._write_fasta_files_in_parallel(
+                source_fasta, target_fasta_to_record_jobs, processes, target_fasta_to_bgzf_target_fasta,
+            )
+
+        for bgzf_target_fasta in target_fasta_to_bgzf_target_fasta.values():
+            with open(bgzf_target_fasta, "ab") as f:
+                f.write(BGZF_EOF_BLOCK)
+        return target_fasta_to_written_records
+
+    @classmethod
+    def _write_records(
+            cls,
+            source_fasta: Path,
+            record_jobs: List[FastaRecordJob],
+            target_fasta: Path,
+            bgzf_target_fasta: Optional[Path],
+    ) -> List[WrittenFastaRecord]:
+        with contextlib.ExitStack() as stack:
+            source_f = stack.enter_context(MappedFastaReader(source_fasta))
+            out_f = stack.enter_context(open(target_fasta, "wb", buffering=cls.OUTPUT_BUFFER_SIZE))
+            if bgzf_target_fasta is not None:
+                bgzf_out_f: Optional[BinaryIO] = stack.enter_context(
+                    open(bgzf_target_fasta, "wb", buffering=cls.OUTPUT_BUFFER_SIZE),
+                )
+            else:
+                bgzf_out_f = None
+            return [cls._write_record(source_f, record_job, out_f, bgzf_out_f) for record_job in record_jobs]
+
+    @classmethod
+    def _write_fasta_files_in_parallel(
+            cls,
+            source_fasta: Path,
+            target_fasta_to_record_jobs: Dict[Path, List[FastaRecordJob]],
+            processes: Optional[int],
+            target_fasta_to_bgzf_target_fasta: Dict[Path, Path],
+    ) -> Dict[Path, List[WrittenFastaRecord]]:
+        # Each record is written to its own shard, after which the shards are concatenated in the original order.
+        # The records of all target files share a single pool, so all of them are written in one pass.
+        # BGZF shards can be concatenated as well, since each record starts in a new block.
+        # Each target file gets a new shard dir, so shards of an earlier failed run are never mixed in.
+        target_fasta_to_shard_dir: Dict[Path, Path] = {}
+        try:
+            target_fasta_to_shard_paths: Dict[Path, List[Path]] = {}
+            target_fasta_to_futures: Dict[Path, List["concurrent.futures.Future[List[WrittenFastaRecord]]"]] = {}
+            with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+                for target_fasta, record_jobs in target_fasta_to_record_jobs.items():
+                    shard_dir = cls._create_shard_dir(target_fasta)
+                    target_fasta_to_shard_dir[target_fasta] = shard_dir
+                    shard_paths = [shard_dir / f"{index}.fasta" for index in range(len(record_jobs))]
+                    target_fasta_to_shard_paths[target_fasta] = shard_paths
+                    write_bgzf = target_fasta in target_fasta_to_bgzf_target_fasta
+                    target_fasta_to_futures[target_fasta] = [
+                        executor.submit(
+                            cls._write_records,
+                            source_fasta,
+                            [record_job],
+                            shard_path,
+                            cls._get_bgzf_shard_path(shard_path) if write_bgzf else None,
                         )
-                        logging.info(f"Header: {header}")
-                        out_f.write(header + "\n")
-                        for i in range(0, len(sequence), cls.FASTA_LINE_WRAP):
-                            out_f.write(sequence[i:i + cls.FASTA_LINE_WRAP] + "\n")
+                        for record_job, shard_path in zip(record_jobs, shard_paths)
+                    ]
+
+            target_fasta_to_written_records: Dict[Path, List[WrittenFastaRecord]] = {}
+            for target_fasta, futures in target_fasta_to_futures.items():
+                written_records: List[WrittenFastaRecord] = []
+                for future in futures:
+                    try:
+                        written_records.extend(future.result())
+                    except Exception as exc:
+                        raise ValueError(exc)
+                target_fasta_to_written_records[target_fasta] = written_records
+
+            for target_fasta, shard_paths in target_fasta_to_shard_paths.items():
+                cls._combine_shards(shard_paths, target_fasta)
+                if target_fasta in target_fasta_to_bgzf_target_fasta:
+                    cls._combine_shards(
+                        [cls._get_bgzf_shard_path(shard_path) for shard_path in shard_paths],
+                        target_fasta_to_bgzf_target_fasta[target_fasta],
+                    )
+            return target_fasta_to_written_records
+        finally:
+            for shard_dir in target_fasta_to_shard_dir.values():
+                shutil.rmtree(shard_dir, ignore_errors=True)
+
+    @classmethod
+    def _combine_shards(cls, shard_paths: List[Path], target_path: Path) -> None:
+        if len(shard_paths) == 1:
+            shard_paths[0].rename(target_path)
+        else:
+            logging.info(f"Concatenating {len(shard_paths)} shards into {target_path}")
+            concatenate_files(shard_paths, target_path)
+            for shard_path in shard_paths:
+                shard_path.unlink()
+
+    @classmethod
+    def _create_shard_dir(cls, target_fasta: Path) -> Path:
+        return Path(tempfile.mkdtemp(prefix=f"{target_fasta.name}.", suffix=".shards", dir=target_fasta.parent))
+
+    @classmethod
+    def _get_bgzf_shard_path(cls, shard_path: Path) -> Path:
+        return shard_path.parent / f"{shard_path.name}.gz"
+
+    @classmethod
+    def _write_record(
+            cls,
+            source_f: MappedFastaReader,
+            record_job: FastaRecordJob,
+            out_f: BinaryIO,
+            bgzf_out_f: Optional[BinaryIO],
+    ) -> WrittenFastaRecord:
+        # Only holds one window of the sequence in memory at a time.
+        # The M5 digest is only known after the whole sequence has been written,
+        # so it is filled in afterwards at the position of the placeholder in the header.
+        # In BGZF output, the header gets an uncompressed block of its own, so it can be filled in the same way.
+        bgzf_writer = BgzfWriter(bgzf_out_f) if bgzf_out_f is not None else None
+        record_start = out_f.tell()
+        encoded_header = f"{record_job.header}\n".encode("ascii")
+        out_f.write(encoded_header)
+        if bgzf_writer is not None:
+            bgzf_header_position = bgzf_writer.write_stored_block(encoded_header)
+        digester = ContigDigester(record_job.name)
+        windows = source_f.iterate_windows(
+            record_job.source_contig_name, cls.WINDOW_SIZE, record_job.start, record_job.end,
+        )
+        for window in windows:
+            if record_job.uppercase:
+                window = window.translate(UPPERCASE_TRANSLATION_TABLE)
+            digester.update(window)
+            wrapped_window = cls._wrap_lines(window)
+            out_f.write(wrapped_window)
+            if bgzf_writer is not None:
+                bgzf_writer.write(wrapped_window)
+        digest = digester.get_digest()
+        md5_hex = digest.md5
+        record_end = out_f.tell()
+
+        final_header = record_job.header.replace(cls.MD5_PLACEHOLDER_ENTRY, f"M5:{md5_hex}")
+        if final_header != record_job.header:
+            out_f.seek(record_start)
+            out_f.write(f"{final_header}\n".encode("ascii"))
+            out_f.seek(record_end)
+            if bgzf_writer is not None:
+                bgzf_writer.overwrite_stored_block(bgzf_header_position, f"{final_header}\n".encode("ascii"))
+        logging.info(f"Header: {final_header}")
+
+        if bgzf_writer is None:
+            return WrittenFastaRecord(digest, len(encoded_header), record_end - record_start)
+        bgzf_writer.flush()
+        return WrittenFastaRecord(
+            digest,
+            len(encoded_header),
+            record_end - record_start,
+            tuple(bgzf_writer.get_block_offsets()),
+            bgzf_writer.get_compressed_size(),
+        )
+
+    @classmethod
+    def _write_fasta_index(cls, written_records: List[WrittenFastaRecord], index_path: Path) -> None:
+        # Same as the index samtools faidx would create, but without having to read the FASTA file again
+        index_lines = []
+        record_start = 0
+        for record in written_records:
+            line_bases = min(record.digest.length, cls.FASTA_LINE_WRAP)
+            sequence_start = record_start + record.header_size
+            index_entries = [record.digest.name, record.digest.length, sequence_start, line_bases, line_bases + 1]
+            index_lines.append("\t".join(str(entry) for entry in index_entries) + "\n")
+            record_start += record.record_size
+        with open(index_path, "w") as f:
+            f.write("".join(index_lines))
+
+    @classmethod
+    def _write_bgzf_index(cls, written_records: List[WrittenFastaRecord], index_path: Path) -> None:
+        # Same as the .gzi index samtools faidx would create, but without having to decompress the file again
+        block_offsets: List[BgzfBlockOffset] = []
+        record_start = BgzfBlockOffset(0, 0)
+        for record in written_records:
+            block_offsets.extend(
+                BgzfBlockOffset(
+                    record_start.compressed_offset + block_offset.compressed_offset,
+                    record_start.uncompressed_offset + block_offset.uncompressed_offset,
+                )
+                for block_offset in record.bgzf_block_offsets
+            )
+            record_start = BgzfBlockOffset(
+                record_start.compressed_offset + record.bgzf_record_size,
+                record_start.uncompressed_offset + record.record_size,
+            )
+        write_bgzf_index(block_offsets, index_path)
+
+    @classmethod
+    def _write_sequence_dictionary(
+            cls, written_records: List[WrittenFastaRecord], dictionary_path: Path, fasta_uri: Optional[str],
+    ) -> None:
+        # Same as the dictionary samtools dict would create, with the MD5 that was computed while writing
+        lines = [cls.SEQUENCE_DICTIONARY_HEADER]
+        for record in written_records:
+            entries = [
+                "@SQ",
+                f"SN:{record.digest.name}",
+                f"LN:{record.digest.length}",
+                f"M5:{record.digest.md5}",
+            ]
+            if fasta_uri is not None:
+                entries.append(f"UR:{fasta_uri}")
+            lines.append("\t".join(entries))
+        with open(get_temp_path(dictionary_path), "w") as f:
+            f.write("".join(f"{line}\n" for line in lines))
+        make_temp_version_final(dictionary_path)
+
+    @classmethod
+    def _wrap_lines(cls, window: bytes) -> bytes:
+        lines = [window[i:i + cls.FASTA_LINE_WRAP] for i in range(0, len(window), cls.FASTA_LINE_WRAP)]
+        lines.append(b"")
+        return b"\n".join(lines)
 
     @classmethod
     def _assert_master_fasta_contig_types_match_expected(
@@ -69,8 +364,8 @@ class FastaWriter(object):
             contig_categorizer: ContigCategorizer,
             contig_type_desirabilities: ContigTypeDesirabilities,
     ) -> None:
-        with pysam.Fastafile(master_fasta_path) as master_f:
-            seen_contig_types = {contig_categorizer.get_contig_type(name) for name in master_f.references}
+        with MappedFastaReader(master_fasta_path) as master_f:
+            seen_contig_types = set(contig_categorizer.categorize_many(master_f.references))
 
         expected_contig_types = contig_type_desirabilities.get_expected_contig_types()
         if seen_contig_types != expected_contig_types:
@@ -86,9 +381,9 @@ class FastaWriter(object):
 
     @classmethod
     def _get_header(
-            cls, contig_name: str, standardized_contig_name: str, contig_type: ContigType, sequence: str,
+            cls, contig_name: str, standardized_contig_name: str, contig_type: ContigType, contig_length: int,
     ) -> str:
-        header_entries = [f">{standardized_contig_name}", f"AC:{contig_name}", f"LN:{len(sequence)}"]
+        header_entries = [f">{standardized_contig_name}", f"AC:{contig_name}", f"LN:{contig_length}"]
         if contig_type == ContigType.UNLOCALIZED:
             region = standardized_contig_name.split("_")[0]
             header_entries.append(f"rg:{region}")
@@ -101,7 +396,7 @@ class FastaWriter(object):
             )
             raise NotImplementedError(error_msg)
         header_entries.append(f"rl:{cls._get_contig_role(contig_type)}")
-        header_entries.append(f"M5:{hashlib.md5(sequence.encode('utf-8')).hexdigest()}")
+        header_entries.append(cls.MD5_PLACEHOLDER_ENTRY)
         assembly = contig_type.get_assembly()
         if assembly == Assembly.GRCH38:
             header_entries.append("AS:GRCh38")
@@ -123,3 +418,8 @@ class FastaWriter(object):
             return cls.CONTIG_TYPE_TO_ROLE[contig_type]
         else:
             raise ValueError(f"Encountered contig type without an assigned role: {contig_type}")
+
+
+def get_sequence_dictionary_path(fasta_path: Path) -> Path:
+    # Like Picard and GATK expect, so "ref.fasta" gets "ref.dict"
+    return fasta_path.with_suffix(".dict")
@@ -0,0 +1,135 @@
+import errno
+import hashlib
+import json
+import logging
+import shutil
+import tempfile
+from pathlib import Path
+from typing import NamedTuple, List, Optional, Tuple
+
+from ref_lib.contig_digest import ContigDigest, ContigDigestTable
+from ref_lib.fasta_reader import MappedFastaReader
+from ref_lib.ref_genome_feature_analysis import ReferenceGenomeFeatureAnalysis
+from ref_lib.ref_util import get_md5_of_file
+
+# Increase when the analysis changes in a way that invalidates previously cached results
+FEATURE_ANALYSIS_CACHE_VERSION = 1
+
+
+class FastaFingerprint(NamedTuple):
+    size: int
+    mtime_ns: int
+    index_md5: str
+    sampled_blocks_md5: str
+
+
+class FastaFingerprinter(object):
+    """Cheap identification of a FASTA file that doesn't require reading all of it."""
+    SAMPLED_BLOCK_COUNT = 64
+    SAMPLED_BLOCK_SIZE = 64 * 1024
+
+    @classmethod
+    def get_fingerprint(cls, fasta_path: Path) -> FastaFingerprint:
+        stat_result = fasta_path.stat()
+        index_md5 = get_md5_of_file(MappedFastaReader.create_index_if_missing(fasta_path))
+
+        sampled_blocks_md5 = hashlib.md5()
+        with open(fasta_path, "rb") as f:
+            for offset in cls._get_sampled_block_offsets(stat_result.st_size):
+                f.seek(offset)
+                sampled_blocks_md5.update(f.read(cls.SAMPLED_BLOCK_SIZE))
+
+        return FastaFingerprint(stat_result.st_size, stat_result.st_mtime_ns, index_md5, sampled_blocks_md5.hexdigest())
+
+    @classmethod
+    def _get_sampled_block_offsets(cls, file_size: int) -> List[int]:
+        # Evenly spaced, including the first and last block of the file
+        if file_size <= cls.SAMPLED_BLOCK_COUNT * cls.SAMPLED_BLOCK_SIZE:
+            return list(range(0, file_size, cls.SAMPLED_BLOCK_SIZE))
+        last_offset = file_size - cls.SAMPLED_BLOCK_SIZE
+        return [
+            index * last_offset // (cls.SAMPLED_BLOCK_COUNT - 1) for index in range(cls.SAMPLED_BLOCK_COUNT)
+        ]
+
+
+class FeatureAnalysisCache(object):
+    """
+    Persistent cache of feature analyses with the per-contig digests they were based on.
+    Entries are keyed by the fingerprint of the analyzed FASTA file and the checksums of the other analysis inputs,
+    like the contig alias file and the rCRS file.
+    """
+    ANALYSIS_FILE_NAME = "analysis.json"
+    CONTIG_DIGESTS_FILE_NAME = "contig_digests.tsv"
+
+    def __init__(self, cache_dir: Path) -> None:
+        self._cache_dir = cache_dir
+
+    @classmethod
+    def get_key(cls, fasta_fingerprint: FastaFingerprint, other_input_paths: List[Path]) -> str:
+        key_entries = [str(FEATURE_ANALYSIS_CACHE_VERSION), *[str(value) for value in fasta_fingerprint]]
+        key_entries.extend(get_md5_of_file(path) for path in other_input_paths)
+        return hashlib.sha256("\t".join(key_entries).encode("utf-8")).hexdigest()
+
+    def load(self, key: str) -> Optional[Tuple[ReferenceGenomeFeatureAnalysis, List[ContigDigest]]]:
+        entry_dir = self._get_entry_dir(key)
+        if not entry_dir.exists():
+            return None
+
+        with open(entry_dir / self.ANALYSIS_FILE_NAME, "r") as f:
+            field_to_value = json.load(f)["analysis"]
+        if set(field_to_value.keys()) != set(ReferenceGenomeFeatureAnalysis._fields):
+            logging.warning(f"Ignoring cached feature analysis with unexpected fields: {entry_dir}")
+            return None
+        analysis = ReferenceGenomeFeatureAnalysis(**field_to_value)
+        contig_digests = ContigDigestTable.read(entry_dir / self.CONTIG_DIGESTS_FILE_NAME)
+        logging.info(f"Loaded cached feature analysis from {entry_dir}")
+        return analysis, contig_digests
+
+    def store(
+            self,
+            key: str,
+            ref_genome_path: Path,
+            fasta_fingerprint: FastaFingerprint,
+            analysis: ReferenceGenomeFeatureAnalysis,
+            contig_digests: List[ContigDigest],
+    ) -> None:
+        # Written to a temporary directory first, so an interrupted run never leaves a partial entry behind.
+        # Each writer gets its own temporary directory, since identical ref genomes can be analyzed concurrently.
+        entry_dir = self._get_entry_dir(key)
+        self._cache_dir.mkdir(parents=True, exist_ok=True)
+        temp_entry_dir = Path(tempfile.mkdtemp(prefix=f"{key}.", suffix=".tmp", dir=self._cache_dir))
+        try:
+            entry = {
+                "ref_genome": str(ref_genome_path.resolve()),
+                "fingerprint": fasta_fingerprint._asdict(),
+                "analysis": analysis._asdict(),
+            }
+            with open(temp_entry_dir / self.ANALYSIS_FILE_NAME, "w") as f:
+                json.dump(entry, f, indent=2)
+            ContigDigestTable.write(contig_digests, temp_entry_dir / self.CONTIG_DIGESTS_FILE_NAME)
+
+            self._remove_entry_dir(entry_dir)
+            try:
+                temp_entry_dir.rename(entry_dir)
+            except OSError as exc:
+                # Another writer stored the same entry in the meantime
+                if exc.errno not in {errno.EEXIST, errno.ENOTEMPTY}:
+                    raise
+                logging.info(f"Feature analysis was stored in cache concurrently: {entry_dir}")
+                return
+        finally:
+            shutil.rmtree(temp_entry_dir, ignore_errors=True)
+        logging.info(f"Stored feature analysis in cache: {entry_dir}")
+
+    def _remove_entry_dir(self, entry_dir: Path) -> None:
+        # Moved out of the way first, so concurrent writers never remove the same directory
+        outdated_dir = Path(tempfile.mkdtemp(prefix=f"{entry_dir.name}.", suffix=".outdated", dir=self._cache_dir))
+        try:
+            entry_dir.rename(outdated_dir / entry_dir.name)
+        except FileNotFoundError:
+            pass
+        finally:
+            shutil.rmtree(outdated_dir)
+
+    def _get_entry_dir(self, key: str) -> Path:
+        return self._cache_dir / key
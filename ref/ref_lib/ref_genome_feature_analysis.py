@@ -1,16 +1,22 @@
-import gzip
+import hashlib
 import logging
-import shutil
 import concurrent.futures
 from pathlib import Path
-from typing import NamedTuple, Optional, Set
-
-import pysam
+from typing import NamedTuple, Optional, Set, TypeVar, Tuple, List, Dict
 
 from ref_lib.contig_classification import ContigCategorizer
+from ref_lib.contig_digest import ContigDigest, ContigDigester
 from ref_lib.contig_name_translation import ContigNameTranslator
+from ref_lib.fasta_reader import FastaReader, open_fasta_reader, read_single_record_fasta
 from ref_lib.ref_util import assert_file_exists, STANDARD_NUCLEOTIDES, SOFTMASKED_NUCLEOTIDES, UNKNOWN_NUCLEOTIDES
 
+T = TypeVar("T")
+
+# Reference genome handle of the current worker process, see ReferenceGenomeFeatureAnalyzer._open_worker_genome
+_worker_genome_f: Optional[FastaReader] = None
+# Length and MD5 of rCRS sequences read by the current process, by path and file stats
+_rcrs_cache_key_to_length_and_md5: Dict[Tuple[str, int, int], Tuple[int, str]] = {}
+
 
 class ReferenceGenomeFeatureAnalysis(NamedTuple):
     has_unplaced_contigs: bool
@@ -34,14 +40,32 @@ class ReferenceGenomeFeatureAnalyzer(object):
 
     @classmethod
     def do_analysis(
-            cls, ref_genome_path: Path, rcrs_path: Optional[Path], contig_name_translator: ContigNameTranslator,
+            cls,
+            ref_genome_path: Path,
+            rcrs_path: Optional[Path],
+            contig_name_translator: ContigNameTranslator,
+            processes: Optional[int] = None,
     ) -> ReferenceGenomeFeatureAnalysis:
+        analysis, _ = cls.do_analysis_with_contig_digests(
+            ref_genome_path, rcrs_path, contig_name_translator, processes,
+        )
+        return analysis
+
+    @classmethod
+    def do_analysis_with_contig_digests(
+            cls,
+            ref_genome_path: Path,
+            rcrs_path: Optional[Path],
+            contig_name_translator: ContigNameTranslator,
+            processes: Optional[int] = None,
+    ) -> Tuple[ReferenceGenomeFeatureAnalysis, List[ContigDigest]]:
         # Assert that files exist where they should
         assert_file_exists(ref_genome_path)
         if rcrs_path is not None:
             assert_file_exists(rcrs_path)
-        with pysam.Fastafile(ref_genome_path) as genome_f:
-            contig_names = list(genome_f.references)
+        with open_fasta_reader(ref_genome_path) as genome_f:
+            contig_to_length = {name: genome_f.get_reference_length(name) for name in genome_f.references}
+        contig_names = list(contig_to_length.keys())
 
         contig_categorizer = ContigCategorizer(contig_name_translator)
         categorized_contig_names = contig_categorizer.get_categorized_contig_names(contig_names)
@@ -55,7 +79,33 @@ class ReferenceGenomeFeatureAnalyzer(object):
             warn_msg = f"Did not find exactly one X contig: x={categorized_contig_names.x_contigs}"
             logging.warning(warn_msg)
 
-        nucleotides = cls._get_nucleotides_from_fasta(ref_genome_path)
+        # The checks are independent, so they run as separate tasks on a shared pool of worker processes.
+        # Each worker opens the reference genome once and reuses that handle for all of its tasks.
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=processes, initializer=cls._open_worker_genome, initargs=(ref_genome_path,),
+        ) as executor:
+            # Longest contigs first, so the slowest tasks don't end up at the back of the queue
+            contig_to_digest_future = {
+                contig_name: executor.submit(cls._get_contig_digest, contig_name)
+                for contig_name in sorted(contig_names, key=lambda name: contig_to_length[name], reverse=True)
+            }
+            rcrs_future = None
+            if rcrs_path is not None and len(categorized_contig_names.mitochondrial_contigs) == 1:
+                rcrs_future = executor.submit(
+                    cls._mitochondrial_sequence_is_rcrs, rcrs_path, categorized_contig_names.mitochondrial_contigs[0],
+                )
+            y_test_sequence_future = None
+            if len(categorized_contig_names.y_contigs) == 1:
+                y_test_sequence_future = executor.submit(
+                    cls._get_y_test_sequence, categorized_contig_names.y_contigs[0],
+                )
+            alt_is_definitely_padded_futures = [
+                executor.submit(cls._is_definitely_padded_with_n, contig)
+                for contig in categorized_contig_names.alt_contigs
+            ]
+
+        contig_digests = [cls._get_result(contig_to_digest_future[contig_name]) for contig_name in contig_names]
+        nucleotides = {symbol for digest in contig_digests for symbol, _ in digest.composition}
         logging.info(f"nucleotides: {sorted(nucleotides)}")
 
         has_unplaced_contigs = bool(categorized_contig_names.unplaced_contigs)
@@ -75,10 +125,8 @@ class ReferenceGenomeFeatureAnalyzer(object):
             logging.warning(f"Found more than one EBV contig: {categorized_contig_names.ebv_contigs}")
             has_ebv = None
         has_rcrs: Optional[bool]
-        if rcrs_path is not None and len(categorized_contig_names.mitochondrial_contigs) == 1:
-            has_rcrs = cls._mitochondrial_sequence_is_rcrs(
-                ref_genome_path, rcrs_path, categorized_contig_names.mitochondrial_contigs[0],
-            )
+        if rcrs_future is not None:
+            has_rcrs = cls._get_result(rcrs_future)
         elif rcrs_path is None:
             warn_msg = (
                 f"rCRS argument not provided, so skipping comparison of mitochondrial sequence."
@@ -97,10 +145,8 @@ class ReferenceGenomeFeatureAnalyzer(object):
             for contig_name in categorized_contig_names.get_contig_names()
         )
         has_only_hardmasked_nucleotides_at_y_par1: Optional[bool]
-        if len(categorized_contig_names.y_contigs) == 1:
-            y_test_nucleotides = cls._get_nucleotides_from_string(
-                cls._get_y_test_sequence(categorized_contig_names.y_contigs[0], ref_genome_path)
-            )
+        if y_test_sequence_future is not None:
+            y_test_nucleotides = cls._get_nucleotides_from_string(cls._get_result(y_test_sequence_future))
             logging.info(f"nucleotides at y par1 test region: {sorted(y_test_nucleotides)}")
             has_only_hardmasked_nucleotides_at_y_par1 = not bool(y_test_nucleotides.difference(UNKNOWN_NUCLEOTIDES))
         else:
@@ -116,10 +162,7 @@ class ReferenceGenomeFeatureAnalyzer(object):
         has_softmasked_nucleotides = bool(nucleotides.intersection(SOFTMASKED_NUCLEOTIDES))
         alts_are_padded: Optional[bool]
         if categorized_contig_names.alt_contigs:
-            alt_is_definitely_padded_list = [
-                cls._is_definitely_padded_with_n(contig, ref_genome_path)
-                for contig in categorized_contig_names.alt_contigs
-            ]
+            alt_is_definitely_padded_list = [cls._get_result(future) for future in alt_is_definitely_padded_futures]
             if all(is_padded for is_padded in alt_is_definitely_padded_list):
                 alts_are_padded = True
             elif all(not is_padded for is_padded in alt_is_definitely_padded_list):
@@ -131,9 +174,9 @@ class ReferenceGenomeFeatureAnalyzer(object):
             logging.warning(f"There are no alts that could be padded with N's (or n's)")
             alts_are_padded = None
 
-        standardized_contig_names = {
-            contig_name_translator.standardize(contig_name) for contig_name in categorized_contig_names.unplaced_contigs
-        }
+        standardized_contig_names = set(
+            contig_name_translator.standardize_many(categorized_contig_names.unplaced_contigs),
+        )
         has_ki270752 = cls.CANONICAL_KI270752_NAME in standardized_contig_names
 
         analysis = ReferenceGenomeFeatureAnalysis(
@@ -151,77 +194,69 @@ class ReferenceGenomeFeatureAnalyzer(object):
             alts_are_padded,
             has_ki270752,
         )
-        return analysis
+        return analysis, contig_digests
 
     @classmethod
-    def _mitochondrial_sequence_is_rcrs(
-            cls,
-            ref_genome_path: Path,
-            rcrs_path: Path,
-            ref_mitochondrial_contig_name: str,
-    ) -> bool:
-        do_decompress = rcrs_path.suffix == ".gz"
-        if do_decompress:
-            uncompressed_rcrs_path = rcrs_path.with_suffix("")
-            if uncompressed_rcrs_path.exists():
-                error_msg = (
-                    f"Cannot decompress file {rcrs_path} without overwriting existing file {uncompressed_rcrs_path}"
-                )
-                raise FileExistsError(error_msg)
-            with gzip.open(rcrs_path, "rb") as source_f, open(uncompressed_rcrs_path, "wb") as target_f:
-                shutil.copyfileobj(source_f, target_f)
-        else:
-            uncompressed_rcrs_path = rcrs_path
-        with pysam.Fastafile(uncompressed_rcrs_path) as rcrs_f:
-            if rcrs_f.nreferences != 1:
-                raise ValueError(f"rCRS FASTA file has more than one contig")
-            rcrs_genome = rcrs_f.fetch(rcrs_f.references[0])
-        if do_decompress:
-            uncompressed_rcrs_path.unlink()
-            (uncompressed_rcrs_path.parent / f"{uncompressed_rcrs_path.name}.fai") .unlink()
-        with pysam.Fastafile(ref_genome_path) as genome_f:
-            mitochondrial_from_ref = genome_f.fetch(ref_mitochondrial_contig_name)
-        return bool(rcrs_genome == mitochondrial_from_ref)
+    def _mitochondrial_sequence_is_rcrs(cls, rcrs_path: Path, ref_mitochondrial_contig_name: str) -> bool:
+        # Case-sensitive comparison, so a softmasked rCRS only matches a mitochondrial sequence with the same masking
+        genome_f = cls._get_worker_genome()
+        mitochondrial_md5 = hashlib.md5()
+        for window in genome_f.iterate_windows(ref_mitochondrial_contig_name):
+            mitochondrial_md5.update(window)
+        mitochondrial_length = genome_f.get_reference_length(ref_mitochondrial_contig_name)
+        return (mitochondrial_length, mitochondrial_md5.hexdigest()) == cls._get_rcrs_length_and_md5(rcrs_path)
 
     @classmethod
-    def _get_y_test_sequence(cls, y_contig_name: str, ref_genome_path: Path) -> str:
-        with pysam.Fastafile(ref_genome_path) as genome_f:
-            return str(genome_f.fetch(y_contig_name, cls.Y_PAR1_TEST_REGION[0], cls.Y_PAR1_TEST_REGION[1]))
+    def _get_rcrs_length_and_md5(cls, rcrs_path: Path) -> Tuple[int, str]:
+        # Cached per process. The file stats are part of the key, so a replaced file is read again.
+        stat_result = rcrs_path.stat()
+        cache_key = (str(rcrs_path.resolve()), stat_result.st_size, stat_result.st_mtime_ns)
+        if cache_key not in _rcrs_cache_key_to_length_and_md5:
+            rcrs_sequence = read_single_record_fasta(rcrs_path).sequence
+            _rcrs_cache_key_to_length_and_md5[cache_key] = (len(rcrs_sequence), hashlib.md5(rcrs_sequence).hexdigest())
+        return _rcrs_cache_key_to_length_and_md5[cache_key]
 
     @classmethod
-    def _is_definitely_padded_with_n(cls, contig_name: str, ref_genome_path: Path) -> bool:
-        with pysam.Fastafile(ref_genome_path) as genome_f:
-            first_1000_nucleotides = cls._get_nucleotides_from_string(
-                genome_f.fetch(contig_name, 0, 1000)
-            )
-            last_1000_nucleotides = cls._get_nucleotides_from_string(
-                genome_f.fetch(contig_name, start=genome_f.get_reference_length(contig_name) - 1000)
-            )
+    def _get_y_test_sequence(cls, y_contig_name: str) -> str:
+        return cls._get_worker_genome().fetch(y_contig_name, cls.Y_PAR1_TEST_REGION[0], cls.Y_PAR1_TEST_REGION[1])
+
+    @classmethod
+    def _is_definitely_padded_with_n(cls, contig_name: str) -> bool:
+        genome_f = cls._get_worker_genome()
+        first_1000_nucleotides = cls._get_nucleotides_from_string(
+            genome_f.fetch(contig_name, 0, 1000)
+        )
+        last_1000_nucleotides = cls._get_nucleotides_from_string(
+            genome_f.fetch(contig_name, start=genome_f.get_reference_length(contig_name) - 1000)
+        )
 
         first_1000_nucleotides_all_unknown = first_1000_nucleotides.issubset(UNKNOWN_NUCLEOTIDES)
         last_1000_nucleotides_all_unknown = last_1000_nucleotides.issubset(UNKNOWN_NUCLEOTIDES)
         return first_1000_nucleotides_all_unknown and last_1000_nucleotides_all_unknown
 
     @classmethod
-    def _get_nucleotides_from_fasta(cls, fasta_path: Path) -> Set[str]:
-        futures = []
-        with concurrent.futures.ProcessPoolExecutor() as executor:
-            with pysam.Fastafile(fasta_path) as genome_f:
-                for contig_name in genome_f.references:
-                    contig = genome_f.fetch(contig_name)
-                    futures.append(executor.submit(cls._get_nucleotides_from_string, contig))
-
-        nucleotides: Set[str] = set()
-        for future in concurrent.futures.as_completed(futures):
-            try:
-                nucleotides = nucleotides.union(future.result())
-            except Exception as exc:
-                raise ValueError(exc)
-        return nucleotides
+    def _get_contig_digest(cls, contig_name: str) -> ContigDigest:
+        return ContigDigester.digest_contig(cls._get_worker_genome(), contig_name)
+
+    @classmethod
+    def _open_worker_genome(cls, ref_genome_path: Path) -> None:
+        # Kept open for the lifetime of the worker process
+        global _worker_genome_f
+        _worker_genome_f = open_fasta_reader(ref_genome_path)
+
+    @classmethod
+    def _get_worker_genome(cls) -> FastaReader:
+        if _worker_genome_f is None:
+            raise ValueError("Reference genome has not been opened in this worker process")
+        return _worker_genome_f
+
+    @classmethod
+    def _get_result(cls, future: "concurrent.futures.Future[T]") -> T:
+        try:
+            return future.result()
+        except Exception as exc:
+            raise ValueError(exc)
 
     @classmethod
     def _get_nucleotides_from_string(cls, sequence: str) -> Set[str]:
-        nucleotides = set()
-        for nucleotide in sequence:
-            nucleotides.add(nucleotide)
-        return nucleotides
+        return set(sequence)
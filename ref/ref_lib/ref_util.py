@@ -1,10 +1,16 @@
 import concurrent.futures
+import fcntl
 import gzip
+import hashlib
 import logging
+import os
 import re
 import shutil
+import string
+import subprocess
+import zlib
 from pathlib import Path
-from typing import Tuple, List
+from typing import Tuple, List, Optional, BinaryIO, Iterable, NamedTuple
 
 import requests
 from google.cloud import storage
@@ -12,11 +18,23 @@ from google.cloud import storage
 STANDARD_NUCLEOTIDES = {"A", "C", "G", "T", "N"}
 SOFTMASKED_NUCLEOTIDES = {"a", "c", "g", "t", "n"}
 UNKNOWN_NUCLEOTIDES = {"N", "n"}
+UPPERCASE_TRANSLATION_TABLE = bytes.maketrans(string.ascii_lowercase.encode(), string.ascii_uppercase.encode())
 
 ALIAS_TO_CANONICAL_CONTIG_NAME_FILE_NAME = "alias_to_canonical_contig_name.tsv"
 MASTER_FASTA_FILE_NAME = "master.fasta"
 SOURCE_FILES_DIR_NAME = "source_files"
 
+FILE_READ_BUFFER_SIZE = 8 * 1024 * 1024
+SEQUENCE_WINDOW_SIZE = 70 * 16384
+MAX_KERNEL_COPY_SIZE = 1024 * 1024 * 1024
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+HTTP_OK = 200
+HTTP_PARTIAL_CONTENT = 206
+HTTP_RANGE_NOT_SATISFIABLE = 416
+CONTENT_RANGE_PATTERN = re.compile(r"bytes (?:(\d+)-\d+|\*)/(\d+|\*)")
+STORAGE_EMULATOR_HOST_VARIABLE = "STORAGE_EMULATOR_HOST"
+FICLONE = 0x40049409  # Linux ioctl that makes a copy-on-write clone of a file
+
 
 def set_up_logging() -> None:
     logging.basicConfig(
@@ -45,46 +63,102 @@ def get_text_from_file(path: Path) -> str:
 
 
 def combine_compressed_files(sources: List[Path], target: Path) -> None:
+    # The decompressed parts are removed even if something fails, so they are never mistaken for output files
+    decompressed_sources = [target.parent / f"{target.name}.{index}.part" for index in range(len(sources))]
+    try:
+        futures = []
+        with concurrent.futures.ProcessPoolExecutor() as executor:
+            for source, decompressed_source in zip(sources, decompressed_sources):
+                futures.append(executor.submit(decompress_file, source, decompressed_source))
+
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                future.result()
+            except Exception as exc:
+                raise ValueError(exc)
+
+        concatenate_files(decompressed_sources, target)
+    except Exception:
+        target.unlink(missing_ok=True)
+        raise
+    finally:
+        for decompressed_source in decompressed_sources:
+            decompressed_source.unlink(missing_ok=True)
+
+
+def decompress_file(source: Path, target: Path) -> None:
+    pigz = shutil.which("pigz")
     with open(target, "wb") as f_out:
-        for source in sources:
+        if pigz is not None:
+            subprocess.run([pigz, "--decompress", "--stdout", str(source)], stdout=f_out, check=True)
+        else:
             with gzip.open(source, "rb") as f_in:
-                shutil.copyfileobj(f_in, f_out)
+                shutil.copyfileobj(f_in, f_out, FILE_READ_BUFFER_SIZE)
+
+
+def concatenate_files(sources: List[Path], target: Path) -> None:
+    with open(target, "wb") as f_out:
+        for source in sources:
+            with open(source, "rb") as f_in:
+                append_file_contents(f_in, f_out)
+
+
+def append_file_contents(f_in: BinaryIO, f_out: BinaryIO) -> None:
+    # Let the kernel copy the data when possible, so it never passes through user space
+    f_out.flush()
+    size = os.fstat(f_in.fileno()).st_size
+    copied_size = 0
+    while copied_size < size:
+        newly_copied_size = _copy_in_kernel(f_in.fileno(), f_out.fileno(), size - copied_size)
+        if not newly_copied_size:
+            break
+        copied_size += newly_copied_size
+    f_in.seek(copied_size)
+    f_out.seek(0, os.SEEK_END)
+    shutil.copyfileobj(f_in, f_out, FILE_READ_BUFFER_SIZE)
+
+
+def _copy_in_kernel(in_fd: int, out_fd: int, count: int) -> int:
+    count = min(count, MAX_KERNEL_COPY_SIZE)
+    if hasattr(os, "copy_file_range"):
+        try:
+            return os.copy_file_range(in_fd, out_fd, count)
+        except OSError:
+            pass
+    try:
+        return os.sendfile(out_fd, in_fd, None, count)
+    except OSError:
+        return 0
+
+
+def reflink_or_copy_file(source: Path, target: Path) -> None:
+    # A reflink shares the data until either file is changed, so it is as cheap as a hardlink on file systems
+    # that support it, while the files stay independent. Elsewhere the file is copied.
+    try:
+        _reflink_file(source, target)
+        return
+    except OSError:
+        target.unlink(missing_ok=True)
+    shutil.copyfile(source, target)
+
+
+def _reflink_file(source: Path, target: Path) -> None:
+    with open(source, "rb") as f_in, open(target, "wb") as f_out:
+        fcntl.ioctl(f_out.fileno(), FICLONE, f_in.fileno())
 
 
 def assert_bucket_dir_does_not_exist(bucket_path: str) -> None:
     if not re.fullmatch(r"gs://.+", bucket_path):
         raise ValueError(f"Path is not of the form 'gs://some/file/path': {bucket_path}")
-    bucket_name, relative_path = split_bucket_path(bucket_path)
-    if list(storage.Client().get_bucket(bucket_name).list_blobs(prefix=relative_path)):
+    if bucket_prefix_has_blobs(get_storage_client(), bucket_path):
         raise ValueError(f"Bucket dir exists: {bucket_path}")
 
 
-def upload_directory_to_bucket(source_dir: Path, bucket_dir: str) -> None:
-    assert_dir_exists(source_dir)
-
-    futures = []
-    with concurrent.futures.ProcessPoolExecutor() as executor:
-        for file_path in source_dir.glob("**/*"):
-            if file_path.is_file():
-                target_path = f"{bucket_dir}/{file_path.relative_to(source_dir)}"
-                futures.append(executor.submit(upload_file_to_bucket, file_path, target_path))
-
-    for future in concurrent.futures.as_completed(futures):
-        try:
-            future.result()
-        except Exception as exc:
-            raise ValueError(exc)
-
-
-def upload_file_to_bucket(source_path: Path, bucket_path: str) -> None:
-    logging.info(f"Uploading {source_path} to {bucket_path}")
-    assert_file_exists(source_path)
-    blob = get_blob(bucket_path)
-    if not blob.exists():
-        blob.upload_from_filename(str(source_path))
-        logging.info(f"Finished upload of {source_path} to {bucket_path}")
-    else:
-        raise FileExistsError(f"Cannot upload file {source_path} since it would overwrite an existing file.")
+def bucket_prefix_has_blobs(client: storage.Client, bucket_path: str) -> bool:
+    # Requests at most a single blob, instead of paging through everything with this prefix
+    bucket_name, relative_path = split_bucket_path(bucket_path)
+    blobs = client.list_blobs(bucket_name, prefix=relative_path, max_results=1)
+    return next(iter(blobs), None) is not None
 
 
 def download_bucket_file(source: str, target: Path) -> None:
@@ -92,9 +166,20 @@ def download_bucket_file(source: str, target: Path) -> None:
     make_temp_version_final(target)
 
 
+def bucket_file_exists(path: str) -> bool:
+    return bool(get_blob(path).exists())
+
+
+def get_storage_client() -> storage.Client:
+    # Without credentials when a local GCS emulator is used, like fake-gcs-server
+    if os.environ.get(STORAGE_EMULATOR_HOST_VARIABLE):
+        return storage.Client.create_anonymous_client()
+    return storage.Client()
+
+
 def get_blob(path: str) -> storage.Blob:
     bucket_name, relative_path = split_bucket_path(path)
-    return storage.Client().get_bucket(bucket_name).blob(relative_path)
+    return get_storage_client().get_bucket(bucket_name).blob(relative_path)
 
 
 def split_bucket_path(path: str) -> Tuple[str, str]:
@@ -105,13 +190,151 @@ def split_bucket_path(path: str) -> Tuple[str, str]:
     return bucket_name, relative_path
 
 
-def download_file_over_https(source: str, target: Path) -> None:
-    response = requests.get(source, stream=True)
-    response.raise_for_status()
-    with open(get_temp_path(target), 'wb') as f:
-        for block in response.iter_content(1024):
-            f.write(block)
+class FileChecksums(NamedTuple):
+    md5: str
+    sha256: Optional[str]
+
+
+class DownloadedBlockHandler(object):
+    """Computes checksums of and optionally gunzips the blocks of a download while they pass by."""
+    def __init__(self, compute_sha256: bool = False, decompressed_f: Optional[BinaryIO] = None) -> None:
+        self._md5 = hashlib.md5()
+        self._sha256 = hashlib.sha256() if compute_sha256 else None
+        self._decompressed_f = decompressed_f
+        self._decompressor = zlib.decompressobj(GZIP_WBITS)
+        self._inside_gzip_member = False
+
+    def handle(self, block: bytes) -> None:
+        self._md5.update(block)
+        if self._sha256 is not None:
+            self._sha256.update(block)
+        if self._decompressed_f is not None:
+            self._decompress(block, self._decompressed_f)
+
+    def finish(self) -> FileChecksums:
+        if self._decompressed_f is not None:
+            self._decompressed_f.write(self._decompressor.flush())
+            if self._inside_gzip_member:
+                raise ValueError("Downloaded gzip data is truncated")
+        sha256 = self._sha256.hexdigest() if self._sha256 is not None else None
+        return FileChecksums(self._md5.hexdigest(), sha256)
+
+    def _decompress(self, block: bytes, decompressed_f: BinaryIO) -> None:
+        while block:
+            self._inside_gzip_member = True
+            decompressed_f.write(self._decompressor.decompress(block))
+            if self._decompressor.eof:
+                # Start on next member of multi-member gzip file
+                block = self._decompressor.unused_data
+                self._decompressor = zlib.decompressobj(GZIP_WBITS)
+                self._inside_gzip_member = False
+            else:
+                block = b""
+
+
+def download_file_over_https(
+        source: str, target: Path, compute_sha256: bool = False, decompressed_target: Optional[Path] = None,
+) -> FileChecksums:
+    # The checksums and the optional gunzipped copy are produced while the blocks pass by, instead of in a second read
+    temp_path = get_temp_path(target)
+    validator_path = _get_download_validator_path(target)
+    response_blocks, mode = _start_download(source, temp_path, validator_path)
+
+    decompressed_f = None
+    if decompressed_target is not None:
+        decompressed_f = open(get_temp_path(decompressed_target), "wb", buffering=FILE_READ_BUFFER_SIZE)
+    try:
+        block_handler = DownloadedBlockHandler(compute_sha256, decompressed_f)
+        if mode == "ab":
+            with open(temp_path, "rb") as f:
+                for block in iter(lambda: f.read(FILE_READ_BUFFER_SIZE), b""):
+                    block_handler.handle(block)
+        with open(temp_path, mode, buffering=FILE_READ_BUFFER_SIZE) as f:
+            for block in response_blocks:
+                f.write(block)
+                block_handler.handle(block)
+        checksums = block_handler.finish()
+    except Exception:
+        if decompressed_target is not None:
+            get_temp_path(decompressed_target).unlink(missing_ok=True)
+        raise
+    finally:
+        if decompressed_f is not None:
+            decompressed_f.close()
+
     make_temp_version_final(target)
+    validator_path.unlink(missing_ok=True)
+    if decompressed_target is not None:
+        make_temp_version_final(decompressed_target)
+    return checksums
+
+
+def _start_download(source: str, temp_path: Path, validator_path: Path) -> Tuple[Iterable[bytes], str]:
+    # Resume from a partial temp file from an earlier interrupted download, if there is one.
+    # The If-Range header makes the server send the whole file instead if it has changed in the meantime,
+    # so different versions of the file are never combined.
+    resume_position = temp_path.stat().st_size if temp_path.exists() else 0
+    validator = validator_path.read_text() if resume_position and validator_path.exists() else None
+    if resume_position and validator is None:
+        logging.warning(f"Cannot verify that partial download {temp_path} is still up to date, so starting over")
+    if validator is not None:
+        headers = {"Range": f"bytes={resume_position}-", "If-Range": validator}
+        response = requests.get(source, stream=True, headers=headers)
+        content_range = _parse_content_range(response.headers.get("Content-Range"))
+        if response.status_code == HTTP_PARTIAL_CONTENT and content_range[0] == resume_position:
+            logging.info(f"Resuming download of {source} at byte {resume_position}")
+            return response.iter_content(FILE_READ_BUFFER_SIZE), "ab"
+        elif response.status_code == HTTP_RANGE_NOT_SATISFIABLE and content_range[1] == resume_position:
+            logging.info(f"Partial download {temp_path} is already complete")
+            response.close()
+            return [], "ab"
+        elif response.status_code != HTTP_OK:
+            logging.warning(f"Cannot resume partial download {temp_path}, so starting over: {response.status_code}")
+            response.close()
+            response = requests.get(source, stream=True)
+        else:
+            logging.info(f"Source has changed since partial download {temp_path}, so starting over")
+    else:
+        response = requests.get(source, stream=True)
+
+    response.raise_for_status()
+    new_validator = _get_download_validator(response)
+    if new_validator is not None:
+        validator_path.write_text(new_validator)
+    else:
+        validator_path.unlink(missing_ok=True)
+    return response.iter_content(FILE_READ_BUFFER_SIZE), "wb"
+
+
+def _get_download_validator(response: requests.Response) -> Optional[str]:
+    # Weak ETags are not allowed in If-Range headers
+    etag = response.headers.get("ETag")
+    if etag is not None and not etag.startswith("W/"):
+        return etag
+    return response.headers.get("Last-Modified")
+
+
+def _parse_content_range(content_range: Optional[str]) -> Tuple[Optional[int], Optional[int]]:
+    # Returns the start and the total size of the file, if known
+    match = CONTENT_RANGE_PATTERN.fullmatch(content_range.strip()) if content_range is not None else None
+    if match is None:
+        return None, None
+    start_text, size_text = match.groups()
+    start = int(start_text) if start_text is not None else None
+    size = int(size_text) if size_text != "*" else None
+    return start, size
+
+
+def _get_download_validator_path(target: Path) -> Path:
+    return target.parent / f"{get_temp_path(target).name}.validator"
+
+
+def get_md5_of_file(path: Path) -> str:
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(FILE_READ_BUFFER_SIZE), b""):
+            md5.update(block)
+    return md5.hexdigest()
 
 
 def get_temp_path(path: Path) -> Path:
@@ -0,0 +1,124 @@
+import hashlib
+import logging
+import os
+import stat
+import tempfile
+from pathlib import Path
+from typing import Optional, Set
+
+from ref_lib.ref_util import reflink_or_copy_file, get_temp_path, make_temp_version_final
+
+DEFAULT_SOURCE_FILE_CACHE_MAX_SIZE_GIB = 20
+GIB = 1024 * 1024 * 1024
+TEMP_FILE_SUFFIX = ".tmp"
+READ_ONLY_FILE_MODE = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+
+
+class SourceFileCache(object):
+    """
+    Local content-addressed cache of source files, shared between working dirs.
+    Files are stored by MD5, and the MD5 of the latest version of each source is recorded as well,
+    so files can be found by source or by checksum.
+    Files are copied into and out of the cache as reflinks where the file system allows it, so their data is shared
+    without the files being linked. Elsewhere they are copied, which still avoids downloading them again.
+    When the cache grows beyond its maximum size, the least recently used files are removed.
+    """
+    OBJECTS_DIR_NAME = "objects"
+    SOURCES_DIR_NAME = "sources"
+    LAST_USED_DIR_NAME = "last_used"
+
+    def __init__(self, cache_dir: Path, max_size: int = DEFAULT_SOURCE_FILE_CACHE_MAX_SIZE_GIB * GIB) -> None:
+        self._cache_dir = cache_dir
+        self._max_size = max_size
+        self._md5s_used_in_this_run: Set[str] = set()
+        for dir_name in [self.OBJECTS_DIR_NAME, self.SOURCES_DIR_NAME, self.LAST_USED_DIR_NAME]:
+            (self._cache_dir / dir_name).mkdir(parents=True, exist_ok=True)
+
+    def retrieve(self, source: str, expected_md5: Optional[str], target: Path) -> Optional[str]:
+        # Returns the MD5 of the retrieved file, or None if it is not in the cache
+        md5 = expected_md5 if expected_md5 is not None else self._get_recorded_md5(source)
+        if md5 is None or not self._get_object_path(md5).exists():
+            return None
+        logging.info(f"Retrieving {target.name} from source file cache: {self._get_object_path(md5)}")
+        reflink_or_copy_file(self._get_object_path(md5), get_temp_path(target))
+        make_temp_version_final(target)
+        self._record_source(source, md5)
+        self._mark_used(md5)
+        return md5
+
+    def store(self, source: str, md5: str, path: Path) -> None:
+        object_path = self._get_object_path(md5)
+        if not object_path.exists():
+            logging.info(f"Storing {path.name} in source file cache: {object_path}")
+            temp_object_path = self._create_unique_temp_path(object_path)
+            try:
+                reflink_or_copy_file(path, temp_object_path)
+                temp_object_path.chmod(READ_ONLY_FILE_MODE)
+                temp_object_path.rename(object_path)
+            except Exception:
+                temp_object_path.unlink(missing_ok=True)
+                raise
+        self._record_source(source, md5)
+        self._mark_used(md5)
+        self._evict_least_recently_used()
+
+    def _evict_least_recently_used(self) -> None:
+        # Temp files of stores that are still in progress are not objects yet
+        object_paths = [
+            object_path for object_path in (self._cache_dir / self.OBJECTS_DIR_NAME).iterdir()
+            if not object_path.name.endswith(TEMP_FILE_SUFFIX)
+        ]
+        total_size = sum(object_path.stat().st_size for object_path in object_paths)
+        object_paths.sort(key=lambda object_path: self._get_last_used_time(object_path.name))
+        for object_path in object_paths:
+            if total_size <= self._max_size:
+                break
+            md5 = object_path.name
+            if md5 in self._md5s_used_in_this_run:
+                continue
+            logging.info(f"Removing least recently used file from source file cache: {object_path}")
+            total_size -= object_path.stat().st_size
+            object_path.unlink()
+            self._get_last_used_path(md5).unlink(missing_ok=True)
+        if total_size > self._max_size:
+            logging.warning("Source file cache is larger than its maximum size, since all files are in use")
+
+    def _get_recorded_md5(self, source: str) -> Optional[str]:
+        source_path = self._get_source_path(source)
+        if not source_path.exists():
+            return None
+        with open(source_path, "r") as f:
+            recorded_source, md5 = f.read().rstrip("\n").split("\t")
+        return md5 if recorded_source == source else None
+
+    def _record_source(self, source: str, md5: str) -> None:
+        source_path = self._get_source_path(source)
+        temp_source_path = self._create_unique_temp_path(source_path)
+        with open(temp_source_path, "w") as f:
+            f.write(f"{source}\t{md5}\n")
+        temp_source_path.chmod(READ_ONLY_FILE_MODE)
+        temp_source_path.rename(source_path)
+
+    def _mark_used(self, md5: str) -> None:
+        self._md5s_used_in_this_run.add(md5)
+        self._get_last_used_path(md5).touch()
+
+    def _get_last_used_time(self, md5: str) -> int:
+        last_used_path = self._get_last_used_path(md5)
+        return last_used_path.stat().st_mtime_ns if last_used_path.exists() else 0
+
+    @staticmethod
+    def _create_unique_temp_path(path: Path) -> Path:
+        # Concurrent writers of the same file each get their own temp file, so none of them can rename another's
+        temp_fd, temp_name = tempfile.mkstemp(prefix=f"{path.name}.", suffix=TEMP_FILE_SUFFIX, dir=path.parent)
+        os.close(temp_fd)
+        return Path(temp_name)
+
+    def _get_object_path(self, md5: str) -> Path:
+        return self._cache_dir / self.OBJECTS_DIR_NAME / md5
+
+    def _get_source_path(self, source: str) -> Path:
+        return self._cache_dir / self.SOURCES_DIR_NAME / hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+    def _get_last_used_path(self, md5: str) -> Path:
+        return self._cache_dir / self.LAST_USED_DIR_NAME / md5
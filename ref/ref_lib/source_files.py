@@ -1,9 +1,12 @@
+import concurrent.futures
 import logging
 from enum import Enum, auto
 from pathlib import Path
-from typing import List, NamedTuple, overload, Any, Optional
+from typing import List, NamedTuple, overload, Any, Optional, Dict
 
-from ref_lib.ref_util import make_temp_version_final, get_temp_path, download_bucket_file, download_file_over_https
+from ref_lib.ref_util import make_temp_version_final, get_temp_path, download_bucket_file, download_file_over_https, \
+    get_md5_of_file, bucket_file_exists
+from ref_lib.source_file_cache import SourceFileCache
 
 
 class SourceFile(Enum):
@@ -84,9 +87,18 @@ class DownloadJob(NamedTuple):
     target: Path
 
 
+class FileStat(NamedTuple):
+    size: int
+    mtime_ns: int
+    md5: str  # of the file when it had this size and modification time
+
+
 class SourceFileDownloader(object):
     SOURCES_LIST_FILE_NAME = "sources.txt"
-    
+    CHECKSUM_MANIFEST_FILE_NAME = "checksums.md5"
+    FILE_STATS_FILE_NAME = "file_stats.tsv"
+    MAX_CONCURRENT_DOWNLOADS = 4
+
     @classmethod
     def download_source_files(
             cls,
@@ -94,7 +106,11 @@ class SourceFileDownloader(object):
             target_dir: Path,
             bucket_dir: Optional[str] = None,
             create_file_with_sources: bool = True,
+            cache: Optional[SourceFileCache] = None,
+            verify_checksums: bool = False,
     ) -> None:
+        # Existing files are only hashed again if their size or modification time has changed since they were
+        # last verified, or if verify_checksums is set
         logging.info(f"Starting download of source files: {[file.name for file in source_files]}")
         download_jobs = [
             DownloadJob(
@@ -104,25 +120,13 @@ class SourceFileDownloader(object):
             ) for source_file in source_files
         ]
         local_sources_list_file_path = target_dir / cls.SOURCES_LIST_FILE_NAME
-
-        local_file_exists_list = [job.target.exists() for job in download_jobs]
-        if create_file_with_sources:
-            local_file_exists_list.append(local_sources_list_file_path.exists())
-
-        if all(local_file_exists_list):
-            logging.info("Skipping downloads. Source files already exist locally.")
-            return
-        elif any(local_file_exists_list):
-            error_msg = (
-                f"Some of the expected source files already exist locally and other do not. "
-                f"Please delete the existing local source files so new version can be downloaded."
-            )
-            raise ValueError(error_msg)
+        checksum_manifest_path = target_dir / cls.CHECKSUM_MANIFEST_FILE_NAME
+        file_stats_path = target_dir / cls.FILE_STATS_FILE_NAME
 
         if not target_dir.is_dir():
             target_dir.mkdir(parents=True)
 
-        if create_file_with_sources:
+        if create_file_with_sources and not local_sources_list_file_path.exists():
             if bucket_dir is None:
                 logging.info(f"Writing original sources of files to a file: {local_sources_list_file_path}")
                 cls._write_local_sources_list_file(download_jobs, local_sources_list_file_path)
@@ -130,30 +134,153 @@ class SourceFileDownloader(object):
                 logging.info(f"Downloading file with original sources from bucket: {bucket_dir}")
                 download_bucket_file(f"{bucket_dir}/{cls.SOURCES_LIST_FILE_NAME}", local_sources_list_file_path)
 
-        logging.info("Starting downloads of source files")
+        if bucket_dir is not None and not checksum_manifest_path.exists():
+            bucket_checksum_manifest_path = f"{bucket_dir}/{cls.CHECKSUM_MANIFEST_FILE_NAME}"
+            if bucket_file_exists(bucket_checksum_manifest_path):
+                logging.info(f"Downloading checksum manifest from bucket: {bucket_checksum_manifest_path}")
+                download_bucket_file(bucket_checksum_manifest_path, checksum_manifest_path)
+
+        file_name_to_md5 = cls._read_checksum_manifest(checksum_manifest_path)
+        file_name_to_stat = {} if verify_checksums else cls._read_file_stats(file_stats_path)
+        missing_download_jobs = [
+            job for job in download_jobs if not cls._is_downloaded(job, file_name_to_md5, file_name_to_stat)
+        ]
+        if cache is not None:
+            missing_download_jobs = [
+                job for job in missing_download_jobs if not cls._retrieve_from_cache(job, file_name_to_md5, cache)
+            ]
+        if not missing_download_jobs:
+            logging.info("Skipping downloads. Source files already exist locally.")
+            cls._write_checksum_manifest(file_name_to_md5, checksum_manifest_path)
+            cls._write_file_stats(file_name_to_md5, target_dir, file_stats_path)
+            return
+
+        logging.info(f"Starting downloads of source files: {[job.source_file.name for job in missing_download_jobs]}")
         download_failed = False
-        for job in download_jobs:
-            logging.info(f"Start download of {job.source_file.name}")
-            try:
-                if bucket_dir is None:
-                    logging.info(f"Download over https: {job.source}")
-                    download_file_over_https(job.source, job.target)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=cls.MAX_CONCURRENT_DOWNLOADS) as executor:
+            future_to_job = {
+                executor.submit(cls._download, job, bucket_dir is None): job for job in missing_download_jobs
+            }
+            for future in concurrent.futures.as_completed(future_to_job):
+                job = future_to_job[future]
+                try:
+                    md5 = future.result()
+                    expected_md5 = file_name_to_md5.get(job.target.name)
+                    if expected_md5 is not None and md5 != expected_md5:
+                        job.target.unlink()
+                        raise ValueError(f"Checksum mismatch: expected={expected_md5}, actual={md5}")
+                except Exception as exc:
+                    logging.error(
+                        f"Download of {job.source_file.name} from {job.source} to {job.target} "
+                        f"has generated an exception: {exc}"
+                    )
+                    download_failed = True
                 else:
-                    logging.info(f"Download from bucket: {job.source}")
-                    download_bucket_file(job.source, job.target)
-            except Exception as exc:
-                logging.error(
-                    f"Download of {job.source_file.name} from {job.source} to {job.target} "
-                    f"has generated an exception: {exc}"
-                )
-                download_failed = True
-            else:
-                logging.info(f"Finished download of {job.source_file.name}")
+                    file_name_to_md5[job.target.name] = md5
+                    if cache is not None:
+                        cache.store(job.source, md5, job.target)
+                    logging.info(f"Finished download of {job.source_file.name}")
+
+        cls._write_checksum_manifest(file_name_to_md5, checksum_manifest_path)
+        cls._write_file_stats(file_name_to_md5, target_dir, file_stats_path)
         if download_failed:
             raise ValueError("Download of at least one file has failed")
         else:
             logging.info(f"Finished downloads of source files: {[file.name for file in source_files]}")
 
+    @classmethod
+    def _is_downloaded(
+            cls, job: DownloadJob, file_name_to_md5: Dict[str, str], file_name_to_stat: Dict[str, FileStat],
+    ) -> bool:
+        # Records checksums of existing files that are not in the manifest yet
+        if not job.target.exists():
+            return False
+        expected_md5 = file_name_to_md5.get(job.target.name)
+        recorded_stat = file_name_to_stat.get(job.target.name)
+        if recorded_stat is not None and expected_md5 in {None, recorded_stat.md5}:
+            if cls._get_file_stat(job.target, recorded_stat.md5) == recorded_stat:
+                logging.info(f"Existing file is unchanged since its checksum was verified: {job.target}")
+                file_name_to_md5[job.target.name] = recorded_stat.md5
+                return True
+        md5 = get_md5_of_file(job.target)
+        if expected_md5 is None:
+            logging.warning(f"No checksum recorded for existing file, so trusting it: {job.target}")
+            file_name_to_md5[job.target.name] = md5
+            return True
+        elif md5 == expected_md5:
+            return True
+        else:
+            logging.warning(f"Existing file does not match recorded checksum, so downloading it again: {job.target}")
+            job.target.unlink()
+            return False
+
+    @classmethod
+    def _retrieve_from_cache(cls, job: DownloadJob, file_name_to_md5: Dict[str, str], cache: SourceFileCache) -> bool:
+        md5 = cache.retrieve(job.source, file_name_to_md5.get(job.target.name), job.target)
+        if md5 is None:
+            return False
+        file_name_to_md5[job.target.name] = md5
+        return True
+
+    @classmethod
+    def _download(cls, job: DownloadJob, over_https: bool) -> str:
+        logging.info(f"Start download of {job.source_file.name}")
+        if over_https:
+            logging.info(f"Download over https: {job.source}")
+            return download_file_over_https(job.source, job.target).md5
+        else:
+            logging.info(f"Download from bucket: {job.source}")
+            download_bucket_file(job.source, job.target)
+            return get_md5_of_file(job.target)
+
+    @classmethod
+    def _read_checksum_manifest(cls, checksum_manifest_path: Path) -> Dict[str, str]:
+        file_name_to_md5: Dict[str, str] = {}
+        if checksum_manifest_path.exists():
+            with open(checksum_manifest_path, "r") as f:
+                for line in f:
+                    if line.strip():
+                        md5, file_name = line.rstrip("\n").split("  ", 1)
+                        file_name_to_md5[file_name] = md5
+        return file_name_to_md5
+
+    @classmethod
+    def _write_checksum_manifest(cls, file_name_to_md5: Dict[str, str], checksum_manifest_path: Path) -> None:
+        checksum_manifest_text = "".join(
+            f"{md5}  {file_name}\n" for file_name, md5 in sorted(file_name_to_md5.items())
+        )
+        with open(get_temp_path(checksum_manifest_path), "w") as f:
+            f.write(checksum_manifest_text)
+        make_temp_version_final(checksum_manifest_path)
+
+    @classmethod
+    def _get_file_stat(cls, path: Path, md5: str) -> FileStat:
+        stat_result = path.stat()
+        return FileStat(stat_result.st_size, stat_result.st_mtime_ns, md5)
+
+    @classmethod
+    def _read_file_stats(cls, file_stats_path: Path) -> Dict[str, FileStat]:
+        file_name_to_stat: Dict[str, FileStat] = {}
+        if file_stats_path.exists():
+            with open(file_stats_path, "r") as f:
+                for line in f:
+                    if line.strip():
+                        file_name, size, mtime_ns, md5 = line.rstrip("\n").split("\t")
+                        file_name_to_stat[file_name] = FileStat(int(size), int(mtime_ns), md5)
+        return file_name_to_stat
+
+    @classmethod
+    def _write_file_stats(cls, file_name_to_md5: Dict[str, str], target_dir: Path, file_stats_path: Path) -> None:
+        # Records the size and modification time of each file whose checksum is known, so reruns can skip hashing it
+        lines = []
+        for file_name, md5 in sorted(file_name_to_md5.items()):
+            if (target_dir / file_name).exists():
+                file_stat = cls._get_file_stat(target_dir / file_name, md5)
+                lines.append(f"{file_name}\t{file_stat.size}\t{file_stat.mtime_ns}\t{md5}\n")
+        with open(get_temp_path(file_stats_path), "w") as f:
+            f.write("".join(lines))
+        make_temp_version_final(file_stats_path)
+
     @classmethod
     def _write_local_sources_list_file(
             cls, download_jobs: List[DownloadJob], local_sources_list_file_path: Path,
@@ -0,0 +1,133 @@
+import argparse
+import logging
+import os
+import sys
+from pathlib import Path
+from typing import List, NamedTuple
+
+from ref_lib.contig_name_translation import ContigNameTranslator
+from ref_lib.contig_renaming import ContigRenamer, VcfContigRenamer, AlignmentHeaderContigRenamer, is_vcf_path, \
+    is_alignment_path
+from ref_lib.ref_util import set_up_logging, assert_file_exists, ALIAS_TO_CANONICAL_CONTIG_NAME_FILE_NAME
+
+SCRIPT_NAME = "rename_contigs"
+
+
+class Config(NamedTuple):
+    input_path: Path
+    output_path: Path
+    contig_alias_path: Path
+    keep_unknown_names: bool
+    create_index: bool
+    threads: int
+
+
+def main(config: Config) -> None:
+    set_up_logging()
+
+    logging.info(f"Starting {SCRIPT_NAME}.")
+
+    logging.info(f"Config values:\n{config}")
+
+    # Sanity checks
+    assert_file_exists(config.input_path)
+    assert_file_exists(config.contig_alias_path)
+    if config.output_path.exists():
+        raise ValueError(f"Output file already exists: {config.output_path}")
+
+    contig_name_translator = ContigNameTranslator.from_contig_alias_file(config.contig_alias_path)
+    contig_renamer = ContigRenamer(contig_name_translator, config.keep_unknown_names)
+
+    if is_vcf_path(config.input_path):
+        VcfContigRenamer.rename_contigs(
+            config.input_path, config.output_path, contig_renamer, config.threads, config.create_index,
+        )
+    elif is_alignment_path(config.input_path):
+        if config.create_index:
+            raise ValueError("Indexing is only supported for VCF output. Use samtools index for BAM and CRAM.")
+        AlignmentHeaderContigRenamer.rename_contigs(config.input_path, config.output_path, contig_renamer)
+    else:
+        raise ValueError(f"Unrecognized input file type: {config.input_path}")
+
+    logging.info(f"Finished {SCRIPT_NAME}.")
+
+
+def parse_args(sys_args: List[str]) -> Config:
+    parser = argparse.ArgumentParser(
+        prog=f"{SCRIPT_NAME}",
+        description=(
+            "Rename contigs in a VCF file, or in the header of a BAM or CRAM file, to their canonical names, "
+            "like 'chr1'. VCF output is BGZF-compressed."
+        ),
+    )
+    parser.add_argument(
+        "--input",
+        "-i",
+        type=Path,
+        required=True,
+        help="Path to input VCF (optionally gzipped), BAM or CRAM file.",
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        type=Path,
+        required=True,
+        help="Path to output file. For VCF input, this should end with '.vcf.gz'.",
+    )
+    parser.add_argument(
+        "--contig_alias_file",
+        "-a",
+        type=Path,
+        required=True,
+        help=(
+            f"Path to {ALIAS_TO_CANONICAL_CONTIG_NAME_FILE_NAME} file, "
+            f"as created in the working dir of create_hmf_ref_genome_fasta or check_ref_genome_features."
+        ),
+    )
+    parser.add_argument(
+        "--keep_unknown_names",
+        help="Optional argument. Keep names of contigs that are not in the alias file, instead of failing.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--index",
+        help="Optional argument. Create tabix index for output VCF.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--threads",
+        "-t",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Optional argument. Number of compression threads for bgzip, if it is available. Default is all cores.",
+    )
+    parser.add_argument(
+        "--venv_dir",
+        "-v",
+        type=Path,
+        default=None,
+        help="Optional argument. Directory to use for a Python venv. If not provided, no venv is used.",
+    )  # Does nothing. Should be caught and used in shell script already.
+
+    args = parser.parse_args(sys_args)
+
+    if args.venv_dir is not None:
+        error_msg = (
+            f"Venv argument should be caught and used in the wrapping shell script, "
+            f"not in the Python script itself: {args.venv_dir}"
+        )
+        raise SyntaxError(error_msg)
+
+    config = Config(
+        args.input,
+        args.output,
+        args.contig_alias_file,
+        args.keep_unknown_names,
+        args.index,
+        args.threads,
+    )
+    return config
+
+
+if __name__ == "__main__":
+    main(parse_args(sys.argv[1:]))
@@ -0,0 +1,157 @@
+import gzip
+import hashlib
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import List, Optional, Iterator, Tuple
+
+from ref_lib.ref_util import download_file_over_https, get_temp_path, bucket_prefix_has_blobs
+
+UNCOMPRESSED_CONTENT = b"".join(f">chr{i}\nACGTNacgtn\n".encode("utf-8") for i in range(10000))
+# Multi-member gzip data, like files compressed with bgzip
+COMPRESSED_CONTENT = gzip.compress(UNCOMPRESSED_CONTENT[:50000]) + gzip.compress(UNCOMPRESSED_CONTENT[50000:])
+ETAG = '"version1"'
+
+
+class StubFileHandler(BaseHTTPRequestHandler):
+    """Serves gzipped content with support for Range and If-Range headers, and records the Range headers."""
+    range_headers: List[Optional[str]] = []
+
+    def do_GET(self) -> None:
+        # The truncated file ends in the middle of a gzip member
+        full_content = COMPRESSED_CONTENT[:-100] if self.path.endswith("/truncated.fa.gz") else COMPRESSED_CONTENT
+        range_header = self.headers.get("Range")
+        self.range_headers.append(range_header)
+        if range_header is not None and self.headers.get("If-Range") == ETAG:
+            start = int(range_header[len("bytes="):-1])
+            content = full_content[start:]
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{len(full_content) - 1}/{len(full_content)}")
+        else:
+            content = full_content
+            self.send_response(200)
+        self.send_header("ETag", ETAG)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+
+class FakeBlob(object):
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+
+class FakeBlobIterator(object):
+    """Fetches pages of blob names lazily, like the iterator of the storage client, and counts the page fetches."""
+    PAGE_SIZE = 1000
+
+    def __init__(self, names: List[str], max_results: Optional[int]) -> None:
+        self.names = names
+        self.max_results = max_results
+        self.page_fetch_count = 0
+
+    def __iter__(self) -> Iterator[FakeBlob]:
+        limit = len(self.names) if self.max_results is None else min(self.max_results, len(self.names))
+        for page_start in range(0, limit, self.PAGE_SIZE):
+            self.page_fetch_count += 1
+            for name in self.names[page_start:min(page_start + self.PAGE_SIZE, limit)]:
+                yield FakeBlob(name)
+
+
+class FakeStorageClient(object):
+    def __init__(self, names: List[str]) -> None:
+        self.names = names
+        self.list_blobs_calls: List[Tuple[str, str, Optional[int]]] = []
+        self.iterators: List[FakeBlobIterator] = []
+
+    def list_blobs(self, bucket_name: str, prefix: str, max_results: Optional[int] = None) -> FakeBlobIterator:
+        self.list_blobs_calls.append((bucket_name, prefix, max_results))
+        iterator = FakeBlobIterator([name for name in self.names if name.startswith(prefix)], max_results)
+        self.iterators.append(iterator)
+        return iterator
+
+
+class TestBucketPrefixHasBlobs(unittest.TestCase):
+    def setUp(self) -> None:
+        self.client = FakeStorageClient([f"ref/38/file_{i}" for i in range(50000)])
+
+    def test_prefix_with_many_blobs_takes_single_page_fetch(self) -> None:
+        self.assertTrue(bucket_prefix_has_blobs(self.client, "gs://bucket/ref/38"))
+        self.assertEqual([("bucket", "ref/38", 1)], self.client.list_blobs_calls)
+        self.assertEqual(1, self.client.iterators[0].page_fetch_count)
+
+    def test_prefix_without_blobs(self) -> None:
+        self.assertFalse(bucket_prefix_has_blobs(self.client, "gs://bucket/ref/37"))
+        self.assertEqual([("bucket", "ref/37", 1)], self.client.list_blobs_calls)
+
+
+class TestDownloadFileOverHttps(unittest.TestCase):
+    def setUp(self) -> None:
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubFileHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        StubFileHandler.range_headers = []
+        self.source = f"http://127.0.0.1:{self.server.server_port}/file.fa.gz"
+        self.working_dir = tempfile.TemporaryDirectory()
+        self.target = Path(self.working_dir.name) / "file.fa.gz"
+        self.decompressed_target = Path(self.working_dir.name) / "file.fa"
+
+    def tearDown(self) -> None:
+        self.working_dir.cleanup()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_download_computes_checksums_and_decompresses_in_same_pass(self) -> None:
+        checksums = download_file_over_https(
+            self.source, self.target, compute_sha256=True, decompressed_target=self.decompressed_target,
+        )
+
+        self.assertEqual(COMPRESSED_CONTENT, self.target.read_bytes())
+        self.assertEqual(UNCOMPRESSED_CONTENT, self.decompressed_target.read_bytes())
+        self.assertEqual(hashlib.md5(COMPRESSED_CONTENT).hexdigest(), checksums.md5)
+        self.assertEqual(hashlib.sha256(COMPRESSED_CONTENT).hexdigest(), checksums.sha256)
+        self.assertEqual([None], StubFileHandler.range_headers)
+
+    def test_sha256_and_decompression_are_optional(self) -> None:
+        checksums = download_file_over_https(self.source, self.target)
+
+        self.assertEqual(hashlib.md5(COMPRESSED_CONTENT).hexdigest(), checksums.md5)
+        self.assertIsNone(checksums.sha256)
+        self.assertFalse(self.decompressed_target.exists())
+
+    def test_interrupted_download_is_resumed(self) -> None:
+        download_file_over_https(self.source, self.target)
+        self.target.rename(get_temp_path(self.target))
+        resume_position = len(COMPRESSED_CONTENT) // 2
+        with open(get_temp_path(self.target), "r+b") as f:
+            f.truncate(resume_position)
+        Path(f"{get_temp_path(self.target)}.validator").write_text(ETAG)
+        StubFileHandler.range_headers = []
+
+        checksums = download_file_over_https(
+            self.source, self.target, compute_sha256=True, decompressed_target=self.decompressed_target,
+        )
+
+        self.assertEqual([f"bytes={resume_position}-"], StubFileHandler.range_headers)
+        self.assertEqual(COMPRESSED_CONTENT, self.target.read_bytes())
+        self.assertEqual(UNCOMPRESSED_CONTENT, self.decompressed_target.read_bytes())
+        self.assertEqual(hashlib.sha256(COMPRESSED_CONTENT).hexdigest(), checksums.sha256)
+
+    def test_truncated_gzip_data_is_not_made_final(self) -> None:
+        with self.assertRaises(ValueError):
+            download_file_over_https(
+                self.source.replace("file.fa.gz", "truncated.fa.gz"), self.target,
+                decompressed_target=self.decompressed_target,
+            )
+
+        self.assertFalse(self.target.exists())
+        self.assertFalse(self.decompressed_target.exists())
+        self.assertFalse(get_temp_path(self.decompressed_target).exists())
+
+
+if __name__ == "__main__":
+    unittest.main()